@@ -58,10 +58,12 @@ router.post("/", auth, (req, res) => {
 
       await db.collection("files").insertOne(fileRec);
 
-      // Call Python service to process the file
+      // Queue the file with the Python service; it returns a job id at once
+      // and processes the file in the background (see GET /api/files/:id/status)
       const pythonUrl = (
         process.env.PYTHON_RAG_URL || "http://localhost:8000"
       ).replace(/\/$/, "");
+      let jobId = null;
       try {
         const resp = await fetch(`${pythonUrl}/process-file`, {
           method: "POST",
@@ -79,6 +81,19 @@ router.post("/", auth, (req, res) => {
             resp.status
           }, body=${text.slice(0, 200)}`
         );
+        try {
+          jobId = JSON.parse(text).job_id || null;
+        } catch {
+          jobId = null;
+        }
+        if (jobId) {
+          await db
+            .collection("files")
+            .updateOne(
+              { id: fileRec.id },
+              { $set: { processingJobId: jobId } }
+            );
+        }
       } catch (err) {
         console.warn("Failed to call python service:", err.message);
       }
@@ -89,6 +104,7 @@ router.post("/", auth, (req, res) => {
           id: fileRec.id,
           name: fileRec.originalName,
           url: `/uploads/${fileRec.filename}`,
+          jobId,
         },
       });
     } catch (err) {
@@ -164,6 +180,51 @@ router.get("/:id", auth, async (req, res) => {
   }
 });
 
+/**
+ * GET /api/files/:id/status
+ * Returns the processing job of a file (stage, progress, error)
+ */
+router.get("/:id/status", auth, async (req, res) => {
+  try {
+    const db = getDb();
+    const file = await db
+      .collection("files")
+      .findOne({ id: req.params.id, ownerId: req.user.id });
+    if (!file) return res.status(404).json({ message: "File not found" });
+    if (!file.processingJobId) {
+      return res.json({ job: null });
+    }
+
+    const pythonUrl = (
+      process.env.PYTHON_RAG_URL || "http://localhost:8000"
+    ).replace(/\/$/, "");
+    const resp = await fetch(
+      `${pythonUrl}/jobs/${encodeURIComponent(file.processingJobId)}`
+    );
+    if (!resp.ok) {
+      return res
+        .status(resp.status === 404 ? 404 : 502)
+        .json({ message: "Processing job not available" });
+    }
+    const job = await resp.json();
+    return res.json({
+      job: {
+        id: job.id,
+        status: job.status,
+        stage: job.stage,
+        progress: job.progress,
+        error: job.error,
+        updatedAt: job.updatedAt,
+      },
+    });
+  } catch (err) {
+    console.error(err);
+    return res
+      .status(500)
+      .json({ message: "Failed to fetch processing status" });
+  }
+});
+
 /**
  * DELETE /api/files/:id
  * Deletes file record, chunks, and vectors
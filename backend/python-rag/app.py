@@ -1,9 +1,14 @@
 # python-rag/app.py
 import os
 import uuid
+import hashlib
 import logging
+import time
 import requests
-from typing import List, Optional, Dict, Any
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple, Callable
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -12,18 +17,80 @@ from dotenv import load_dotenv
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-from utils.file_processing import extract_text_simple
+from utils.file_processing import iter_text_sections
 from utils.vector_store import (
     add_texts_to_store,
-    search_store,
+    embed_chunks,
+    pack_vector,
+    search_store_batch,
     load_all_stores,
     list_loaded_owner_ids,
+    cache_stats,
+    start_persister,
+    stop_persister,
+    VECTOR_PRELOAD,
     delete_file_from_store,
+    delete_chunks_from_store,
+    renumber_chunks_in_store,
     debug_store_stats,
     debug_search_owner,
 )
+from utils.lexical_index import (
+    add_chunks as lexical_add_chunks,
+    delete_file as lexical_delete_file,
+    lexical_stats,
+)
+from utils.retrieval import retrieve, resolve_mode, resolve_file_filter
 from utils.mongo_client import get_db
+from utils.jobs import (
+    JobContext,
+    JobCancelled,
+    JobLost,
+    submit as submit_job,
+    get_job,
+    cancel_file_jobs,
+    register_handler as register_job_handler,
+    start_workers as start_job_workers,
+    stop_workers as stop_job_workers,
+    job_stats,
+)
+from utils.embeddings import (
+    MODEL_NAME as EMBEDDING_MODEL_NAME,
+    cache_stats as embedding_cache_stats,
+    query_batch_stats,
+)
+from utils.embedding_pool import (
+    start_pool as start_embedding_pool,
+    stop_pool as stop_embedding_pool,
+    pool_stats as embedding_pool_stats,
+)
+from utils.artifacts import (
+    file_sha256,
+    chunk_set_key,
+    find_chunk_set,
+    claim_chunk_set,
+    add_chunks as add_artifact_chunks,
+    finish_chunk_set,
+    release_chunk_set,
+    iter_chunk_set,
+    add_ref as add_artifact_ref,
+    release_refs as release_artifact_refs,
+    delete_chunk_sets,
+    artifact_stats,
+)
+from utils.text_store import (
+    TextWriter,
+    text_id,
+    get_text,
+    iter_text,
+    page_at,
+    chunk_texts,
+    delete_texts,
+    text_stats,
+)
+from utils.ocr_pool import start_pool as start_ocr_pool, stop_pool as stop_ocr_pool, pool_stats as ocr_pool_stats
 
+from pymongo import UpdateOne
 import uvicorn
 
 load_dotenv()  # load .env if present
@@ -34,6 +101,20 @@ logger = logging.getLogger("python-rag")
 app = FastAPI()
 db = get_db()
 
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "256"))
+# ingestion embeds and stores a file's chunks this many at a time
+INGEST_BATCH_CHUNKS = int(os.environ.get("INGEST_BATCH_CHUNKS", "256"))
+# the streaming chunker re-splits its buffer once it holds this many chunks' worth of text
+CHUNK_BUFFER_CHUNKS = 8
+# part of the artifact keys (utils/artifacts.py): bump when chunking changes
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+CHUNKER_VERSION = f"recursive-{CHUNK_SIZE}-{CHUNK_OVERLAP}-v1"
+# bulk ingestion (/process-files, import_dir.py): files extracted in parallel, and
+# chunks pooled across files per embedding batch / FAISS add / Mongo bulk insert
+INGEST_EXTRACT_WORKERS = int(os.environ.get("INGEST_EXTRACT_WORKERS", "4"))
+BULK_BATCH_CHUNKS = int(os.environ.get("BULK_BATCH_CHUNKS", "1024"))
+
 OPENAI_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
@@ -91,6 +172,119 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[st
     return splitter.split_text(text)
 
 
+def chunk_hash(text: str) -> str:
+    """Content hash of a chunk (the `textHash` of a chunks document), used to diff re-ingestions."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_chunk_spans(
+    sections: Iterable[str], chunk_size: int = 1200, overlap: int = 200
+) -> Iterator[Tuple[Optional[int], Optional[int], str]]:
+    """
+    chunk_text over a stream of text pieces (see iter_text_sections), yielding each
+    chunk as (start, end, text) with offsets into the concatenated pieces. The buffer
+    is split whenever it holds CHUNK_BUFFER_CHUNKS chunks' worth of text; all but the
+    last chunk are emitted and splitting resumes at the start of that last chunk, so
+    chunks span piece boundaries and match chunk_text on the whole text almost always.
+    start/end are None for a chunk that cannot be found verbatim in the text.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=overlap,
+        separators=["\n\n", "\n", " ", ""],
+    )
+    buffer = ""
+    base: Optional[int] = 0  # offset of buffer[0] in the text
+
+    def located(chunks: List[str]) -> Iterator[Tuple[Optional[int], Optional[int], str]]:
+        # chunks are stripped substrings of the buffer, in order
+        pos = 0
+        for chunk in chunks:
+            i = buffer.find(chunk, pos)
+            if i < 0 or base is None:
+                yield None, None, chunk
+                continue
+            yield base + i, base + i + len(chunk), chunk
+            pos = i + 1
+
+    for piece in sections:
+        buffer += piece
+        if len(buffer) < chunk_size * CHUNK_BUFFER_CHUNKS:
+            continue
+        chunks = splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+        tail = buffer.rfind(chunks[-1])
+        yield from located(chunks[:-1])
+        if tail > 0:
+            base = None if base is None else base + tail
+            buffer = buffer[tail:]
+        else:
+            base, buffer = None, chunks[-1]
+    if buffer.strip():
+        yield from located(splitter.split_text(buffer))
+
+
+# (textId, start, end, page) of a chunk in the text store; start/end None: the chunk keeps its text
+ChunkRef = Tuple[Optional[str], Optional[int], Optional[int], Optional[int]]
+_NO_REF: ChunkRef = (None, None, None, None)
+
+
+class _TextSource:
+    """
+    A file's extracted text for the chunker (see utils/text_store.py): read back from
+    the text store when it is there, else extracted and stored as it is read. Chunks
+    refer to it by offset; sync() before storing chunks, close() when done with it,
+    whether or not it was read to the end.
+    """
+
+    def __init__(
+        self,
+        sha256: str,
+        path: str,
+        owner_id: str,
+        on_page: Optional[Callable[[int, int, Dict[str, Any]], None]] = None,
+    ):
+        self.tid = text_id(sha256)
+        self.writer: Optional[TextWriter] = None
+        self.complete = False
+        header = get_text(self.tid)
+        if header is not None:
+            self.pages: List[List[int]] = header.get("pages") or []
+            self.sections: Iterator[str] = iter_text(self.tid)
+            return
+        # a new text is compressed with its first owner's dictionary
+        writer = self.writer = TextWriter(self.tid, owner_id=owner_id)
+        self.pages = writer.pages
+
+        def page(done: int, total: int, info: Dict[str, Any]):
+            # called just before the page's text comes through
+            writer.mark_page(info["page"])
+            if on_page is not None:
+                on_page(done, total, info)
+
+        self.sections = self._read(writer.tee(iter_text_sections(path, on_page=page)))
+
+    def _read(self, sections: Iterator[str]) -> Iterator[str]:
+        yield from sections
+        self.complete = True
+
+    def ref(self, start: Optional[int], end: Optional[int]) -> ChunkRef:
+        if start is None:
+            return _NO_REF
+        return (self.tid, start, end, page_at(self.pages, start))
+
+    def sync(self):
+        if self.writer is not None:
+            self.writer.sync()
+
+    def close(self):
+        """Release the file (or stored text) being read; a new text is kept only if it was read to the end."""
+        self.sections.close()
+        if self.writer is not None and self.complete:
+            self.writer.close()
+
+
 # Schemas
 class ProcessFilePayload(BaseModel):
     file_id: str
@@ -99,6 +293,17 @@ class ProcessFilePayload(BaseModel):
     original_name: Optional[str]
 
 
+class BulkFilePayload(BaseModel):
+    file_id: str
+    path: str
+    original_name: Optional[str] = None
+
+
+class ProcessFilesPayload(BaseModel):
+    owner_id: str
+    files: List[BulkFilePayload]
+
+
 class DeletePayload(BaseModel):
     file_id: str
     owner_id: str
@@ -108,6 +313,23 @@ class QueryPayload(BaseModel):
     query: str
     scope: Optional[str] = "mydata+general"
     owner_id: str
+    retrieval_mode: Optional[str] = None  # vector | lexical | hybrid (default: RETRIEVAL_MODE env)
+    # restrict retrieval to some of the owner's files (applied inside the index search)
+    file_ids: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    file_types: Optional[List[str]] = None  # mime types ("application/pdf", "image/*") or extensions ("pdf")
+    # recall knobs for owners whose store was promoted to HNSW / IVF (ignored on flat)
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
+
+
+class SearchBatchPayload(BaseModel):
+    owner_id: str
+    queries: List[str]
+    top_k: int = 6
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
 
 
 class ChatPayload(BaseModel):
@@ -118,20 +340,46 @@ class ChatPayload(BaseModel):
     max_tokens: int = 300
     scope: Optional[str] = "mydata+general"
     selected_models: Optional[List[str]] = None  # ["openai","gemini"]
+    retrieval_mode: Optional[str] = None  # vector | lexical | hybrid
+    file_ids: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    file_types: Optional[List[str]] = None
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
 
 
 @app.on_event("startup")
 def on_startup_load_vectorstores():
+    start_persister()
+    start_embedding_pool()
+    start_ocr_pool()
+    start_job_workers()
+    # stores load lazily on first access; VECTOR_PRELOAD only warms the LRU cache
+    if not VECTOR_PRELOAD:
+        logger.info("Vector stores will be loaded on demand.")
+        return
     try:
         loaded = load_all_stores()
         if loaded:
-            logger.info("Loaded vector stores for owners: %s", ", ".join(loaded))
+            logger.info("Preloaded vector stores for owners: %s", ", ".join(loaded))
         else:
             logger.info("No existing vector stores found on disk.")
     except Exception as e:
         logger.exception("Failed to load vector stores on startup: %s", e)
 
 
+@app.on_event("shutdown")
+def on_shutdown_flush_vectorstores():
+    stop_job_workers()
+    try:
+        stop_persister()
+    except Exception as e:
+        logger.exception("Failed to flush vector stores on shutdown: %s", e)
+    stop_embedding_pool()
+    stop_ocr_pool()
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
@@ -140,69 +388,797 @@ def health():
 @app.get("/vector-stores")
 def vector_stores():
     try:
-        return {"loaded": list_loaded_owner_ids()}
+        return {
+            "loaded": list_loaded_owner_ids(),
+            "cache": cache_stats(),
+            "lexical": lexical_stats(),
+            "embedding_cache": embedding_cache_stats(),
+            "query_batching": query_batch_stats(),
+            "embedding_pool": embedding_pool_stats(),
+            "ocr_pool": ocr_pool_stats(),
+            "jobs": job_stats(),
+            "artifacts": artifact_stats(),
+            "texts": text_stats(),
+        }
     except Exception as e:
         logger.exception("Error listing vector stores: %s", e)
         raise HTTPException(status_code=500, detail="failed to list vector stores")
 
 
+def _submit_file_job(kind: str, payload: ProcessFilePayload) -> Dict[str, Any]:
+    if not os.path.exists(payload.path):
+        raise HTTPException(status_code=400, detail="file not found on server")
+    try:
+        job = submit_job(kind, payload.dict(), owner_id=payload.owner_id, file_id=payload.file_id)
+    except Exception as e:
+        logger.exception("Failed to queue file %s: %s", payload.file_id, e)
+        raise HTTPException(status_code=500, detail="failed to queue file for processing")
+    return {"ok": True, "job_id": job["id"], "status": job["status"]}
+
+
 @app.post("/process-file")
 def process_file(payload: ProcessFilePayload):
+    """Queue the file for ingestion and return at once; poll /jobs/{job_id} for progress."""
+    return _submit_file_job("process-file", payload)
+
+
+@app.post("/process-files")
+def process_files(payload: ProcessFilesPayload):
+    """
+    Queue many files of one owner as a single bulk job (see ingest_files); poll
+    /jobs/{job_id} for files/s and chunks/s. Paths that do not exist are returned in
+    `missing` and not queued.
+    """
+    present = [f for f in payload.files if os.path.exists(f.path)]
+    missing = [f.file_id for f in payload.files if not os.path.exists(f.path)]
+    if not present:
+        raise HTTPException(status_code=400, detail="no file found on server")
+    files = [
+        ProcessFilePayload(
+            file_id=f.file_id, owner_id=payload.owner_id, path=f.path, original_name=f.original_name
+        ).dict()
+        for f in present
+    ]
+    try:
+        job = submit_job(
+            "process-files", {"files": files}, owner_id=payload.owner_id, file_ids=[f["file_id"] for f in files]
+        )
+    except Exception as e:
+        logger.exception("Failed to queue %d files for %s: %s", len(files), payload.owner_id, e)
+        raise HTTPException(status_code=500, detail="failed to queue files for processing")
+    return {"ok": True, "job_id": job["id"], "status": job["status"], "files": len(files), "missing": missing}
+
+
+@app.post("/reprocess-file")
+def reprocess_file(payload: ProcessFilePayload):
+    """
+    Queue re-ingestion of an already processed file whose content changed (same
+    file_id, new bytes at path). Only new or changed chunks are embedded; the job
+    result reports how many chunks were kept, added and removed.
+    """
+    return _submit_file_job("reprocess-file", payload)
+
+
+def _chunk_doc(chunk_id: str, payload: ProcessFilePayload, chunk_index: int, text: str, ref: ChunkRef) -> Dict[str, Any]:
+    doc: Dict[str, Any] = {"id": chunk_id, "fileId": payload.file_id, "ownerId": payload.owner_id}
+    tid, start, end, page = ref
+    if start is None:
+        doc["text"] = text
+    else:
+        # the text itself is sliced from the file's text on demand
+        doc.update(textId=tid, start=start, end=end)
+    if page is not None:
+        doc["page"] = page
+    doc["textHash"] = chunk_hash(text)
+    doc["chunkIndex"] = chunk_index
+    return doc
+
+
+def _store_chunks(entries: List[Tuple[ProcessFilePayload, int, str, ChunkRef]], vectors: np.ndarray) -> List[str]:
+    """
+    Store embedded chunks, given as (file, chunkIndex, text, ref) in the order of
+    vectors and from any number of files and owners: one FAISS add per owner, one
+    unordered Mongo bulk insert, one lexical index update per file. A chunk with
+    offsets into the text store keeps no text of its own, in Mongo or in FAISS.
+    Returns the new chunk ids, in order.
+    """
+    # chunk ids double as docstore ids so the vectors can be deleted per file
+    chunk_ids = [str(uuid.uuid4()) for _ in entries]
+    by_owner: Dict[str, List[int]] = {}
+    for i, (payload, _, _, _) in enumerate(entries):
+        by_owner.setdefault(payload.owner_id, []).append(i)
+
+    for owner_id, positions in by_owner.items():
+        metas = [
+            {
+                "fileId": entries[i][0].file_id,
+                "ownerId": owner_id,
+                "chunkIndex": entries[i][1],
+                "chunkId": chunk_ids[i],
+                "originalName": entries[i][0].original_name or "",
+            }
+            for i in positions
+        ]
+        try:
+            count_after = add_texts_to_store(
+                owner_id=owner_id,
+                texts=[entries[i][2] if entries[i][3][1] is None else "" for i in positions],
+                metadatas=metas,
+                ids=[chunk_ids[i] for i in positions],
+                vectors=vectors[positions],
+            )
+            logger.debug(
+                "Added %d chunks to vector store for owner %s (count after: %s)", len(positions), owner_id, count_after
+            )
+        except Exception as e:
+            logger.exception("Failed to add texts to vector store: %s", e)
+            raise RuntimeError("vector store update failed")
+
+    docs = [
+        dict(
+            _chunk_doc(chunk_ids[i], payload, chunk_index, text, ref),
+            embedding=pack_vector(vectors[i]),
+            embeddingModel=EMBEDDING_MODEL_NAME,
+        )
+        for i, (payload, chunk_index, text, ref) in enumerate(entries)
+    ]
+    try:
+        db.chunks.insert_many(docs, ordered=False)
+    except Exception as e:
+        logger.exception("Failed to insert chunks into Mongo: %s", e)
+        raise RuntimeError("vectors stored but failed to save chunks metadata")
+
+    by_file: Dict[Tuple[str, str], List[int]] = {}
+    for i, (payload, _, _, _) in enumerate(entries):
+        by_file.setdefault((payload.owner_id, payload.file_id), []).append(i)
+    for (owner_id, file_id), positions in by_file.items():
+        try:
+            lexical_add_chunks(
+                owner_id,
+                file_id,
+                [entries[i][2] for i in positions],
+                [chunk_ids[i] for i in positions],
+                [entries[i][1] for i in positions],
+            )
+        except Exception as e:
+            logger.exception("Failed to update lexical index: %s", e)
+    return chunk_ids
+
+
+def _ingest_batch(
+    payload: ProcessFilePayload,
+    chunks: List[str],
+    first_index: int,
+    vectors: Optional[np.ndarray] = None,
+    refs: Optional[List[ChunkRef]] = None,
+) -> np.ndarray:
+    """
+    Embed one batch of a file's chunks (unless vectors are given) and store it: FAISS,
+    Mongo, lexical index. refs place the chunks in the text store (else they keep
+    their text). Returns the vectors.
+    """
+    # embed once; the same vectors go into FAISS and into Mongo for future rebuilds
+    if vectors is None:
+        vectors = embed_chunks(chunks)
+    refs = refs or [_NO_REF] * len(chunks)
+    _store_chunks([(payload, first_index + i, c, refs[i]) for i, c in enumerate(chunks)], vectors)
+    return vectors
+
+
+def _iter_artifact_chunks(artifact: Dict[str, Any]) -> Iterator[Tuple[List[str], List[ChunkRef], np.ndarray]]:
+    """A stored chunk set as (texts, refs, vectors), INGEST_BATCH_CHUNKS at a time."""
+    tid = artifact.get("textId") or text_id(artifact.get("sha256") or "")
+    for records, vectors in iter_chunk_set(artifact["key"], INGEST_BATCH_CHUNKS):
+        for r in records:
+            r["textId"] = tid
+        refs = [(tid, r["start"], r["end"], r.get("page")) if r.get("start") is not None else _NO_REF for r in records]
+        yield chunk_texts(records), refs, vectors
+
+
+def _link_chunk_set(payload: ProcessFilePayload, artifact: Dict[str, Any], ctx: JobContext) -> int:
+    """Add a stored chunk set (offsets and vectors) to the owner's index; nothing is embedded."""
+    count = 0
+    for texts, refs, vectors in _iter_artifact_chunks(artifact):
+        ctx.check_cancelled()
+        _ingest_batch(payload, texts, count, vectors=vectors, refs=refs)
+        count += len(texts)
+        ctx.update(chunks=count)
+    ctx.check_cancelled()
+    return count
+
+
+def _process_file_job(data: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    """
+    Stream the file through extraction -> chunking -> embedding -> storage. Chunks are
+    stored INGEST_BATCH_CHUNKS at a time, so memory stays flat on large files and the
+    first batches are searchable while the rest of the file is still being read.
+    """
+    payload = ProcessFilePayload(**data)
     p = payload.path
     if not os.path.exists(p):
-        raise HTTPException(status_code=400, detail="file not found on server")
+        raise RuntimeError("file not found on server")
+
+    if ctx.resumed:
+        # an interrupted attempt may have stored part of this file: start from a clean slate
+        ctx.stage("cleanup")
+        _delete_file_data(payload.file_id, payload.owner_id, release_refs=False)
+
+    try:
+        return _ingest_file(payload, ctx)
+    except JobLost:
+        # the attempt that took over cleans up and stores the file
+        raise
+    except Exception:
+        # failed or cancelled (the file was deleted): none of its batches stay searchable
+        try:
+            _delete_file_data(payload.file_id, payload.owner_id)
+        except Exception as e:
+            logger.exception("Failed to remove the partly stored file %s: %s", payload.file_id, e)
+        raise
 
-    text = extract_text_simple(p)
-    if not text:
-        logger.info("No extractable text for %s", p)
-        return {"ok": True, "message": "no text extracted"}
-
-    chunks = chunk_text(text, chunk_size=1200, overlap=200)
-    if not chunks:
-        return {"ok": True, "message": "no chunks"}
-
-    metas = [
-        {
-            "fileId": payload.file_id,
-            "ownerId": payload.owner_id,
-            "chunkIndex": i,
-            "originalName": payload.original_name or "",
-        }
-        for i in range(len(chunks))
-    ]
 
+def _ingest_file(payload: ProcessFilePayload, ctx: JobContext) -> Dict[str, Any]:
+    """The body of _process_file_job; stops at the first batch after the job is cancelled."""
+    p = payload.path
+    # a file seen before (any owner) with the same extractor, chunker and model
+    sha256 = file_sha256(p)
+    add_artifact_ref(sha256, payload.owner_id, payload.file_id)
+    key = chunk_set_key(sha256, CHUNKER_VERSION, EMBEDDING_MODEL_NAME)
+    artifact = find_chunk_set(key)
+    if artifact is not None:
+        ctx.stage("linking", chunks=0, chunksTotal=artifact.get("count", 0), reused=True)
+        count = _link_chunk_set(payload, artifact, ctx)
+        ctx.update(chunks=count)
+        logger.info("Linked %d stored chunks of %s (sha256 %s)", count, payload.original_name, sha256[:12])
+        return {"ok": True, "count": count, "pages": artifact.get("pages") or [], "reused": True}
+
+    # per-page extraction method and timing (PDFs), kept on the job result
+    page_stats: List[Dict[str, Any]] = []
+    methods: Dict[str, int] = {}
+
+    def on_page(done: int, total: int, info: Dict[str, Any]):
+        page_stats.append(info)
+        methods[info["method"]] = methods.get(info["method"], 0) + 1
+        ctx.update(pages=done, pagesTotal=total, methods=dict(methods))
+
+    # only one job at a time records the chunk set; others just ingest
+    claimed = claim_chunk_set(
+        key,
+        ctx.job_id,
+        sha256=sha256,
+        textId=text_id(sha256),
+        chunker=CHUNKER_VERSION,
+        model=EMBEDDING_MODEL_NAME,
+    )
+    storing, complete = claimed, False
+    count = 0
+    source: Optional[_TextSource] = None
     try:
-        count_after = add_texts_to_store(owner_id=payload.owner_id, texts=chunks, metadatas=metas)
+        ctx.stage("processing", chunks=0)
+        source = _TextSource(sha256, p, payload.owner_id, on_page=on_page)
+        batch: List[Tuple[Optional[int], Optional[int], str]] = []
+
+        def store():
+            nonlocal storing
+            ctx.check_cancelled()
+            # the chunks point into the text read so far: make it readable first
+            source.sync()
+            texts = [t for _, _, t in batch]
+            refs = [source.ref(start, end) for start, end, _ in batch]
+            vectors = _ingest_batch(payload, texts, count, refs=refs)
+            if storing:
+                storing = add_artifact_chunks(key, count, [r[1:] for r in refs], texts, vectors)
+
+        for span in iter_chunk_spans(source.sections, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+            batch.append(span)
+            if len(batch) >= INGEST_BATCH_CHUNKS:
+                store()
+                count += len(batch)
+                batch = []
+                ctx.update(chunks=count)
+        if batch:
+            store()
+            count += len(batch)
+        # a delete that ran during the last store() has not seen its chunks
+        ctx.check_cancelled()
+        ctx.update(chunks=count, chunksTotal=count)
+        complete = True
+    finally:
+        if source is not None:
+            source.close()
+        if claimed and complete and storing:
+            finish_chunk_set(key, ctx.job_id, count, pages=page_stats)
+        elif claimed:
+            release_chunk_set(key, ctx.job_id)
+
+    if page_stats:
         logger.info(
-            "Added %d chunks to vector store for owner %s (count after: %s)",
-            len(chunks),
-            payload.owner_id,
-            count_after,
+            "Extracted %d pages of %s in %.0f ms (%s)",
+            len(page_stats),
+            payload.original_name,
+            sum(s["ms"] for s in page_stats),
+            ", ".join(f"{m}: {n}" for m, n in sorted(methods.items())),
         )
-    except Exception as e:
-        logger.exception("Failed to add texts to vector store: %s", e)
-        raise HTTPException(status_code=500, detail="vector store update failed")
+    if not count:
+        logger.info("No extractable text for %s", p)
+        return {"ok": True, "message": "no text extracted", "count": 0, "pages": page_stats}
+    logger.info("Processed file %s: %d chunks", payload.original_name, count)
+    return {"ok": True, "count": count, "pages": page_stats}
 
-    docs = []
-    for i, c in enumerate(chunks):
-        docs.append(
-            {
-                "id": str(uuid.uuid4()),
-                "fileId": payload.file_id,
-                "ownerId": payload.owner_id,
-                "text": c,
-                "chunkIndex": i,
+
+register_job_handler("process-file", _process_file_job)
+
+
+def _reprocess_file_job(data: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    """
+    Re-ingest a file whose content changed. The new chunks are matched to the stored
+    ones by content hash: unchanged chunks keep their id and vector, only new or
+    changed chunks are embedded and inserted, and stored chunks that no longer occur
+    are removed. Every chunk ends up with its position in the new text as chunkIndex
+    (kept ones are renumbered in Mongo, FAISS and the lexical index). New and moved
+    chunks pass through indexes past the end of both texts, so no two chunks of the
+    file share a chunkIndex at any point. Safe to run again after an interruption:
+    the next diff picks up where this one stopped.
+    """
+    payload = ProcessFilePayload(**data)
+    p = payload.path
+    if not os.path.exists(p):
+        raise RuntimeError("file not found on server")
+
+    sha256 = file_sha256(p)
+    add_artifact_ref(sha256, payload.owner_id, payload.file_id)
+    key = chunk_set_key(sha256, CHUNKER_VERSION, EMBEDDING_MODEL_NAME)
+    ctx.stage("extracting")
+    new_vectors: Optional[np.ndarray] = None
+    new_texts: List[str] = []
+    new_refs: List[ChunkRef] = []
+    artifact = find_chunk_set(key)
+    if artifact is not None:
+        parts = []
+        for texts, refs, vectors in _iter_artifact_chunks(artifact):
+            new_texts.extend(texts)
+            new_refs.extend(refs)
+            parts.append(vectors)
+        new_vectors = np.vstack(parts) if parts else None
+    else:
+        source = _TextSource(sha256, p, payload.owner_id)
+        try:
+            for start, end, text in iter_chunk_spans(source.sections, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+                new_texts.append(text)
+                new_refs.append(source.ref(start, end))
+        finally:
+            source.close()
+
+    ctx.stage("diffing", chunksTotal=len(new_texts))
+    stored: Dict[str, List[Dict[str, Any]]] = {}
+    cursor = db.chunks.find(
+        {"ownerId": payload.owner_id, "fileId": payload.file_id},
+        {"_id": 0, "id": 1, "chunkIndex": 1, "textHash": 1, "text": 1, "textId": 1, "start": 1, "end": 1, "page": 1},
+    ).sort("chunkIndex", 1)
+    # chunk indexes from `spare` on are used by neither the stored nor the new chunks
+    spare = len(new_texts)
+    for c in cursor:
+        h = c.get("textHash") or chunk_hash(chunk_texts([c])[0])
+        stored.setdefault(h, []).append(c)
+        if c.get("chunkIndex") is not None:
+            spare = max(spare, int(c["chunkIndex"]) + 1)
+    added: List[int] = []
+    kept = 0
+    # kept chunks move onto the new text, so the old one is no longer referenced, and
+    # those at another position go to spare + position first (see `final` below)
+    moves: List[UpdateOne] = []
+    renumbered: Dict[str, int] = {}
+    for i, text in enumerate(new_texts):
+        same = stored.get(chunk_hash(text))
+        if same:
+            c = same.pop(0)
+            kept += 1
+            update: Dict[str, Any] = {}
+            if c.get("chunkIndex") != i:
+                update["$set"] = {"chunkIndex": spare + i}
+                renumbered[c["id"]] = i
+            tid, start, end, page = new_refs[i]
+            if start is not None and (c.get("textId"), c.get("start"), c.get("end"), c.get("page")) != new_refs[i]:
+                update.setdefault("$set", {}).update(textId=tid, start=start, end=end, page=page)
+                update["$unset"] = {"text": ""}
+            elif start is None and c.get("start") is not None:
+                # the new text is not in the text store: the chunk keeps its own copy
+                update.setdefault("$set", {}).update(text=text, page=page)
+                update["$unset"] = {"textId": "", "start": "", "end": ""}
+            if update:
+                moves.append(UpdateOne({"id": c["id"], "ownerId": payload.owner_id}, update))
+        else:
+            added.append(i)
+    stale = [c for cs in stored.values() for c in cs]
+
+    # insert before removing, so the file stays searchable throughout; new chunks go
+    # in at spare + position and take their position with the moved ones at the end
+    ctx.stage("saving", added=0, addedTotal=len(added), kept=kept, removed=len(stale))
+    try:
+        for start in range(0, len(added), INGEST_BATCH_CHUNKS):
+            ctx.check_cancelled()
+            positions = added[start : start + INGEST_BATCH_CHUNKS]
+            if new_vectors is not None:
+                vectors = new_vectors[positions]
+            else:
+                vectors = embed_chunks([new_texts[i] for i in positions])
+            chunk_ids = _store_chunks([(payload, spare + i, new_texts[i], new_refs[i]) for i in positions], vectors)
+            renumbered.update(zip(chunk_ids, positions))
+            ctx.update(added=start + len(positions))
+        ctx.check_cancelled()
+    except JobLost:
+        raise
+    except JobCancelled:
+        # the file was deleted meanwhile: drop the chunks this run inserted
+        _delete_file_data(payload.file_id, payload.owner_id)
+        raise
+    if moves:
+        try:
+            db.chunks.bulk_write(moves, ordered=False)
+        except Exception as e:
+            logger.exception("Failed to update kept chunks of %s: %s", payload.file_id, e)
+            raise RuntimeError("failed to update kept chunks in db")
+
+    if stale:
+        stale_ids = [c["id"] for c in stale if c.get("id")]
+        try:
+            db.chunks.delete_many({"ownerId": payload.owner_id, "fileId": payload.file_id, "id": {"$in": stale_ids}})
+        except Exception as e:
+            logger.exception("Failed to delete stale chunks of %s: %s", payload.file_id, e)
+            raise RuntimeError("failed to delete stale chunks from db")
+        delete_chunks_from_store(payload.owner_id, payload.file_id, stale_ids)
+
+    if renumbered:
+        # every chunk still below spare is at its final position, so these moves are collision-free
+        final = [
+            UpdateOne({"id": chunk_id, "ownerId": payload.owner_id}, {"$set": {"chunkIndex": i}})
+            for chunk_id, i in renumbered.items()
+        ]
+        try:
+            db.chunks.bulk_write(final, ordered=False)
+        except Exception as e:
+            logger.exception("Failed to renumber chunks of %s: %s", payload.file_id, e)
+            raise RuntimeError("failed to renumber chunks in db")
+        renumber_chunks_in_store(payload.owner_id, payload.file_id, renumbered)
+    if added or renumbered or stale:
+        # the lexical index is keyed by chunkIndex: index the file again in its new order
+        try:
+            ids = {
+                c.get("chunkIndex"): c.get("id")
+                for c in db.chunks.find(
+                    {"ownerId": payload.owner_id, "fileId": payload.file_id}, {"_id": 0, "id": 1, "chunkIndex": 1}
+                )
             }
+            lexical_delete_file(payload.owner_id, payload.file_id)
+            lexical_add_chunks(
+                payload.owner_id, payload.file_id, new_texts, [ids.get(i) for i in range(len(new_texts))]
+            )
+        except Exception as e:
+            logger.exception("Failed to update lexical index: %s", e)
+    # the previous content of the file, if no other file has it
+    _release_file_artifacts(payload.file_id, payload.owner_id, keep=sha256)
+
+    logger.info(
+        "Reprocessed file %s: %d chunks, %d kept, %d embedded, %d removed",
+        payload.original_name,
+        len(new_texts),
+        kept,
+        len(added) if new_vectors is None else 0,
+        len(stale),
+    )
+    return {
+        "ok": True,
+        "count": len(new_texts),
+        "kept": kept,
+        "added": len(added),
+        "removed": len(stale),
+        "embedded": len(added) if new_vectors is None else 0,
+    }
+
+
+register_job_handler("reprocess-file", _reprocess_file_job)
+
+
+class _BulkFile:
+    """One file of a bulk ingestion: its chunks once extracted and how far they are stored."""
+
+    def __init__(self, payload: ProcessFilePayload, job_id: str):
+        self.payload = payload
+        # artifact claims are per file: two copies of one file in a batch must not both build it
+        self.claim_id = f"{job_id}:{payload.file_id}"
+        self.key: Optional[str] = None
+        self.texts: List[str] = []
+        self.refs: List[ChunkRef] = []
+        self.vectors: Optional[np.ndarray] = None  # set when the chunks come from the artifact store
+        self.pages: List[Dict[str, Any]] = []
+        self.claimed = False
+        self.storing = False
+        self.stored = 0
+        self.error: Optional[str] = None
+
+    def prepare(self) -> "_BulkFile":
+        """Hash, then link the stored chunk set or extract and chunk (runs on an extraction thread)."""
+        p = self.payload.path
+        try:
+            if not os.path.exists(p):
+                raise RuntimeError("file not found on server")
+            sha256 = file_sha256(p)
+            add_artifact_ref(sha256, self.payload.owner_id, self.payload.file_id)
+            self.key = chunk_set_key(sha256, CHUNKER_VERSION, EMBEDDING_MODEL_NAME)
+            artifact = find_chunk_set(self.key)
+            if artifact is not None:
+                parts = []
+                for texts, refs, vectors in _iter_artifact_chunks(artifact):
+                    self.texts.extend(texts)
+                    self.refs.extend(refs)
+                    parts.append(vectors)
+                self.vectors = np.vstack(parts) if parts else None
+                self.pages = artifact.get("pages") or []
+                return self
+            self.claimed = claim_chunk_set(
+                self.key,
+                self.claim_id,
+                sha256=sha256,
+                textId=text_id(sha256),
+                chunker=CHUNKER_VERSION,
+                model=EMBEDDING_MODEL_NAME,
+            )
+            self.storing = self.claimed
+            source = _TextSource(
+                sha256, p, self.payload.owner_id, on_page=lambda done, total, info: self.pages.append(info)
+            )
+            try:
+                for start, end, text in iter_chunk_spans(
+                    source.sections, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP
+                ):
+                    self.texts.append(text)
+                    self.refs.append(source.ref(start, end))
+            finally:
+                source.close()
+        except Exception as e:
+            logger.exception("Failed to extract %s (%s): %s", self.payload.original_name, p, e)
+            self.error = str(e) or type(e).__name__
+            self.texts, self.refs = [], []
+            self.release()
+        return self
+
+    def release(self):
+        if self.claimed:
+            release_chunk_set(self.key, self.claim_id)
+            self.claimed = False
+
+    def finish(self):
+        if self.claimed and self.storing:
+            finish_chunk_set(self.key, self.claim_id, len(self.texts), pages=self.pages)
+            self.claimed = False
+        self.release()
+
+    def result(self) -> Dict[str, Any]:
+        res = {"file_id": self.payload.file_id, "count": len(self.texts), "reused": self.vectors is not None}
+        if self.error:
+            res["error"] = self.error
+        return res
+
+
+def ingest_files(
+    files: List[ProcessFilePayload],
+    job_id: str,
+    progress: Optional[Callable[..., None]] = None,
+    ctx: Optional[JobContext] = None,
+) -> Dict[str, Any]:
+    """
+    Bulk ingestion, shared by /process-files and import_dir.py. Files are hashed,
+    extracted and chunked INGEST_EXTRACT_WORKERS at a time while the chunks of all of
+    them are pooled into batches of BULK_BATCH_CHUNKS: each batch is embedded with one
+    call (chunk sets already in the artifact store are not embedded at all) and stored
+    with one FAISS add per owner and one unordered Mongo bulk insert. A file that cannot
+    be read is reported in its result and does not stop the others. With ctx (a job),
+    cancellation is checked before every batch; if the run fails or is cancelled, the
+    files it stored in part are deleted again and finished ones are kept. Files
+    deleted meanwhile (ctx.cancelled_files) are dropped and whatever they stored
+    is deleted, while the other files go on.
+    """
+    start = time.perf_counter()
+    workers = max(1, INGEST_EXTRACT_WORKERS)
+    pending: List[Tuple[_BulkFile, int]] = []  # (file, chunk position) not yet stored
+    results: List[Dict[str, Any]] = []
+    unfinished: set = set()
+    created: List[_BulkFile] = []
+    preparing: set = set()
+    dropped: set = set()  # ids of deleted files already dropped
+    totals = {"chunks": 0, "embedded": 0}
+
+    def report():
+        if progress is None:
+            return
+        elapsed = max(1e-9, time.perf_counter() - start)
+        progress(
+            files=len(results),
+            filesTotal=len(files),
+            chunks=totals["chunks"],
+            embedded=totals["embedded"],
+            filesPerS=round(len(results) / elapsed, 2),
+            chunksPerS=round(totals["chunks"] / elapsed, 1),
         )
-    if docs:
+
+    def done(f: _BulkFile):
+        f.finish()
+        unfinished.discard(f)
+        results.append(f.result())
+        report()
+
+    def discard(f: _BulkFile):
+        if f in unfinished:
+            f.error = "file deleted during ingestion"
+            f.release()
+            unfinished.discard(f)
+            results.append(f.result())
         try:
-            db.chunks.insert_many(docs)
+            _delete_file_data(f.payload.file_id, f.payload.owner_id)
         except Exception as e:
-            logger.exception("Failed to insert chunks into Mongo: %s", e)
-            return {"ok": False, "message": "vectors stored but failed to save chunks metadata"}
+            logger.exception("Failed to drop deleted file %s from bulk ingestion: %s", f.payload.file_id, e)
+
+    def drop_deleted():
+        """Check for cancellation; drop files deleted since the last check, stored chunks included."""
+        if ctx is None:
+            return
+        ctx.check_cancelled()
+        gone = ctx.cancelled_files - dropped
+        if not gone:
+            return
+        dropped.update(gone)
+        pending[:] = [(f, i) for f, i in pending if f.payload.file_id not in gone]
+        for f in created:
+            # files still extracting are dropped once they are ready
+            if f.payload.file_id in gone and f not in preparing:
+                discard(f)
+
+    def flush(n: int):
+        drop_deleted()
+        batch, pending[:] = pending[:n], pending[n:]
+        todo = [k for k, (f, _) in enumerate(batch) if f.vectors is None]
+        embedded = embed_chunks([batch[k][0].texts[batch[k][1]] for k in todo]) if todo else None
+        rows: List[np.ndarray] = []
+        j = 0
+        for f, i in batch:
+            if f.vectors is not None:
+                rows.append(f.vectors[i])
+            else:
+                rows.append(embedded[j])
+                j += 1
+        vectors = np.vstack(rows)
+        _store_chunks([(f.payload, i, f.texts[i], f.refs[i]) for f, i in batch], vectors)
+        totals["chunks"] += len(batch)
+        totals["embedded"] += len(todo)
+        # a file's chunks are contiguous in the batch
+        k = 0
+        while k < len(batch):
+            f, first = batch[k]
+            end = k
+            while end < len(batch) and batch[end][0] is f:
+                end += 1
+            if f.storing:
+                f.storing = add_artifact_chunks(
+                    f.key,
+                    first,
+                    [r[1:] for r in f.refs[first : first + end - k]],
+                    f.texts[first : first + end - k],
+                    vectors[k:end],
+                )
+            f.stored += end - k
+            if f.stored == len(f.texts):
+                done(f)
+            k = end
+        report()
+
+    it = iter(files)
+    inflight = set()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-extract") as pool:
+
+            def fill():
+                # a bounded window of files ahead, so extracted chunks never pile up
+                while len(inflight) < 2 * workers:
+                    payload = next(it, None)
+                    if payload is None:
+                        return
+                    if ctx is not None and payload.file_id in ctx.cancelled_files:
+                        continue
+                    f = _BulkFile(payload, job_id)
+                    unfinished.add(f)
+                    created.append(f)
+                    preparing.add(f)
+                    inflight.add(pool.submit(f.prepare))
+
+            fill()
+            while inflight:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    inflight.discard(fut)
+                    f = fut.result()
+                    preparing.discard(f)
+                    if f.payload.file_id in dropped:
+                        discard(f)
+                        continue
+                    if not f.texts:
+                        done(f)
+                        continue
+                    pending.extend((f, i) for i in range(len(f.texts)))
+                fill()
+                while len(pending) >= BULK_BATCH_CHUNKS:
+                    flush(BULK_BATCH_CHUNKS)
+            while pending:
+                flush(BULK_BATCH_CHUNKS)
+        # a file deleted while its last batch was stored
+        drop_deleted()
+    except JobLost:
+        # the attempt that took over cleans up and stores the files
+        raise
+    except Exception:
+        for f in unfinished:
+            if not f.texts:
+                continue
+            try:
+                _delete_file_data(f.payload.file_id, f.payload.owner_id)
+            except Exception as e:
+                logger.exception("Failed to clean up %s after an interrupted bulk ingestion: %s", f.payload.file_id, e)
+        raise
+    finally:
+        for f in unfinished:
+            f.release()
+
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if r.get("error"))
+    summary = {
+        "ok": True,
+        "files": len(results),
+        "failed": failed,
+        "reused": sum(1 for r in results if r["reused"]),
+        "chunks": totals["chunks"],
+        "embedded": totals["embedded"],
+        "seconds": round(elapsed, 3),
+        "files_per_s": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        "chunks_per_s": round(totals["chunks"] / elapsed, 1) if elapsed > 0 else None,
+        "results": results,
+    }
+    logger.info(
+        "Bulk ingestion of %d files (%d failed): %d chunks, %d embedded in %.1f s (%.2f files/s, %.1f chunks/s)",
+        len(results),
+        failed,
+        totals["chunks"],
+        totals["embedded"],
+        elapsed,
+        summary["files_per_s"] or 0,
+        summary["chunks_per_s"] or 0,
+    )
+    return summary
+
+
+def _process_files_job(data: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    files = [ProcessFilePayload(**f) for f in data.get("files") or []]
+    if ctx.resumed:
+        # start over; files finished by the interrupted attempt are linked from the artifact store
+        ctx.stage("cleanup")
+        for f in files:
+            _delete_file_data(f.file_id, f.owner_id, release_refs=False)
+    ctx.stage("processing", files=0, filesTotal=len(files), chunks=0)
+    return ingest_files(files, ctx.job_id, progress=ctx.update, ctx=ctx)
+
+
+register_job_handler("process-files", _process_files_job)
 
-    logger.info("Processed file %s: %d chunks", payload.original_name, len(chunks))
-    return {"ok": True, "count": len(chunks)}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    Stage (queued, processing, done / failed), progress (pages / pagesTotal, pages per
+    extraction method, chunks stored so far; chunksTotal once finished), error and
+    result of a job. The result of a PDF lists each page's method, ms and chars.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
 
 
 @app.post("/delete-file")
@@ -217,7 +1193,30 @@ def delete_file_delete(file_id: Optional[str] = None, owner_id: Optional[str] =
     return _delete_file_logic(file_id, owner_id)
 
 
+def _release_file_artifacts(file_id: str, owner_id: str, keep: Optional[str] = None):
+    try:
+        for sha256 in release_artifact_refs(owner_id, file_id, keep=keep):
+            # chunk sets point into the text: they go first
+            delete_chunk_sets(sha256)
+            delete_texts(sha256)
+    except Exception as e:
+        logger.exception("Failed to release the artifacts of file %s: %s", file_id, e)
+
+
 def _delete_file_logic(file_id: str, owner_id: str):
+    # first, so a running job stops storing (and cleans up) what the delete below removes
+    try:
+        cancel_file_jobs(owner_id=owner_id, file_id=file_id)
+    except Exception as e:
+        logger.exception("Failed to cancel jobs for file %s: %s", file_id, e)
+    return _delete_file_data(file_id, owner_id)
+
+
+def _delete_file_data(file_id: str, owner_id: str, release_refs: bool = True):
+    """
+    Remove a file's chunks from Mongo, the lexical index and the vector store, and
+    (release_refs) the artifacts of its content unless another file uses them.
+    """
     try:
         res = db.chunks.delete_many({"fileId": file_id, "ownerId": owner_id})
         logger.info("Deleted %d chunk docs for file %s", res.deleted_count, file_id)
@@ -225,6 +1224,14 @@ def _delete_file_logic(file_id: str, owner_id: str):
         logger.exception("Failed to delete chunks in Mongo: %s", e)
         raise HTTPException(status_code=500, detail="failed to delete chunks from db")
 
+    if release_refs:
+        _release_file_artifacts(file_id, owner_id)
+
+    try:
+        lexical_delete_file(owner_id=owner_id, file_id=file_id)
+    except Exception as e:
+        logger.exception("Failed to remove file from lexical index: %s", e)
+
     try:
         removed = delete_file_from_store(owner_id=owner_id, file_id=file_id)
         return {"ok": True, "deleted_from_vector_store": removed}
@@ -239,7 +1246,24 @@ def query(payload: QueryPayload):
     if not q:
         raise HTTPException(status_code=400, detail="query required")
 
-    hits = search_store(owner_id=payload.owner_id, query=q, top_k=6)
+    try:
+        mode = resolve_mode(payload.retrieval_mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    file_ids = resolve_file_filter(
+        payload.owner_id, payload.file_ids, payload.uploaded_after, payload.uploaded_before, payload.file_types
+    )
+    hits = retrieve(
+        owner_id=payload.owner_id,
+        query=q,
+        top_k=6,
+        mode=mode,
+        ef_search=payload.ef_search,
+        nprobe=payload.nprobe,
+        file_ids=file_ids,
+        with_text=False,  # read from the chunk records below, for the top-k only
+    )
 
     if hits and (payload.scope in ["mydata", "mydata+general", None]):
         snippets = []
@@ -250,8 +1274,12 @@ def query(payload: QueryPayload):
             chunk_index = md.get("chunkIndex")
             file = db.files.find_one({"id": file_id}) or {}
             title = file.get("originalName") or md.get("originalName") or "unknown"
-            chunk_doc = db.chunks.find_one({"fileId": file_id, "ownerId": payload.owner_id, "chunkIndex": chunk_index})
-            text = (chunk_doc.get("text") if chunk_doc else doc.page_content) or ""
+            chunk_id = md.get("chunkId")
+            if chunk_id:
+                chunk_doc = db.chunks.find_one({"id": chunk_id, "ownerId": payload.owner_id})
+            else:
+                chunk_doc = db.chunks.find_one({"fileId": file_id, "ownerId": payload.owner_id, "chunkIndex": chunk_index})
+            text = (chunk_texts([chunk_doc])[0] if chunk_doc else doc.page_content) or ""
             text = text[:1200]
             snippets.append(f"From {title} (chunk {chunk_index}, score {score:.3f}):\n{text}")
             citations.append({"title": title, "locator": f"chunk {chunk_index}", "score": score})
@@ -261,6 +1289,67 @@ def query(payload: QueryPayload):
     return {"message": "No answer found in your database. (General fallback not configured.)", "answer_origin": "general-knowledge", "citations": [], "confidence": "low"}
 
 
+@app.post("/search-batch")
+def search_batch(payload: SearchBatchPayload):
+    """
+    Run many queries for one owner with one embedding call and one FAISS search.
+    Hits carry the same metadata and score (squared L2, lower is closer) as /query.
+    """
+    queries = [(q or "").strip() for q in payload.queries]
+    if not queries:
+        raise HTTPException(status_code=400, detail="queries required")
+    if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"at most {SEARCH_BATCH_MAX_QUERIES} queries per batch")
+
+    top_k = max(1, int(payload.top_k or 6))
+    batch_hits = search_store_batch(
+        owner_id=payload.owner_id,
+        queries=queries,
+        top_k=top_k,
+        ef_search=payload.ef_search,
+        nprobe=payload.nprobe,
+        with_text=False,
+    )
+
+    # one lookup each for file titles and chunk texts across all queries
+    file_ids = {(doc.metadata or {}).get("fileId") for hits in batch_hits for doc, _ in hits}
+    chunk_ids = {(doc.metadata or {}).get("chunkId") for hits in batch_hits for doc, _ in hits}
+    file_ids.discard(None)
+    chunk_ids.discard(None)
+    titles = {}
+    if file_ids:
+        for f in db.files.find({"id": {"$in": list(file_ids)}}, {"id": 1, "originalName": 1}):
+            titles[f.get("id")] = f.get("originalName")
+    texts = {}
+    if chunk_ids:
+        records = list(
+            db.chunks.find(
+                {"ownerId": payload.owner_id, "id": {"$in": list(chunk_ids)}},
+                {"id": 1, "text": 1, "textId": 1, "start": 1, "end": 1},
+            )
+        )
+        texts = dict(zip([c.get("id") for c in records], chunk_texts(records)))
+
+    results = []
+    for q, hits in zip(queries, batch_hits):
+        items = []
+        for doc, score in hits:
+            md = doc.metadata or {}
+            chunk_index = md.get("chunkIndex")
+            text = (texts.get(md.get("chunkId")) or doc.page_content or "")[:1200]
+            items.append({
+                "title": titles.get(md.get("fileId")) or md.get("originalName") or "unknown",
+                "locator": f"chunk {chunk_index}",
+                "score": score,
+                "fileId": md.get("fileId"),
+                "chunkIndex": chunk_index,
+                "chunkId": md.get("chunkId"),
+                "text": text,
+            })
+        results.append({"query": q, "hits": items})
+    return {"owner_id": payload.owner_id, "results": results}
+
+
 def call_gemini(prompt: str, context: str = "", temperature: float = 0.3, max_tokens: int = 4096) -> Dict[str, Any]:
     """
     Calls Gemini 2.5 Flash via REST API.
@@ -360,8 +1449,25 @@ def chat(payload: ChatPayload):
         top_k = max(1, int(payload.top_k or 4))
         selected = [m.lower() for m in (payload.selected_models or ["openai", "gemini"])]
 
-        # 1) Retrieve top-k from vector store
-        hits = search_store(owner_id=owner, query=q, top_k=top_k)
+        try:
+            mode = resolve_mode(payload.retrieval_mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 1) Retrieve top-k from vector store (and/or the lexical index)
+        file_ids = resolve_file_filter(
+            owner, payload.file_ids, payload.uploaded_after, payload.uploaded_before, payload.file_types
+        )
+        hits = retrieve(
+            owner_id=owner,
+            query=q,
+            top_k=top_k,
+            mode=mode,
+            ef_search=payload.ef_search,
+            nprobe=payload.nprobe,
+            file_ids=file_ids,
+            with_text=False,  # read from the chunk records below, for the top-k only
+        )
 
         # Build retrieved snippets (try to fetch full chunk text from Mongo when possible)
         retrieved = []
@@ -376,13 +1482,13 @@ def chat(payload: ChatPayload):
             if chunk_id:
                 chunk_doc = db.chunks.find_one({"id": chunk_id})
                 if chunk_doc:
-                    chunk_text = chunk_doc.get("text", "")
+                    chunk_text = chunk_texts([chunk_doc])[0]
 
             # Fallback to fileId+chunkIndex lookup
             if not chunk_text and file_id is not None and chunk_index is not None:
                 chunk_doc = db.chunks.find_one({"fileId": file_id, "ownerId": owner, "chunkIndex": chunk_index})
                 if chunk_doc:
-                    chunk_text = chunk_doc.get("text", "")
+                    chunk_text = chunk_texts([chunk_doc])[0]
 
             # Final fallback: use the langchain Document page_content
             if not chunk_text:
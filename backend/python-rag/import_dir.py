@@ -0,0 +1,118 @@
+# python-rag/import_dir.py
+"""
+Import a local directory into an owner's index without uploading each file:
+
+    python import_dir.py /data/handbooks --owner <user id>
+    python import_dir.py /data/inbox --owner <user id> --ext pdf,docx --dry-run
+
+Every file gets a `files` record like an upload through the Node backend (its path
+points at the file where it is; nothing is copied) and all of them are ingested
+in-process by the bulk pipeline behind /process-files (app.ingest_files). Files the
+owner already has a record for (same path) are skipped, so an interrupted import can
+simply be run again. Throughput (files/s, chunks/s) is printed as it goes.
+"""
+import os
+import sys
+import uuid
+import time
+import logging
+import argparse
+import mimetypes
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_EXTENSIONS = "pdf,docx,doc,txt,md,csv,json"
+
+
+def find_files(root: Path, extensions):
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            path = Path(dirpath) / name
+            if path.suffix.lower().lstrip(".") in extensions and path.is_file():
+                yield path.resolve()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("directory")
+    ap.add_argument("--owner", required=True, help="owner (user) id the files are imported for")
+    ap.add_argument("--ext", default=DEFAULT_EXTENSIONS, help="comma-separated extensions to import")
+    ap.add_argument("--dry-run", action="store_true", help="list the files that would be imported")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    root = Path(args.directory)
+    if not root.is_dir():
+        sys.exit(f"not a directory: {root}")
+    extensions = {e.strip().lower().lstrip(".") for e in args.ext.split(",") if e.strip()}
+
+    import app
+    from utils.vector_store import start_persister, stop_persister
+    from utils.embedding_pool import stop_pool as stop_embedding_pool
+    from utils.ocr_pool import start_pool as start_ocr_pool, stop_pool as stop_ocr_pool
+
+    db = app.db
+    known = {f.get("path") for f in db.files.find({"ownerId": args.owner}, {"path": 1})}
+    paths = [p for p in find_files(root, extensions) if str(p) not in known]
+    print(f"{len(paths)} new files under {root} ({len(known)} already imported for {args.owner})")
+    if args.dry_run:
+        for p in paths:
+            print(p)
+        return
+    if not paths:
+        return
+
+    records = []
+    for p in paths:
+        records.append(
+            {
+                "id": str(uuid.uuid4()),
+                "ownerId": args.owner,
+                "originalName": p.name,
+                "filename": p.name,
+                "path": str(p),
+                "mimeType": mimetypes.guess_type(p.name)[0] or "application/octet-stream",
+                "size": p.stat().st_size,
+                "uploadedAt": datetime.utcnow(),
+                "importedFrom": str(root.resolve()),
+            }
+        )
+    db.files.insert_many(records, ordered=False)
+
+    last = [0.0]
+
+    def progress(**p):
+        now = time.monotonic()
+        if now - last[0] >= 2.0:
+            last[0] = now
+            print(
+                f"  {p['files']}/{p['filesTotal']} files, {p['chunks']} chunks "
+                f"({p['filesPerS']} files/s, {p['chunksPerS']} chunks/s)",
+                flush=True,
+            )
+
+    files = [
+        app.ProcessFilePayload(file_id=r["id"], owner_id=args.owner, path=r["path"], original_name=r["originalName"])
+        for r in records
+    ]
+    start_persister()
+    start_ocr_pool()
+    try:
+        summary = app.ingest_files(files, job_id=f"import-{uuid.uuid4()}", progress=progress)
+    finally:
+        stop_persister()
+        stop_embedding_pool()
+        stop_ocr_pool()
+
+    for r in summary["results"]:
+        if r.get("error"):
+            print(f"  failed: {r['file_id']}: {r['error']}")
+    print(
+        f"Imported {summary['files'] - summary['failed']}/{summary['files']} files, {summary['chunks']} chunks "
+        f"({summary['embedded']} embedded, {summary['reused']} files reused) in {summary['seconds']} s: "
+        f"{summary['files_per_s']} files/s, {summary['chunks_per_s']} chunks/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
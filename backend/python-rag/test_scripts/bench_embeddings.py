@@ -0,0 +1,142 @@
+# python-rag/test_scripts/bench_embeddings.py
+"""
+Compare embedding backends on this machine: load time, throughput (model.encode at a
+fixed batch size, and MB of text/s for both that and the length-bucketed ingest path),
+peak memory and agreement with the torch vectors (cosine, against ONNX_MIN_COSINE).
+
+    python test_scripts/bench_embeddings.py --texts 1000
+    python test_scripts/bench_embeddings.py --file some_chunks.txt --backends torch,onnx-int8
+
+Each backend runs in its own subprocess so peak RSS is measured in isolation.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKENDS = {
+    "torch": {"EMBEDDING_BACKEND": "torch"},
+    "onnx": {"EMBEDDING_BACKEND": "onnx", "EMBEDDING_ONNX_INT8": "false"},
+    "onnx-int8": {"EMBEDDING_BACKEND": "onnx", "EMBEDDING_ONNX_INT8": "true"},
+}
+
+_WORDS = (
+    "invoice contract payment policy report revenue customer warranty clause section "
+    "quarterly results employee handbook security incident error code part number "
+    "shipment delivery schedule meeting notes research paper abstract method dataset"
+).split()
+
+
+def sample_texts(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        length = int(rng.integers(8, 220))  # mix of short queries and chunk-sized texts
+        out.append(" ".join(rng.choice(_WORDS, size=length)))
+    return out
+
+
+def worker(backend: str, texts_path: str, out_path: str, batch_size: int):
+    sys.path.insert(0, str(ROOT))
+    t0 = time.perf_counter()
+    from utils import embeddings
+
+    model = embeddings.get_model()
+    load_s = time.perf_counter() - t0
+    if backend != "torch" and type(model).__name__ != "OnnxSentenceEncoder":
+        raise SystemExit(f"{backend}: ONNX backend did not load (see log above)")
+    with open(texts_path, "r", encoding="utf-8") as f:
+        texts = json.load(f)
+    model.encode(texts[: min(32, len(texts))], batch_size=batch_size)  # warm-up
+    t1 = time.perf_counter()
+    vecs = np.asarray(model.encode(texts, batch_size=batch_size), dtype=np.float32)
+    encode_s = time.perf_counter() - t1
+    # the ingest path: length buckets at an adaptive batch size (embeddings._encode)
+    t2 = time.perf_counter()
+    embeddings._encode(texts)
+    bucketed_s = time.perf_counter() - t2
+    mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    np.save(out_path, vecs)
+    print(json.dumps({
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "texts_per_s": round(len(texts) / encode_s, 1),
+        "mb_per_s": round(mb / encode_s, 3),
+        "bucketed_mb_per_s": round(mb / bucketed_s, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "dim": int(vecs.shape[1]),
+    }))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--texts", type=int, default=512, help="number of synthetic texts")
+    ap.add_argument("--file", help="one text per line instead of synthetic texts")
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    ap.add_argument("--texts-path", help=argparse.SUPPRESS)
+    ap.add_argument("--out", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.texts_path, args.out, args.batch_size)
+        return
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = sample_texts(args.texts)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "torch" not in backends:
+        backends.insert(0, "torch")  # reference for the cosine check
+
+    tmp = Path(tempfile.mkdtemp(prefix="bench_embeddings_"))
+    texts_path = tmp / "texts.json"
+    texts_path.write_text(json.dumps(texts), encoding="utf-8")
+    results, vectors = [], {}
+    for backend in backends:
+        out = tmp / f"{backend}.npy"
+        env = dict(os.environ, **BACKENDS[backend], EMBED_CACHE_DISK="false")
+        cmd = [sys.executable, __file__, "--worker", backend, "--texts-path", str(texts_path),
+               "--out", str(out), "--batch-size", str(args.batch_size)]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{backend}: failed\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        vectors[backend] = np.load(out)
+
+    sys.path.insert(0, str(ROOT))
+    from utils.embeddings import ONNX_MIN_COSINE
+
+    ref = vectors.get("torch")
+    print(f"{len(texts)} texts, batch size {args.batch_size}")
+    print(f"{'backend':<10} {'load s':>7} {'texts/s':>9} {'MB/s':>7} {'bucketed':>9} {'peak MB':>8}"
+          f" {'min cos':>8} {'mean cos':>9}  check")
+    ok = True
+    for r in results:
+        line = (f"{r['backend']:<10} {r['load_s']:>7} {r['texts_per_s']:>9} {r['mb_per_s']:>7}"
+                f" {r['bucketed_mb_per_s']:>9} {r['peak_rss_mb']:>8}")
+        if ref is not None and r["backend"] != "torch":
+            v = vectors[r["backend"]]
+            cos = (v * ref).sum(1) / (np.linalg.norm(v, axis=1) * np.linalg.norm(ref, axis=1))
+            need = ONNX_MIN_COSINE["int8" if r["backend"].endswith("int8") else "fp32"]
+            passed = v.shape == ref.shape and float(cos.min()) >= need
+            ok &= passed
+            line += f" {cos.min():>8.5f} {cos.mean():>9.5f}  {'ok' if passed else 'FAIL'} (>= {need})"
+        print(line)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# python-rag/test_scripts/bench_text_store.py
+"""
+Storage saved against per-hit latency for the text store (utils/text_store.py): each
+file's text stored once in compressed blocks, versus chunk text stored inline.
+
+    python test_scripts/bench_text_store.py --docs 200
+    python test_scripts/bench_text_store.py --dir /data/handbooks
+    python test_scripts/bench_text_store.py --configs zlib:16384,zstd:8192,zstd+dict:4096 --hits 5000
+
+A config is codec[+dict]:block_chars. For "+dict", a dictionary is trained on the first
+half of the documents, the way an owner's is trained on its earlier uploads, and it
+is used for all of them. Storage is compared with the chunk text that `chunks` used to
+hold inline (overlap included). Per-hit latency is the cost of one hit's text from a
+cold block cache: decompress the blocks it spans, then slice. The Mongo read is left
+out; it was one query per top-k before and still is.
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DEFAULT_CONFIGS = "zlib:16384,zstd:16384,zstd:8192,zstd+dict:8192,zstd+dict:4096"
+
+_WORDS = (
+    "invoice contract payment policy report revenue customer warranty clause section "
+    "quarterly results employee handbook security incident error code part number "
+    "shipment delivery schedule meeting notes research paper abstract method dataset "
+    "the of and to in for is on that by with as at from this be are or an will shall "
+    "agreement party parties term termination notice effective date amount total tax"
+).split()
+
+
+def synthetic_docs(n: int, chars: int, seed: int = 0):
+    """Documents of one owner: shared boilerplate (letterheads, clauses) mixed with free text and numbers."""
+    rng = np.random.default_rng(seed)
+    boilerplate = [" ".join(rng.choice(_WORDS, size=int(rng.integers(20, 60)))) + "." for _ in range(40)]
+    docs = []
+    for _ in range(n):
+        paras, length = [], 0
+        target = int(chars * rng.uniform(0.5, 1.5))
+        while length < target:
+            if rng.random() < 0.3:
+                para = boilerplate[int(rng.integers(len(boilerplate)))]
+            else:
+                words = list(rng.choice(_WORDS, size=int(rng.integers(30, 120))))
+                for k in range(int(rng.integers(0, 6))):
+                    words.insert(int(rng.integers(len(words))), f"{rng.integers(1, 99999)}.{rng.integers(0, 99):02d}")
+                para = " ".join(words).capitalize() + "."
+            paras.append(para)
+            length += len(para) + 2
+        docs.append("\n\n".join(paras))
+    return docs
+
+
+def dir_docs(root: str):
+    from utils.file_processing import iter_text_sections
+
+    docs = []
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            try:
+                text = "".join(iter_text_sections(os.path.join(dirpath, name)))
+            except Exception as e:
+                print(f"skipped {name}: {e}")
+                continue
+            if text.strip():
+                docs.append(text)
+    return docs
+
+
+def chunk_spans(text: str, chunk_size: int, overlap: int):
+    """(start, end) of each chunk, as the ingest chunker locates them (app.iter_chunk_spans)."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=overlap, separators=["\n\n", "\n", " ", ""]
+    )
+    spans, pos = [], 0
+    for chunk in splitter.split_text(text):
+        i = text.find(chunk, pos)
+        if i >= 0:
+            spans.append((i, i + len(chunk)))
+            pos = i + 1
+    return spans
+
+
+def blocks_of(text: str, block_chars: int):
+    return [text[i : i + block_chars] for i in range(0, len(text), block_chars)]
+
+
+def run_config(config: str, docs, spans, hits, top_k: int, dict_size: int):
+    from utils import text_store
+
+    codec, _, block_chars = config.partition(":")
+    use_dict = codec.endswith("+dict")
+    codec = codec.replace("+dict", "")
+    block_chars = int(block_chars or text_store.TEXT_STORE_BLOCK_CHARS)
+    if codec == "zstd" and text_store.zstd is None:
+        return {"config": config, "error": "zstandard not installed"}
+
+    zdict, dict_bytes = None, 0
+    if use_dict:
+        samples = []
+        for text in docs[: max(1, len(docs) // 2)]:
+            samples.extend(blocks_of(text, 2048))
+        zdict = text_store.train_dict(samples, size=dict_size)
+        dict_bytes = len(zdict.as_bytes())
+
+    compress = text_store._compressor(codec, zdict)
+    t0 = time.perf_counter()
+    stored = [[compress(b) for b in blocks_of(text, block_chars)] for text in docs]
+    compress_s = time.perf_counter() - t0
+    stored_bytes = sum(len(b) for blocks in stored for b in blocks)
+
+    def hit_text(d: int, start: int, end: int) -> str:
+        first, last = start // block_chars, (end - 1) // block_chars
+        text = "".join(text_store._decompress(stored[d][n], codec, zdict) for n in range(first, last + 1))
+        return text[start - first * block_chars : end - first * block_chars]
+
+    for d, start, end in hits[:50]:  # warm-up, and check the slices
+        assert hit_text(d, start, end) == docs[d][start:end], config
+    per_hit = []
+    for d, start, end in hits:
+        t = time.perf_counter_ns()
+        hit_text(d, start, end)
+        per_hit.append(time.perf_counter_ns() - t)
+    per_hit_us = np.array(per_hit) / 1000.0
+    sets = per_hit_us[: len(per_hit_us) // top_k * top_k].reshape(-1, top_k).sum(1)
+    raw_mb = sum(len(t.encode("utf-8")) for t in docs) / 1e6
+    return {
+        "config": config,
+        "stored_bytes": stored_bytes + dict_bytes,
+        "dict_bytes": dict_bytes,
+        "compress_mb_per_s": round(raw_mb / compress_s, 1),
+        "hit_us_p50": float(np.percentile(per_hit_us, 50)),
+        "hit_us_p95": float(np.percentile(per_hit_us, 95)),
+        "topk_us_p50": float(np.percentile(sets, 50)) if len(sets) else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=200, help="number of synthetic documents")
+    ap.add_argument("--chars", type=int, default=40000, help="average synthetic document length")
+    ap.add_argument("--dir", help="extract the files under this directory instead of synthetic documents")
+    ap.add_argument("--configs", default=DEFAULT_CONFIGS)
+    ap.add_argument("--hits", type=int, default=3000, help="random chunk hits timed per config")
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--chunk-size", type=int, default=1200)
+    ap.add_argument("--overlap", type=int, default=200)
+    ap.add_argument("--dict-size", type=int, default=None, help="dictionary bytes (default TEXT_DICT_SIZE)")
+    args = ap.parse_args()
+
+    from utils import text_store
+
+    docs = dir_docs(args.dir) if args.dir else synthetic_docs(args.docs, args.chars)
+    if not docs:
+        sys.exit("no text")
+    spans = [chunk_spans(t, args.chunk_size, args.overlap) for t in docs]
+    rng = np.random.default_rng(1)
+    pool = [(d, s, e) for d, doc_spans in enumerate(spans) for s, e in doc_spans]
+    hits = [pool[i] for i in rng.integers(0, len(pool), size=args.hits)]
+
+    raw_bytes = sum(len(t.encode("utf-8")) for t in docs)
+    inline_bytes = sum(len(docs[d][s:e].encode("utf-8")) for d, doc_spans in enumerate(spans) for s, e in doc_spans)
+    print(
+        f"{len(docs)} documents, {raw_bytes / 1e6:.2f} MB of text, {len(pool)} chunks "
+        f"({inline_bytes / 1e6:.2f} MB inline), {args.hits} hits, top-k {args.top_k}"
+    )
+    print(
+        f"{'config':<18} {'stored MB':>9} {'vs inline':>9} {'ratio':>6} {'dict KB':>8} {'comp MB/s':>9}"
+        f" {'hit p50 us':>10} {'hit p95 us':>10} {'top-k p50 us':>12}"
+    )
+    print(
+        f"{'inline (before)':<18} {inline_bytes / 1e6:>9.2f} {'-':>9} {inline_bytes / raw_bytes:>6.3f} {'-':>8}"
+        f" {'-':>9} {0.0:>10.1f} {0.0:>10.1f} {0.0:>12.1f}"
+    )
+    dict_size = args.dict_size or text_store.TEXT_DICT_SIZE
+    for config in [c.strip() for c in args.configs.split(",") if c.strip()]:
+        r = run_config(config, docs, spans, hits, args.top_k, dict_size)
+        if "error" in r:
+            print(f"{config:<18} {r['error']}")
+            continue
+        saved = 1 - r["stored_bytes"] / inline_bytes
+        print(
+            f"{config:<18} {r['stored_bytes'] / 1e6:>9.2f} {-saved:>+9.1%} {r['stored_bytes'] / raw_bytes:>6.3f}"
+            f" {r['dict_bytes'] / 1024:>8.1f} {r['compress_mb_per_s']:>9}"
+            f" {r['hit_us_p50']:>10.1f} {r['hit_us_p95']:>10.1f} {r['topk_us_p50']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# python-rag/utils/artifacts.py
+import os
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+from utils.mongo_client import get_db
+from utils.file_processing import EXTRACTOR_VERSION
+from utils.vector_store import pack_vector, unpack_vector
+from utils.text_store import Span
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed ingestion artifacts, shared by every owner. Uploads are identified
+# by the sha256 of their bytes. The extracted text is kept once per (sha256,
+# EXTRACTOR_VERSION) in the text store (utils/text_store.py), so a chunker or model
+# change never extracts (or OCRs) again. On top of it, the chunk set, keyed by
+# (sha256, EXTRACTOR_VERSION, chunker version, model), holds the chunk offsets into
+# that text in order with their vectors (`artifact_chunks`), plus a summary document
+# (`artifacts`) that becomes "ready" once the whole file is stored. A file whose chunk
+# set is ready is linked into an owner's index without extraction, chunking or
+# embedding. Only one job builds a chunk set at a time (see claim). The files using
+# each sha256 are recorded in `artifact_refs` (see add_ref); once the last of them is
+# deleted, the chunk sets and the stored text of that sha256 are deleted too.
+# a claim older than this belongs to a job that died; another job may take it over
+ARTIFACT_CLAIM_TTL_S = int(os.environ.get("ARTIFACT_CLAIM_TTL_S", "3600"))
+_HASH_BLOCK = 1 << 20
+
+BUILDING = "building"
+READY = "ready"
+
+_stats = {"hits": 0, "misses": 0}
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_set_key(sha256: str, chunker_version: str, model: str) -> str:
+    return f"{sha256}:{EXTRACTOR_VERSION}:{chunker_version}:{model}"
+
+
+# Chunk sets
+def find_chunk_set(key: str) -> Optional[Dict[str, Any]]:
+    """The ready chunk set for key, or None."""
+    try:
+        doc = get_db().artifacts.find_one({"key": key, "status": READY}, {"_id": 0})
+    except Exception as e:
+        logger.exception("Artifact lookup failed for %s: %s", key, e)
+        return None
+    _stats["hits" if doc is not None else "misses"] += 1
+    return doc
+
+
+def claim_chunk_set(key: str, job_id: str, **fields) -> bool:
+    """
+    Become the builder of the chunk set for key. False when it is ready already or
+    another live job is building it; that job's result will serve later uploads.
+    """
+    db = get_db()
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=ARTIFACT_CLAIM_TTL_S)
+    try:
+        db.artifacts.update_one(
+            {
+                "key": key,
+                "status": BUILDING,
+                "$or": [{"claimedBy": job_id}, {"claimedAt": {"$lt": stale}}],
+            },
+            {"$set": dict(fields, claimedBy=job_id, claimedAt=now)},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        logger.exception("Failed to claim artifact %s: %s", key, e)
+        return False
+    # partial chunks from a builder that died
+    try:
+        db.artifact_chunks.delete_many({"key": key})
+    except Exception as e:
+        logger.exception("Failed to clear partial artifact %s: %s", key, e)
+        release_chunk_set(key, job_id)
+        return False
+    return True
+
+
+def add_chunks(key: str, first_index: int, spans: List[Span], texts: List[str], vectors: np.ndarray) -> bool:
+    """Record chunks as (start, end, page) into the file's text; text only for a chunk without offsets."""
+    docs = []
+    for i, (start, end, page) in enumerate(spans):
+        doc = {"key": key, "chunkIndex": first_index + i, "start": start, "end": end, "page": page}
+        if start is None:
+            doc["text"] = texts[i]
+        doc["embedding"] = pack_vector(vectors[i])
+        docs.append(doc)
+    try:
+        if docs:
+            get_db().artifact_chunks.insert_many(docs, ordered=False)
+        return True
+    except Exception as e:
+        logger.exception("Failed to store artifact chunks for %s: %s", key, e)
+        return False
+
+
+def finish_chunk_set(key: str, job_id: str, count: int, **fields):
+    """Mark the chunk set complete; from now on uploads of the same file link it."""
+    try:
+        get_db().artifacts.update_one(
+            {"key": key, "status": BUILDING, "claimedBy": job_id},
+            {"$set": dict(fields, status=READY, count=count, readyAt=datetime.utcnow())},
+        )
+    except Exception as e:
+        logger.exception("Failed to finish artifact %s: %s", key, e)
+
+
+def release_chunk_set(key: str, job_id: str):
+    """Give up a claim (the build failed) and drop what was stored."""
+    db = get_db()
+    try:
+        res = db.artifacts.delete_one({"key": key, "status": BUILDING, "claimedBy": job_id})
+        if res.deleted_count:
+            db.artifact_chunks.delete_many({"key": key})
+    except Exception as e:
+        logger.exception("Failed to release artifact %s: %s", key, e)
+
+
+def iter_chunk_set(key: str, batch_size: int) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """
+    The chunk set in chunk order, batch_size chunks at a time: records (start, end, page,
+    and text when it has no offsets) and their vectors.
+    """
+    records: List[Dict[str, Any]] = []
+    vectors: List[np.ndarray] = []
+    cursor = get_db().artifact_chunks.find(
+        {"key": key}, {"_id": 0, "start": 1, "end": 1, "page": 1, "text": 1, "embedding": 1}
+    ).sort("chunkIndex", 1)
+    for doc in cursor:
+        vectors.append(unpack_vector(doc.pop("embedding")))
+        records.append(doc)
+        if len(records) >= batch_size:
+            yield records, np.vstack(vectors)
+            records, vectors = [], []
+    if records:
+        yield records, np.vstack(vectors)
+
+
+# References
+def add_ref(sha256: str, owner_id: str, file_id: str):
+    """Record that a file uses the artifacts of sha256; call before reading or building them."""
+    try:
+        get_db().artifact_refs.update_one(
+            {"sha256": sha256, "ownerId": owner_id, "fileId": file_id},
+            {"$setOnInsert": {"createdAt": datetime.utcnow()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass
+
+
+def release_refs(owner_id: str, file_id: str, keep: Optional[str] = None) -> List[str]:
+    """
+    Drop a file's references (except to keep, its current sha256); returns the hashes
+    no file uses any more.
+    """
+    db = get_db()
+    query: Dict[str, Any] = {"ownerId": owner_id, "fileId": file_id}
+    if keep is not None:
+        query["sha256"] = {"$ne": keep}
+    hashes = db.artifact_refs.distinct("sha256", query)
+    if not hashes:
+        return []
+    db.artifact_refs.delete_many(query)
+    return [h for h in hashes if db.artifact_refs.find_one({"sha256": h}, {"_id": 1}) is None]
+
+
+def delete_chunk_sets(sha256: str) -> int:
+    """Delete every chunk set of sha256 (any extractor, chunker or model version)."""
+    db = get_db()
+    keys = [d["key"] for d in db.artifacts.find({"sha256": sha256}, {"_id": 0, "key": 1})]
+    if keys:
+        db.artifact_chunks.delete_many({"key": {"$in": keys}})
+        db.artifacts.delete_many({"key": {"$in": keys}})
+        logger.info("Deleted %d chunk sets of %s: no file uses them any more", len(keys), sha256[:12])
+    return len(keys)
+
+
+def artifact_stats() -> Dict[str, int]:
+    return dict(_stats)
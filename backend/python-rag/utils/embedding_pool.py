@@ -0,0 +1,170 @@
+# python-rag/utils/embedding_pool.py
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ingest-side embedding on a pool of worker processes, each with its own model.
+# Large embed_texts calls (>= EMBED_POOL_MIN_TEXTS texts to encode) are sent to the
+# workers one length bucket per shard (see embeddings._encode); smaller ones, which
+# includes every query batch, keep using the in-process model so queries never wait
+# behind ingestion. EMBED_WORKERS=0 disables it.
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "0"))
+# intra-op threads per worker; the default splits the machine's cores between workers
+EMBED_WORKER_THREADS = int(
+    os.environ.get("EMBED_WORKER_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, EMBED_WORKERS))))
+)
+EMBED_POOL_MIN_TEXTS = int(os.environ.get("EMBED_POOL_MIN_TEXTS", "64"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"pending_shards": 0, "pending_texts": 0, "shards": 0, "texts": 0, "failures": 0}
+
+# the worker process's model (set by _init_worker)
+_worker_model = None
+
+
+def _init_worker(threads: int):
+    """Runs once in each worker: pin thread counts before torch/onnxruntime load, then load the model."""
+    global _worker_model
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "EMBEDDING_ONNX_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from utils import embeddings
+
+    _worker_model = embeddings.get_model()
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    embs = _worker_model.encode(texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True)
+    return np.asarray(embs, dtype=np.float32)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def enabled() -> bool:
+    return EMBED_WORKERS > 0
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if not enabled():
+        return None
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent is a threaded server that may already hold a model
+            _pool = ProcessPoolExecutor(
+                max_workers=EMBED_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(EMBED_WORKER_THREADS,),
+            )
+            logger.info(
+                "Started embedding pool: %d workers x %d threads", EMBED_WORKERS, EMBED_WORKER_THREADS
+            )
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_pool():
+    """Create the pool and start every worker (loading its model) without waiting for them."""
+    pool = _get_pool()
+    if pool is None:
+        return
+    try:
+        for _ in range(EMBED_WORKERS):
+            pool.submit(_ping)
+    except Exception as e:
+        logger.exception("Failed to start embedding pool: %s", e)
+
+
+def stop_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _shard_done(size: int, fut: Future):
+    with _stats_lock:
+        _stats["pending_shards"] -= 1
+        _stats["pending_texts"] -= size
+        if fut.cancelled() or fut.exception() is not None:
+            _stats["failures"] += 1
+        else:
+            _stats["shards"] += 1
+            _stats["texts"] += size
+
+
+def accepts(count: int) -> bool:
+    """True when a batch of count texts should go to the pool."""
+    return enabled() and count >= EMBED_POOL_MIN_TEXTS
+
+
+def encode_batches(batches: List[List[str]]) -> Optional[List[np.ndarray]]:
+    """
+    Encode each batch as one shard on the pool; returns one array per batch, or None
+    when the pool is disabled or failed (the caller then encodes in-process).
+    """
+    pool = _get_pool()
+    if pool is None:
+        return None
+    futures: List[Future] = []
+    try:
+        for shard in batches:
+            with _stats_lock:
+                _stats["pending_shards"] += 1
+                _stats["pending_texts"] += len(shard)
+            try:
+                fut = pool.submit(_encode_shard, list(shard))
+            except Exception:
+                with _stats_lock:
+                    _stats["pending_shards"] -= 1
+                    _stats["pending_texts"] -= len(shard)
+                raise
+            fut.add_done_callback(lambda f, n=len(shard): _shard_done(n, f))
+            futures.append(fut)
+        return [f.result() for f in futures]
+    except Exception as e:
+        logger.exception(
+            "Embedding pool failed; encoding %d texts in-process: %s", sum(len(b) for b in batches), e
+        )
+        for f in futures:
+            f.cancel()
+        _discard_pool(pool)
+        return None
+
+
+def pool_stats() -> Dict[str, int]:
+    """Queue depth (shards / texts submitted and not finished) and totals."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["workers"] = EMBED_WORKERS
+    stats["threads_per_worker"] = EMBED_WORKER_THREADS if enabled() else 0
+    stats["running"] = _pool is not None
+    return stats
@@ -1,25 +1,347 @@
 # python-rag/utils/embeddings.py
 import os
+import hashlib
+import logging
+import sqlite3
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List, Dict, Optional
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from utils import embedding_pool
+
+logger = logging.getLogger(__name__)
 
 MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 _model = None
+_model_lock = threading.Lock()
+
+# Backend running MODEL_NAME: "torch" (SentenceTransformer) or "onnx" (the same model
+# exported to ONNX and run by ONNX Runtime on CPU, int8 weights with
+# EMBEDDING_ONNX_INT8). Both produce vectors of the same dimension, so existing
+# FAISS indexes and Mongo embeddings stay valid. Tolerance against torch, per
+# vector (checked by test_scripts/bench_embeddings.py):
+#   onnx fp32: cosine >= 0.9999    onnx int8: cosine >= 0.98
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_INT8 = os.environ.get("EMBEDDING_ONNX_INT8", "false").lower() in ("1", "true", "yes")
+EMBEDDING_ONNX_DIR = Path(os.environ.get("EMBEDDING_ONNX_DIR", "./onnx_models")).resolve()
+EMBEDDING_ONNX_THREADS = int(os.environ.get("EMBEDDING_ONNX_THREADS", "0"))
+ONNX_MIN_COSINE = {"fp32": 0.9999, "int8": 0.98}
+
+# Two-tier cache in front of model.encode, keyed by sha256(EMBED_CACHE_NAMESPACE, text):
+# a bounded in-memory LRU and a SQLite file on disk. The namespace is the model plus
+# the backend and weight precision that produced the vectors, so torch, onnx fp32 and
+# onnx int8 vectors never answer for each other. The disk cache records the namespace
+# it was filled with and is cleared when any of them changes.
+EMBED_CACHE_MAX_ITEMS = int(os.environ.get("EMBED_CACHE_MAX_ITEMS", "50000"))
+EMBED_CACHE_DISK = os.environ.get("EMBED_CACHE_DISK", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_PATH = Path(os.environ.get("EMBED_CACHE_PATH", "./embedding_cache.sqlite")).resolve()
+_SQL_BATCH = 500
+
+
+def _cache_namespace(backend: str) -> str:
+    return "|".join([MODEL_NAME, backend, "int8" if backend == "onnx" and EMBEDDING_ONNX_INT8 else "fp32"])
+
+
+EMBED_CACHE_NAMESPACE = _cache_namespace(EMBEDDING_BACKEND)
+
+# Length-bucketed encoding: texts are sorted by estimated token count and batched so
+# each batch holds about EMBED_BUCKET_TOKENS tokens after padding (at most
+# EMBED_BUCKET_MAX_BATCH texts), then the vectors are put back in input order.
+EMBED_BUCKET_TOKENS = int(os.environ.get("EMBED_BUCKET_TOKENS", "4096"))
+EMBED_BUCKET_MAX_BATCH = int(os.environ.get("EMBED_BUCKET_MAX_BATCH", "128"))
+EMBED_MAX_TOKENS = int(os.environ.get("EMBED_MAX_TOKENS", "256"))  # the model truncates longer inputs
+_CHARS_PER_TOKEN = 4
+
+_memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_memory_lock = threading.Lock()
+_disk: Optional[sqlite3.Connection] = None
+_disk_lock = threading.Lock()
+_disk_failed = False
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+# Query micro-batching: concurrent embed_query calls are collected for up to
+# EMBED_BATCH_WAIT_MS (or EMBED_BATCH_MAX queries) and encoded as one batch by a
+# single dispatcher thread. EMBED_BATCH_WAIT_MS=0 disables it.
+EMBED_BATCH_WAIT_MS = float(os.environ.get("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_BATCH_MAX = int(os.environ.get("EMBED_BATCH_MAX", "32"))
+_query_queue: "queue.Queue[tuple]" = queue.Queue()
+_dispatcher: Optional[threading.Thread] = None
+_dispatcher_lock = threading.Lock()
+_batch_stats = {"batches": 0, "queries": 0, "max_batch": 0}
+
 
 def get_model():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
+    global _model, EMBED_CACHE_NAMESPACE
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None and EMBEDDING_BACKEND == "onnx":
+            try:
+                from utils.onnx_embeddings import OnnxSentenceEncoder
+
+                _model = OnnxSentenceEncoder.load(
+                    MODEL_NAME, EMBEDDING_ONNX_DIR, int8=EMBEDDING_ONNX_INT8, threads=EMBEDDING_ONNX_THREADS
+                )
+                logger.info("Embedding backend: onnx (%s)", "int8" if EMBEDDING_ONNX_INT8 else "fp32")
+            except Exception as e:
+                logger.exception("ONNX embedding backend unavailable, falling back to torch: %s", e)
+                EMBED_CACHE_NAMESPACE = _cache_namespace("torch")
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+
+            _model = SentenceTransformer(MODEL_NAME)
     return _model
 
+
+def _length_batches(texts: List[str], max_batch: int) -> List[List[int]]:
+    """
+    Indices of texts grouped into batches of similar length, longest first. A batch
+    pads to its longest member, so each one holds about EMBED_BUCKET_TOKENS padded
+    tokens: many short chunks per batch, fewer long ones.
+    """
+    est = [min(EMBED_MAX_TOKENS, len(t) // _CHARS_PER_TOKEN + 2) for t in texts]
+    order = sorted(range(len(texts)), key=lambda i: est[i], reverse=True)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        if current and (len(current) >= max_batch or (len(current) + 1) * est[current[0]] > EMBED_BUCKET_TOKENS):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    """
+    Encode texts in length buckets (see _length_batches) and return them in input
+    order. The buckets go to the embedding worker pool when it takes the batch, else
+    to the in-process model.
+    """
+    pooled = embedding_pool.accepts(len(texts))
+    max_batch = EMBED_BUCKET_MAX_BATCH
+    if pooled:
+        # enough batches to keep every worker busy
+        max_batch = max(1, min(max_batch, -(-len(texts) // embedding_pool.EMBED_WORKERS)))
+    batches = _length_batches(texts, max_batch)
+    groups = [[texts[i] for i in b] for b in batches]
+    results = embedding_pool.encode_batches(groups) if pooled else None
+    if results is None:
+        model = get_model()
+        results = [
+            model.encode(g, batch_size=len(g), show_progress_bar=False, convert_to_numpy=True) for g in groups
+        ]
+    out = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+    for b, embs in zip(batches, results):
+        out[b] = embs
+    return out
+
+
+def _text_key(text: str, namespace: Optional[str] = None) -> bytes:
+    h = hashlib.sha256((namespace or EMBED_CACHE_NAMESPACE).encode("utf-8"))
+    h.update(b"\0")
+    h.update((text or "").encode("utf-8"))
+    return h.digest()
+
+
+def _open_disk() -> Optional[sqlite3.Connection]:
+    """Open (once) the on-disk cache; drop its contents if another model or backend filled it."""
+    global _disk, _disk_failed
+    if _disk is not None or _disk_failed or not EMBED_CACHE_DISK:
+        return _disk
+    try:
+        EMBED_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(EMBED_CACHE_PATH), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (sha BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'namespace'").fetchone()
+        if row is None or row[0] != EMBED_CACHE_NAMESPACE:
+            if row is not None:
+                logger.info(
+                    "Embedding model/backend changed (%s -> %s); clearing embedding cache", row[0], EMBED_CACHE_NAMESPACE
+                )
+            conn.execute("DELETE FROM embeddings")
+            conn.execute("DELETE FROM meta WHERE key = 'model'")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('namespace', ?)", (EMBED_CACHE_NAMESPACE,)
+            )
+        conn.commit()
+        _disk = conn
+    except Exception as e:
+        # the cache is an optimization: without it every miss simply goes to the model
+        logger.exception("Embedding disk cache unavailable at %s: %s", EMBED_CACHE_PATH, e)
+        _disk_failed = True
+    return _disk
+
+
+def _memory_get(keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+    found = {}
+    with _memory_lock:
+        for k in keys:
+            vec = _memory.get(k)
+            if vec is not None:
+                _memory.move_to_end(k)
+                found[k] = vec
+    return found
+
+
+def _memory_put(items: Dict[bytes, np.ndarray]):
+    if EMBED_CACHE_MAX_ITEMS <= 0:
+        return
+    with _memory_lock:
+        for k, vec in items.items():
+            _memory[k] = vec
+            _memory.move_to_end(k)
+        while len(_memory) > EMBED_CACHE_MAX_ITEMS:
+            _memory.popitem(last=False)
+
+
+def _disk_get(keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+    conn = _open_disk()
+    found = {}
+    if conn is None or not keys:
+        return found
+    try:
+        with _disk_lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i : i + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                for sha, vec in conn.execute(f"SELECT sha, vec FROM embeddings WHERE sha IN ({marks})", batch):
+                    found[bytes(sha)] = np.frombuffer(vec, dtype=np.float32).copy()
+    except Exception as e:
+        logger.exception("Embedding disk cache read failed: %s", e)
+    return found
+
+
+def _disk_put(items: Dict[bytes, np.ndarray]):
+    conn = _open_disk()
+    if conn is None or not items:
+        return
+    try:
+        with _disk_lock:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (sha, vec) VALUES (?, ?)",
+                [(k, np.ascontiguousarray(v, dtype=np.float32).tobytes()) for k, v in items.items()],
+            )
+            conn.commit()
+    except Exception as e:
+        logger.exception("Embedding disk cache write failed: %s", e)
+
+
+def cache_stats() -> Dict[str, float]:
+    lookups = _stats["memory_hits"] + _stats["disk_hits"] + _stats["misses"]
+    hits = _stats["memory_hits"] + _stats["disk_hits"]
+    return {
+        "model": MODEL_NAME,
+        "namespace": EMBED_CACHE_NAMESPACE,
+        "memory_items": len(_memory),
+        **_stats,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
+
+
 def embed_texts(texts):
     """
     texts: List[str]
     returns: numpy array shape (len(texts), dim)
+    Only texts missing from both cache tiers are sent to the model (each distinct text once).
     """
     if not texts:
         import numpy as _np
         return _np.zeros((0, get_model().get_sentence_embedding_dimension()))
-    model = get_model()
-    embs = model.encode(texts, show_progress_bar=False, convert_to_numpy=True)
-    return embs
+    namespace = EMBED_CACHE_NAMESPACE
+    keys = [_text_key(t, namespace) for t in texts]
+    unique = list(dict.fromkeys(keys))
+
+    vectors = _memory_get(unique)
+    memory_hits = len(vectors)
+    from_disk = _disk_get([k for k in unique if k not in vectors])
+    vectors.update(from_disk)
+    if from_disk:
+        _memory_put(from_disk)
+
+    missing = [k for k in unique if k not in vectors]
+    if missing:
+        text_of = dict(zip(keys, texts))
+        embs = _encode([text_of[k] for k in missing])
+        fresh = {k: np.asarray(e, dtype=np.float32) for k, e in zip(missing, embs)}
+        vectors.update(fresh)
+        if namespace == EMBED_CACHE_NAMESPACE:  # not if loading the model fell back to another backend
+            _memory_put(fresh)
+            _disk_put(fresh)
+
+    with _memory_lock:
+        _stats["memory_hits"] += memory_hits
+        _stats["disk_hits"] += len(from_disk)
+        _stats["misses"] += len(missing)
+    return np.stack([vectors[k] for k in keys])
+
+
+def _dispatch_loop():
+    while True:
+        batch = [_query_queue.get()]
+        deadline = time.monotonic() + EMBED_BATCH_WAIT_MS / 1000.0
+        while len(batch) < EMBED_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_query_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            vectors = embed_texts([text for text, _ in batch])
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(vec)
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+        with _memory_lock:
+            _batch_stats["batches"] += 1
+            _batch_stats["queries"] += len(batch)
+            _batch_stats["max_batch"] = max(_batch_stats["max_batch"], len(batch))
+
+
+def _ensure_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        return
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = threading.Thread(target=_dispatch_loop, name="embed-query-batcher", daemon=True)
+            _dispatcher.start()
+
+
+def embed_query(text: str) -> np.ndarray:
+    """
+    Embed one query, shape (dim,). Cache hits return at once; misses wait (at most
+    EMBED_BATCH_WAIT_MS) to be encoded together with other concurrent queries.
+    """
+    cached = _memory_get([_text_key(text)])
+    if cached:
+        with _memory_lock:
+            _stats["memory_hits"] += 1
+        return next(iter(cached.values())).copy()
+    if EMBED_BATCH_WAIT_MS <= 0 or EMBED_BATCH_MAX <= 1:
+        return embed_texts([text])[0]
+    _ensure_dispatcher()
+    fut: Future = Future()
+    _query_queue.put((text, fut))
+    return fut.result()
+
+
+def query_batch_stats() -> Dict[str, float]:
+    with _memory_lock:
+        stats = dict(_batch_stats)
+    stats["avg_batch"] = round(stats["queries"] / stats["batches"], 2) if stats["batches"] else 0.0
+    stats["pending"] = _query_queue.qsize()
+    return stats
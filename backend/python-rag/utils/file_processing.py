@@ -4,8 +4,11 @@ import shutil
 import tempfile
 import logging
 import subprocess
+import time
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Callable, Iterator, Tuple, Dict, Any, Deque
 
 logger = logging.getLogger(__name__)
 
@@ -60,112 +63,297 @@ def _import_easyocr():
         logger.debug("easyocr not available: %s", e)
         return None
 
-# Extraction helpers
-def extract_text_from_pdf(path: str) -> str:
-    # 1) try pdfplumber
-    pdfplumber = _import_pdfplumber()
-    if pdfplumber:
-        try:
-            parts = []
-            with pdfplumber.open(path) as pdf:
-                for page in pdf.pages:
-                    txt = page.extract_text()
-                    if txt:
-                        parts.append(txt)
-            if parts:
-                return "\n\n".join(parts).strip()
-        except Exception:
-            logger.exception("pdfplumber extraction failed for %s", path)
+# on_page(done, total, info) is called after each PDF page, for progress reporting;
+# info = {"page": n, "method": ..., "ms": ..., "chars": ...} (see iter_pdf_pages)
+PageCallback = Optional[Callable[[int, int, Dict[str, Any]], None]]
+
+# plain text files are streamed in blocks of this many characters
+TEXT_BLOCK_CHARS = int(os.environ.get("TEXT_BLOCK_CHARS", str(1 << 20)))
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+# a page whose text layer has fewer non-space characters than this is OCR'd; the
+# text layer is still used when OCR is unavailable or reads less
+PDF_MIN_PAGE_CHARS = int(os.environ.get("PDF_MIN_PAGE_CHARS", "16"))
+# part of the artifact keys (utils/artifacts.py): bump when extraction output changes
+EXTRACTOR_VERSION = "2"
+
+# this process's OCR engine (see ocr_engine)
+_ocr_engine: Optional[Tuple[str, Any]] = None
+_ocr_engine_lock = threading.Lock()
+
 
-    # 2) try PyPDF2
-    PyPDF2 = _import_pypdf2()
-    if PyPDF2:
+def _report(on_page: PageCallback, done: int, total: int, info: Dict[str, Any]):
+    if on_page is not None:
         try:
-            parts = []
-            with open(path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for p in reader.pages:
-                    try:
-                        t = p.extract_text()
-                    except Exception:
-                        t = ""
-                    if t:
-                        parts.append(t)
-            if parts:
-                return "\n\n".join(parts).strip()
+            on_page(done, total, info)
         except Exception:
-            logger.exception("PyPDF2 extraction failed for %s", path)
+            logger.exception("page progress callback failed")
+
+
+def _chars(txt: Optional[str]) -> int:
+    return sum(1 for c in txt if not c.isspace()) if txt else 0
+
+
+def _usable(txt: Optional[str]) -> bool:
+    return _chars(txt) >= PDF_MIN_PAGE_CHARS
+
 
-    # 3) try PyMuPDF (fitz)
-    fitz = _import_pymupdf()
-    if fitz:
+class _PdfPages:
+    """
+    One PDF opened lazily in each available backend, read page by page. Text layers
+    are tried fastest first (PyMuPDF, pdfplumber, PyPDF2); a page none of them
+    has usable text for is rasterized on its own and OCR'd.
+    """
+
+    TEXT_METHODS = ("pymupdf", "pdfplumber", "pypdf2")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._handles: Dict[str, Any] = {}
+        self._failed: set = set()
+
+    def _open(self, method: str):
+        if method in self._handles or method in self._failed:
+            return self._handles.get(method)
+        handle = None
         try:
-            doc = fitz.open(path)
-            pages_text = []
-            for p in doc:
-                try:
-                    pages_text.append(p.get_text())
-                except Exception:
-                    continue
-            if pages_text:
-                doc.close()
-                return "\n\n".join([t for t in pages_text if t]).strip()
-            doc.close()
+            if method == "pymupdf":
+                fitz = _import_pymupdf()
+                handle = fitz.open(self.path) if fitz else None
+            elif method == "pdfplumber":
+                pdfplumber = _import_pdfplumber()
+                handle = pdfplumber.open(self.path) if pdfplumber else None
+            elif method == "pypdf2":
+                PyPDF2 = _import_pypdf2()
+                handle = PyPDF2.PdfReader(self.path) if PyPDF2 else None
         except Exception:
-            logger.exception("PyMuPDF extraction failed for %s", path)
+            logger.exception("%s could not open %s", method, self.path)
+            handle = None
+        if handle is None:
+            self._failed.add(method)
+        else:
+            self._handles[method] = handle
+        return handle
+
+    def page_count(self) -> int:
+        for method in self.TEXT_METHODS:
+            handle = self._open(method)
+            if handle is None:
+                continue
+            if method == "pymupdf":
+                return handle.page_count
+            return len(handle.pages)
+        pdf2image, _, _ = _import_pdf2image_and_pytesseract()
+        if pdf2image:
+            try:
+                return int(pdf2image.pdfinfo_from_path(self.path)["Pages"])
+            except Exception:
+                logger.exception("pdfinfo failed for %s", self.path)
+        return 0
 
-    # 4) OCR fallback (pytesseract/pdf2image)
-    pdf2image, pytesseract, Image = _import_pdf2image_and_pytesseract()
-    if pdf2image and pytesseract:
+    def text(self, method: str, index: int) -> Optional[str]:
+        handle = self._open(method)
+        if handle is None:
+            return None
         try:
-            pages = pdf2image.convert_from_path(path, dpi=200)
-            txts = []
-            for im in pages:
+            if method == "pymupdf":
+                return handle[index].get_text()
+            if method == "pdfplumber":
+                page = handle.pages[index]
                 try:
-                    txt = pytesseract.image_to_string(im)
-                    if txt and txt.strip():
-                        txts.append(txt)
-                except Exception:
-                    logger.exception("tesseract failed on page")
-            if txts:
-                return "\n\n".join(txts).strip()
+                    return page.extract_text()
+                finally:
+                    # drop the parsed page objects so memory does not grow with the page count
+                    page.flush_cache()
+            return handle.pages[index].extract_text()
         except Exception:
-            logger.exception("pytesseract/pdf2image OCR failed for %s", path)
+            logger.debug("%s failed on page %d of %s", method, index + 1, self.path, exc_info=True)
+            return None
 
-    # 5) easyocr fallback
-    easyocr = _import_easyocr()
-    if easyocr:
-        try:
-            reader = easyocr.Reader(["en"], gpu=False)
-            pdf2image_mod, _, _ = _import_pdf2image_and_pytesseract()
-            if pdf2image_mod:
-                pages = pdf2image_mod.convert_from_path(path, dpi=200)
-                all_text = []
-                for p in pages:
-                    res = reader.readtext(p)
-                    page_text = " ".join([r[1] for r in res])
-                    if page_text.strip():
-                        all_text.append(page_text)
-                if all_text:
-                    return "\n\n".join(all_text).strip()
-        except Exception:
-            logger.exception("easyocr fallback failed for %s", path)
+    def image(self, index: int):
+        """Rasterize one page (pdf2image/poppler, else PyMuPDF) as a PIL image."""
+        pdf2image, _, _ = _import_pdf2image_and_pytesseract()
+        if pdf2image:
+            try:
+                images = pdf2image.convert_from_path(
+                    self.path, dpi=OCR_DPI, first_page=index + 1, last_page=index + 1
+                )
+                if images:
+                    return images[0]
+            except Exception:
+                logger.debug("pdf2image failed on page %d of %s", index + 1, self.path, exc_info=True)
+        doc = self._open("pymupdf")
+        if doc is not None:
+            from PIL import Image
 
-    return ""
+            pix = doc[index].get_pixmap(dpi=OCR_DPI)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        return None
 
+    def ocr(self, index: int) -> Tuple[Optional[str], str]:
+        """(text, method) for one page; method is "none" when no OCR engine is available."""
+        engine = ocr_engine()
+        if engine is None:
+            return None, "none"
+        im = self.image(index)
+        if im is None:
+            return None, "none"
+        name, impl = engine
+        if name == "tesseract":
+            return impl.image_to_string(im), name
+        import numpy as np
 
-def extract_text_from_docx(path: str) -> str:
+        res = impl.readtext(np.asarray(im))
+        return " ".join([r[1] for r in res]), name
+
+    def close(self):
+        for method, handle in self._handles.items():
+            try:
+                if hasattr(handle, "close"):
+                    handle.close()
+            except Exception:
+                logger.debug("closing %s handle failed", method, exc_info=True)
+        self._handles.clear()
+
+
+def ocr_engine() -> Optional[Tuple[str, Any]]:
+    """
+    This process's OCR engine, created once and reused for every page:
+    ("tesseract", pytesseract), ("easyocr", Reader) or None when neither is installed.
+    """
+    global _ocr_engine
+    if _ocr_engine is None:
+        with _ocr_engine_lock:
+            if _ocr_engine is None:
+                _, pytesseract, _ = _import_pdf2image_and_pytesseract()
+                easyocr = None if pytesseract else _import_easyocr()
+                if pytesseract:
+                    _ocr_engine = ("tesseract", pytesseract)
+                elif easyocr:
+                    _ocr_engine = ("easyocr", easyocr.Reader(["en"], gpu=False))
+                else:
+                    _ocr_engine = ("", None)
+    return _ocr_engine if _ocr_engine[1] is not None else None
+
+
+def _ocr_available() -> bool:
+    """True when an OCR engine can be loaded, without loading it."""
+    if _ocr_engine is not None:
+        return _ocr_engine[1] is not None
+    _, pytesseract, _ = _import_pdf2image_and_pytesseract()
+    return bool(pytesseract or _import_easyocr())
+
+
+def timed_ocr(pages: "_PdfPages", index: int) -> Tuple[Optional[str], str, float]:
+    start = time.perf_counter()
+    try:
+        txt, method = pages.ocr(index)
+    except Exception:
+        logger.exception("OCR failed on page %d of %s", index + 1, pages.path)
+        txt, method = None, "none"
+    return txt, method, (time.perf_counter() - start) * 1000.0
+
+
+# Extraction helpers
+def iter_pdf_pages(path: str, on_page: PageCallback = None) -> Iterator[str]:
+    """
+    Yield a PDF's text page by page (pages after the first prefixed with a blank line,
+    so the pieces concatenate to the document text). Each page uses the fastest text
+    layer that has usable text, and only pages without one are OCR'd, on the OCR
+    process pool when enabled (up to OCR_MAX_INFLIGHT pages ahead, in page order).
+    A short text layer is kept when OCR is unavailable or reads fewer characters.
+    on_page gets the page's method ("pymupdf", "pdfplumber", "pypdf2", "tesseract",
+    "easyocr" or "none"), time in ms and character count.
+    """
+    from utils import ocr_pool
+
+    pages = _PdfPages(path)
+    # [index, text-layer ms, text, method, OCR future or None, (short text-layer text,
+    # method) or None], in page order
+    pending: Deque[list] = deque()
+    produced = False
+
+    def emit(entry) -> Iterator[str]:
+        nonlocal produced
+        i, ms, txt, method, fut, short = entry
+        if fut is not None:
+            try:
+                txt, method, ocr_ms = fut.result()
+            except Exception:
+                logger.exception("OCR pool failed on page %d of %s; retrying in-process", i + 1, path)
+                ocr_pool.failed(fut)
+                txt, method, ocr_ms = timed_ocr(pages, i)
+            ms += ocr_ms
+        if short is not None and _chars(txt) < _chars(short[0]):
+            txt, method = short
+        _report(on_page, i + 1, total, {"page": i + 1, "method": method, "ms": round(ms, 1), "chars": len(txt or "")})
+        if txt and txt.strip():
+            yield ("\n\n" if produced else "") + txt
+            produced = True
+
+    try:
+        total = pages.page_count()
+        for i in range(total):
+            start = time.perf_counter()
+            entry = [i, 0.0, None, "none", None, None]
+            for candidate in _PdfPages.TEXT_METHODS:
+                t = pages.text(candidate, i)
+                if _usable(t):
+                    entry[2], entry[3] = t, candidate
+                    break
+                if _chars(t) > _chars(entry[5][0] if entry[5] else None):
+                    entry[5] = (t, candidate)
+            entry[1] = (time.perf_counter() - start) * 1000.0
+            if entry[2] is None:
+                entry[4] = ocr_pool.submit(path, i) if _ocr_available() else None
+                if entry[4] is None:
+                    entry[2], entry[3], ocr_ms = timed_ocr(pages, i)
+                    entry[1] += ocr_ms
+            pending.append(entry)
+            # emit finished pages in order; wait once too many OCR pages are in flight
+            while pending and (
+                pending[0][4] is None or pending[0][4].done() or len(pending) > ocr_pool.OCR_MAX_INFLIGHT
+            ):
+                yield from emit(pending.popleft())
+        while pending:
+            yield from emit(pending.popleft())
+    finally:
+        for entry in pending:
+            if entry[4] is not None:
+                entry[4].cancel()
+        pages.close()
+
+
+def extract_text_from_pdf(path: str, on_page: PageCallback = None) -> str:
+    return "".join(iter_pdf_pages(path, on_page=on_page)).strip()
+
+
+def iter_docx_sections(path: str) -> Iterator[str]:
     docx = _import_docx()
     if not docx:
         logger.debug("python-docx not installed; cannot read .docx")
-        return ""
+        return
     try:
         d = docx.Document(path)
-        paragraphs = [p.text for p in d.paragraphs if p.text and p.text.strip()]
-        return "\n\n".join(paragraphs).strip()
+        first = True
+        for p in d.paragraphs:
+            if p.text and p.text.strip():
+                yield ("" if first else "\n\n") + p.text
+                first = False
     except Exception:
         logger.exception("Failed to extract text from docx %s", path)
-        return ""
+
+
+def extract_text_from_docx(path: str) -> str:
+    return "".join(iter_docx_sections(path)).strip()
+
+
+def _iter_text_file(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_CHARS)
+            if not block:
+                return
+            yield block
 
 
 def convert_doc_to_docx_win32(src_path: str, dst_path: str) -> bool:
@@ -221,72 +409,64 @@ def convert_doc_to_docx_libreoffice(src_path: str, dst_path: str) -> bool:
         return False
 
 
-def extract_text_simple(path: str) -> str:
+def iter_text_sections(path: str, on_page: PageCallback = None) -> Iterator[str]:
+    """
+    Stream a file's text as pieces (pages, paragraphs or blocks) whose concatenation
+    is the text extract_text_simple returns, so large files never sit in memory whole.
+    """
     if not path or not os.path.exists(path):
-        logger.debug("extract_text_simple: path missing or does not exist: %s", path)
-        return ""
+        logger.debug("iter_text_sections: path missing or does not exist: %s", path)
+        return
 
     p = Path(path)
     ext = p.suffix.lower()
-    tmpdir = tempfile.mkdtemp(prefix="extract_")
-    tmp_path = os.path.join(tmpdir, p.name)
-    try:
-        shutil.copy2(path, tmp_path)
-    except Exception:
-        tmp_path = path
+    if ext in [".txt", ".md", ".csv", ".json"]:
+        try:
+            yield from _iter_text_file(path)
+        except Exception:
+            logger.exception("Failed reading plain text file %s", path)
+        return
 
-    try:
-        if ext in [".txt", ".md", ".csv", ".json"]:
-            try:
-                with open(tmp_path, "r", encoding="utf-8", errors="ignore") as f:
-                    return f.read().strip()
-            except Exception:
-                logger.exception("Failed reading plain text file %s", tmp_path)
-                return ""
-
-        if ext == ".pdf":
-            logger.debug("Attempting pdf extraction for %s", tmp_path)
-            txt = extract_text_from_pdf(tmp_path)
-            if txt:
-                logger.info("PDF extraction succeeded for %s (len=%d)", tmp_path, len(txt))
-                return txt
-            logger.info("No PDF text extracted for %s", tmp_path)
-            return ""
-
-        if ext == ".docx":
-            txt = extract_text_from_docx(tmp_path)
-            if txt:
-                logger.info("DOCX extraction succeeded for %s (len=%d)", tmp_path, len(txt))
-                return txt
-            logger.info("python-docx returned no text for %s", tmp_path)
-            return ""
-
-        if ext == ".doc":
-            logger.info("DOC file detected - trying MS Word COM conversion for %s", tmp_path)
+    if ext == ".pdf":
+        logger.debug("Attempting pdf extraction for %s", path)
+        yield from iter_pdf_pages(path, on_page=on_page)
+        return
+
+    if ext == ".docx":
+        yield from iter_docx_sections(path)
+        return
+
+    if ext == ".doc":
+        logger.info("DOC file detected - trying MS Word COM conversion for %s", path)
+        # the converted copy is the only file written
+        tmpdir = tempfile.mkdtemp(prefix="extract_")
+        try:
             target_docx = os.path.join(tmpdir, p.stem + ".docx")
-            ok = convert_doc_to_docx_win32(tmp_path, target_docx)
+            ok = convert_doc_to_docx_win32(path, target_docx)
             if not ok:
-                ok = convert_doc_to_docx_libreoffice(tmp_path, target_docx)
+                ok = convert_doc_to_docx_libreoffice(path, target_docx)
             if ok and os.path.exists(target_docx):
-                txt = extract_text_from_docx(target_docx)
-                if txt:
-                    logger.info("DOC conversion+extraction succeeded for %s (len=%d)", tmp_path, len(txt))
-                    return txt
-                else:
-                    logger.info("Converted DOC produced no text for %s", tmp_path)
-                    return ""
-            logger.info("No extractable text from .doc file %s (conversion failed)", tmp_path)
-            return ""
-
-        # fallback: try read as text
-        try:
-            with open(tmp_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read().strip()
-        except Exception:
-            return ""
-    finally:
-        try:
-            if os.path.exists(tmpdir):
+                yield from iter_docx_sections(target_docx)
+                return
+            logger.info("No extractable text from .doc file %s (conversion failed)", path)
+            return
+        finally:
+            try:
                 shutil.rmtree(tmpdir)
-        except Exception:
-            pass
+            except Exception:
+                pass
+
+    # fallback: try read as text
+    try:
+        yield from _iter_text_file(path)
+    except Exception:
+        return
+
+
+def extract_text_simple(path: str, on_page: PageCallback = None) -> str:
+    txt = "".join(iter_text_sections(path, on_page=on_page)).strip()
+    if txt:
+        logger.info("Extracted text from %s (len=%d)", path, len(txt))
+    else:
+        logger.info("No text extracted for %s", path)
+    return txt
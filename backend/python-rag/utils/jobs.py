@@ -0,0 +1,344 @@
+# python-rag/utils/jobs.py
+import os
+import uuid
+import time
+import queue
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List, Optional, Set
+
+from pymongo import ReturnDocument
+
+from utils.mongo_client import get_db
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs. Each job is a document in the `jobs` collection, so it
+# survives restarts and JOB_WORKERS threads run at most that many jobs at once.
+# A running job records the process running it (workerId) and a lease (leaseUntil)
+# that process renews every JOB_LEASE_S / 3 while the job runs. A job whose lease ran
+# out (its process died) goes back on the queue and runs again from the start
+# (handlers must clean up a previous partial run, see JobContext.resumed); so do the
+# running jobs of this JOB_WORKER_ID when it starts. Jobs of other live processes
+# sharing the database are left alone.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_PROGRESS_INTERVAL_S = float(os.environ.get("JOB_PROGRESS_INTERVAL_S", "1.0"))
+JOB_LEASE_S = float(os.environ.get("JOB_LEASE_S", "120"))
+# stable across restarts (e.g. the replica name) to resume this process's jobs at once
+# instead of when their lease runs out
+JOB_WORKER_ID = os.environ.get("JOB_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+UNFINISHED = (QUEUED, RUNNING)
+
+_handlers: Dict[str, Callable[[Dict[str, Any], "JobContext"], Dict[str, Any]]] = {}
+_queue: "queue.Queue[str]" = queue.Queue()
+_workers: List[threading.Thread] = []
+_heartbeat: Optional[threading.Thread] = None
+_stop = threading.Event()
+_running = 0
+_running_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised by JobContext.check_cancelled once the job was cancelled while running."""
+
+
+class JobLost(JobCancelled):
+    """Raised by JobContext.check_cancelled once another worker took the job over (its lease ran out)."""
+
+
+class JobContext:
+    """Handed to a job handler to report its stage and progress."""
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job_id = job["id"]
+        # > 1 when an earlier attempt was interrupted and may have left partial results
+        self.attempt = int(job.get("attempts") or 1)
+        self.progress: Dict[str, Any] = dict(job.get("progress") or {})
+        # files deleted while a job over several files (fileIds) runs; the job drops them
+        self.cancelled_files: Set[str] = set(job.get("cancelledFileIds") or [])
+        self._last_write = 0.0
+
+    @property
+    def resumed(self) -> bool:
+        return self.attempt > 1
+
+    def check_cancelled(self):
+        """
+        Call between units of work: raises JobCancelled if the job was cancelled (e.g.
+        its file was deleted), JobLost if another worker runs it now. Also refreshes
+        cancelled_files.
+        """
+        try:
+            job = get_db().jobs.find_one(
+                {"id": self.job_id}, {"_id": 0, "status": 1, "workerId": 1, "cancelledFileIds": 1}
+            )
+        except Exception as e:
+            # keep going; the next check may get through
+            logger.exception("Failed to read the status of job %s: %s", self.job_id, e)
+            return
+        if job is None or job.get("status") == CANCELLED:
+            raise JobCancelled(f"job {self.job_id} cancelled")
+        if job.get("status") != RUNNING or job.get("workerId") != JOB_WORKER_ID:
+            raise JobLost(f"job {self.job_id} taken over by another worker")
+        self.cancelled_files.update(job.get("cancelledFileIds") or [])
+
+    def stage(self, name: str, **progress):
+        """Enter a new stage; written at once."""
+        self.progress.update(progress)
+        self._write({"stage": name})
+
+    def update(self, **progress):
+        """Progress within the current stage; written at most every JOB_PROGRESS_INTERVAL_S."""
+        self.progress.update(progress)
+        if time.monotonic() - self._last_write >= JOB_PROGRESS_INTERVAL_S:
+            self._write({})
+
+    def _write(self, fields: Dict[str, Any]):
+        self._last_write = time.monotonic()
+        fields = dict(fields, progress=dict(self.progress), updatedAt=datetime.utcnow())
+        try:
+            get_db().jobs.update_one({"id": self.job_id}, {"$set": fields})
+        except Exception as e:
+            # progress is informational; the job keeps running
+            logger.exception("Failed to record progress for job %s: %s", self.job_id, e)
+
+
+def register_handler(kind: str, handler: Callable[[Dict[str, Any], JobContext], Dict[str, Any]]):
+    """handler(payload, ctx) runs the job and returns its result (stored on the job)."""
+    _handlers[kind] = handler
+
+
+def _public(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if job is not None:
+        job.pop("_id", None)
+    return job
+
+
+def submit(
+    kind: str,
+    payload: Dict[str, Any],
+    owner_id: str,
+    file_id: Optional[str] = None,
+    file_ids: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Record a job and queue it. An unfinished job of the same kind for the same file
+    is returned instead of starting a second one. file_ids lists the files of a job
+    over several files, so cancel_file_jobs finds it.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"unknown job kind {kind}")
+    db = get_db()
+    if file_id is not None:
+        existing = db.jobs.find_one(
+            {"kind": kind, "ownerId": owner_id, "fileId": file_id, "status": {"$in": list(UNFINISHED)}}
+        )
+        if existing is not None:
+            return _public(existing)
+    now = datetime.utcnow()
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "ownerId": owner_id,
+        "fileId": file_id,
+        "fileIds": list(file_ids or []),
+        "payload": payload,
+        "status": QUEUED,
+        "stage": QUEUED,
+        "progress": {},
+        "attempts": 0,
+        "error": None,
+        "result": None,
+        "createdAt": now,
+        "updatedAt": now,
+        "startedAt": None,
+        "finishedAt": None,
+    }
+    db.jobs.insert_one(job)
+    _queue.put(job["id"])
+    return _public(job)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_db().jobs.find_one({"id": job_id}, {"_id": 0})
+
+
+def cancel_file_jobs(owner_id: str, file_id: str) -> int:
+    """
+    Cancel the file's unfinished jobs (e.g. the file was deleted). Queued ones never
+    start; running ones stop at their next JobContext.check_cancelled. Jobs over
+    several files keep going without it: the file is added to their cancelledFileIds.
+    """
+    db = get_db()
+    now = datetime.utcnow()
+    res = db.jobs.update_many(
+        {"ownerId": owner_id, "fileId": file_id, "status": {"$in": list(UNFINISHED)}},
+        {"$set": {"status": CANCELLED, "stage": CANCELLED, "finishedAt": now}},
+    )
+    bulk = db.jobs.update_many(
+        {"ownerId": owner_id, "fileIds": file_id, "status": {"$in": list(UNFINISHED)}},
+        {"$addToSet": {"cancelledFileIds": file_id}, "$set": {"updatedAt": now}},
+    )
+    return res.modified_count + bulk.modified_count
+
+
+def _finish(job_id: str, status: str, **fields):
+    # only while the job is still ours: not over a cancellation or another worker's attempt
+    now = datetime.utcnow()
+    get_db().jobs.update_one(
+        {"id": job_id, "status": RUNNING, "workerId": JOB_WORKER_ID},
+        {"$set": dict(fields, status=status, stage=status, finishedAt=now, updatedAt=now)},
+    )
+
+
+def _run(job_id: str):
+    global _running
+    db = get_db()
+    now = datetime.utcnow()
+    # claim the job; a job that was cancelled or claimed elsewhere meanwhile is skipped
+    job = db.jobs.find_one_and_update(
+        {"id": job_id, "status": QUEUED},
+        {
+            "$set": {
+                "status": RUNNING,
+                "stage": "starting",
+                "workerId": JOB_WORKER_ID,
+                "leaseUntil": now + timedelta(seconds=JOB_LEASE_S),
+                "startedAt": now,
+                "updatedAt": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return
+    handler = _handlers.get(job.get("kind"))
+    if handler is None:
+        _finish(job_id, FAILED, error=f"no handler for job kind {job.get('kind')}")
+        return
+    ctx = JobContext(job)
+    with _running_lock:
+        _running += 1
+    try:
+        result = handler(job.get("payload") or {}, ctx)
+        _finish(job_id, DONE, result=result, progress=ctx.progress)
+        logger.info("Job %s (%s) done", job_id, job.get("kind"))
+    except JobCancelled as e:
+        logger.info("Job %s (%s) stopped: %s", job_id, job.get("kind"), e)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed: %s", job_id, job.get("kind"), e)
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        _finish(job_id, FAILED, error=str(detail), progress=ctx.progress)
+    finally:
+        with _running_lock:
+            _running -= 1
+
+
+def _worker_loop():
+    while not _stop.is_set():
+        try:
+            job_id = _queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        try:
+            _run(job_id)
+        except Exception as e:
+            logger.exception("Job worker error on %s: %s", job_id, e)
+
+
+def _requeue_interrupted(own: bool = False) -> int:
+    """
+    Put running jobs whose lease ran out back on the queue, oldest first; with own,
+    also the ones recorded as this JOB_WORKER_ID's (left over from before a restart).
+    """
+    db = get_db()
+    now = datetime.utcnow()
+    interrupted: List[Dict[str, Any]] = [{"leaseUntil": {"$lt": now}}, {"leaseUntil": None}]
+    if own:
+        interrupted.append({"workerId": JOB_WORKER_ID})
+    count = 0
+    for job in db.jobs.find({"status": RUNNING, "$or": interrupted}, {"id": 1, "attempts": 1}).sort("createdAt", 1):
+        # the same condition again: a live worker may have renewed the lease meanwhile
+        cond = {"id": job["id"], "status": RUNNING, "$or": interrupted}
+        if int(job.get("attempts") or 0) >= JOB_MAX_ATTEMPTS:
+            # interrupted too often: most likely the job itself takes the process down
+            update = {"status": FAILED, "stage": FAILED, "error": "interrupted too many times", "finishedAt": now}
+        else:
+            update = {"status": QUEUED, "stage": QUEUED, "updatedAt": now}
+        res = db.jobs.update_one(cond, {"$set": update})
+        if res.modified_count and update["status"] == QUEUED:
+            _queue.put(job["id"])
+            count += 1
+    return count
+
+
+def _requeue_unfinished() -> int:
+    """On startup: queue the waiting jobs and the interrupted ones, oldest first."""
+    count = _requeue_interrupted(own=True)
+    for job in get_db().jobs.find({"status": QUEUED}, {"id": 1}).sort("createdAt", 1):
+        _queue.put(job["id"])
+        count += 1
+    return count
+
+
+def _heartbeat_loop():
+    """Renew the lease of this process's running jobs; requeue jobs of processes that died."""
+    while not _stop.wait(JOB_LEASE_S / 3):
+        try:
+            get_db().jobs.update_many(
+                {"status": RUNNING, "workerId": JOB_WORKER_ID},
+                {"$set": {"leaseUntil": datetime.utcnow() + timedelta(seconds=JOB_LEASE_S)}},
+            )
+            resumed = _requeue_interrupted()
+            if resumed:
+                logger.info("Resuming %d jobs whose worker stopped renewing them", resumed)
+        except Exception as e:
+            logger.exception("Job heartbeat failed: %s", e)
+
+
+def start_workers():
+    global _heartbeat
+    if _workers:
+        return
+    _stop.clear()
+    try:
+        resumed = _requeue_unfinished()
+        if resumed:
+            logger.info("Resuming %d unfinished jobs", resumed)
+    except Exception as e:
+        logger.exception("Failed to requeue unfinished jobs: %s", e)
+    for i in range(max(1, JOB_WORKERS)):
+        t = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    _heartbeat = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+    _heartbeat.start()
+
+
+def stop_workers(timeout: float = 5.0):
+    """
+    Stop taking jobs. Jobs still running are requeued once their lease runs out, or
+    by the next start_workers with the same JOB_WORKER_ID.
+    """
+    global _heartbeat
+    _stop.set()
+    for t in _workers:
+        t.join(timeout=timeout)
+    _workers.clear()
+    if _heartbeat is not None:
+        _heartbeat.join(timeout=timeout)
+        _heartbeat = None
+
+
+def job_stats() -> Dict[str, Any]:
+    return {"worker_id": JOB_WORKER_ID, "workers": len(_workers), "running": _running, "queued": _queue.qsize()}
@@ -0,0 +1,329 @@
+# python-rag/utils/lexical_index.py
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+from utils.mongo_client import get_db
+from utils.locks import RWLock
+from utils.text_store import chunk_texts
+
+logger = logging.getLogger(__name__)
+
+# Per-owner BM25 inverted index over chunk texts, kept in memory next to the FAISS
+# stores. It is built from Mongo on first use after a restart and then maintained
+# incrementally by process_file (add_chunks) and file deletion (delete_file).
+LEXICAL_CACHE_MAX_OWNERS = int(os.environ.get("LEXICAL_CACHE_MAX_OWNERS", "256"))
+LEXICAL_COMPACT_RATIO = float(os.environ.get("LEXICAL_COMPACT_RATIO", "0.25"))
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+# words, plus compound identifiers such as AB-1234, v2.1.0, E_1002 or 10.0.0.1:8080
+_TOKEN_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+_SPLIT_RE = re.compile(r"[-./:_]+")
+
+_indexes: "OrderedDict[str, OwnerLexicalIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+# owner -> [load lock, threads using it]; dropped when the last one is done
+_load_locks: Dict[str, List[Any]] = {}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased tokens. Compound identifiers are kept whole (so an exact part number
+    or error code matches strongly) and also split into their parts.
+    """
+    tokens = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        tokens.append(tok)
+        if not tok.isalnum():
+            parts = [p for p in _SPLIT_RE.split(tok) if p]
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+class OwnerLexicalIndex:
+    """
+    BM25 over one owner's chunks. Documents are numbered in insertion order; postings
+    map term -> (doc numbers, term frequencies). Deleting a file only marks its
+    documents dead; postings are rewritten once dead documents reach
+    LEXICAL_COMPACT_RATIO. lock: searches shared, add/delete exclusive.
+    """
+
+    def __init__(self, owner_id: str):
+        self.owner_id = owner_id
+        self.chunk_ids: List[Optional[str]] = []
+        self.file_ids: List[str] = []
+        self.chunk_indexes: List[Optional[int]] = []
+        self.doc_lens: List[int] = []
+        self.alive: List[bool] = []
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._keys: Dict[Tuple[str, Optional[int]], int] = {}
+        self._file_docs: Dict[str, List[int]] = {}
+        self.live_docs = 0
+        self.total_len = 0
+        # numpy views of postings / lengths / liveness, rebuilt lazily after mutations
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lens: Optional[np.ndarray] = None
+        self._alive: Optional[np.ndarray] = None
+        self.lock = RWLock()
+
+    @property
+    def dead_docs(self) -> int:
+        return len(self.doc_lens) - self.live_docs
+
+    # --- mutations (caller holds lock.write()) ---------------------------------
+
+    def add(self, file_id: str, texts: List[str], chunk_ids: List[Optional[str]], chunk_indexes: List[Optional[int]]) -> int:
+        added = 0
+        for text, chunk_id, chunk_index in zip(texts, chunk_ids, chunk_indexes):
+            key = (file_id, chunk_index)
+            if key in self._keys:
+                continue  # already indexed (add raced with the initial build from Mongo)
+            doc = len(self.doc_lens)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                docs_tfs = self.postings.get(term)
+                if docs_tfs is None:
+                    docs_tfs = self.postings[term] = ([], [])
+                docs_tfs[0].append(doc)
+                docs_tfs[1].append(tf)
+                self._arrays.pop(term, None)
+            length = sum(counts.values())
+            self.chunk_ids.append(chunk_id)
+            self.file_ids.append(file_id)
+            self.chunk_indexes.append(chunk_index)
+            self.doc_lens.append(length)
+            self.alive.append(True)
+            self._keys[key] = doc
+            self._file_docs.setdefault(file_id, []).append(doc)
+            self.live_docs += 1
+            self.total_len += length
+            added += 1
+        if added:
+            self._lens = None
+            self._alive = None
+        return added
+
+    def delete_file(self, file_id: str) -> int:
+        docs = self._file_docs.pop(file_id, [])
+        for doc in docs:
+            self.alive[doc] = False
+            self.live_docs -= 1
+            self.total_len -= self.doc_lens[doc]
+            self._keys.pop((file_id, self.chunk_indexes[doc]), None)
+        if docs:
+            self._alive = None
+            if self.dead_docs >= LEXICAL_COMPACT_RATIO * max(1, len(self.doc_lens)):
+                self.compact()
+        return len(docs)
+
+    def compact(self):
+        """Drop dead documents and renumber the survivors (no re-tokenizing)."""
+        alive = np.array(self.alive, dtype=bool)
+        remap = np.cumsum(alive) - 1
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for term, (docs, tfs) in self.postings.items():
+            docs_arr = np.asarray(docs, dtype=np.int64)
+            keep = alive[docs_arr]
+            if keep.any():
+                postings[term] = (remap[docs_arr[keep]].tolist(), np.asarray(tfs)[keep].tolist())
+        survivors = np.flatnonzero(alive).tolist()
+        self.chunk_ids = [self.chunk_ids[d] for d in survivors]
+        self.file_ids = [self.file_ids[d] for d in survivors]
+        self.chunk_indexes = [self.chunk_indexes[d] for d in survivors]
+        self.doc_lens = [self.doc_lens[d] for d in survivors]
+        self.alive = [True] * len(survivors)
+        self.postings = postings
+        self._keys = {(f, c): doc for doc, (f, c) in enumerate(zip(self.file_ids, self.chunk_indexes))}
+        self._file_docs = {}
+        for doc, f in enumerate(self.file_ids):
+            self._file_docs.setdefault(f, []).append(doc)
+        self._arrays = {}
+        self._lens = None
+        self._alive = None
+
+    # --- search (caller holds lock.read()) -------------------------------------
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            docs_tfs = self.postings.get(term)
+            if docs_tfs is None:
+                return None
+            arrays = (np.asarray(docs_tfs[0], dtype=np.int64), np.asarray(docs_tfs[1], dtype=np.float32))
+            self._arrays[term] = arrays  # single dict store, safe under the shared lock
+        return arrays
+
+    def search(self, query: str, top_k: int, file_ids: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """
+        Return [(doc number, BM25 score)] best first; only documents matching a query term
+        (and belonging to file_ids, when given). Corpus statistics stay owner-wide.
+        """
+        if self.live_docs <= 0:
+            return []
+        lens = self._lens
+        if lens is None:
+            lens = self._lens = np.asarray(self.doc_lens, dtype=np.float32)
+        alive = self._alive
+        if alive is None:
+            alive = self._alive = np.asarray(self.alive, dtype=bool)
+        n = self.live_docs
+        avgdl = max(1e-6, self.total_len / n)
+        scores = np.zeros(len(lens), dtype=np.float32)
+        for term in set(tokenize(query)):
+            arrays = self._term_arrays(term)
+            if arrays is None:
+                continue
+            docs, tfs = arrays
+            df = int(np.count_nonzero(alive[docs]))
+            if not df:
+                continue
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lens[docs] / avgdl)
+            scores[docs] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+        scores[~alive] = 0.0
+        if file_ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            for f in set(file_ids):
+                docs = self._file_docs.get(f)
+                if docs:
+                    allowed[docs] = True
+            scores[~allowed] = 0.0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(d), float(scores[d])) for d in hits]
+
+    def hit(self, doc: int, score: float) -> Dict[str, Any]:
+        return {
+            "fileId": self.file_ids[doc],
+            "chunkIndex": self.chunk_indexes[doc],
+            "chunkId": self.chunk_ids[doc],
+            "score": score,
+        }
+
+
+def _build_from_mongo(owner_id: str) -> OwnerLexicalIndex:
+    index = OwnerLexicalIndex(owner_id)
+    by_file: Dict[str, List[Dict]] = {}
+    db = get_db()
+    fields = {"id": 1, "fileId": 1, "chunkIndex": 1, "text": 1, "textId": 1, "start": 1, "end": 1}
+    for c in db.chunks.find({"ownerId": owner_id}, fields):
+        by_file.setdefault(c.get("fileId"), []).append(c)
+    for file_id, chunks in by_file.items():
+        chunks.sort(key=lambda c: c.get("chunkIndex") if c.get("chunkIndex") is not None else -1)
+        index.add(
+            file_id,
+            chunk_texts(chunks),
+            [c.get("id") for c in chunks],
+            [c.get("chunkIndex") for c in chunks],
+        )
+    logger.info("Built lexical index for %s: %d chunks, %d terms", owner_id, index.live_docs, len(index.postings))
+    return index
+
+
+@contextmanager
+def _load_lock(owner_id: str) -> Iterator[None]:
+    """Hold the owner's load lock, so builds and updates of its index are ordered."""
+    with _indexes_lock:
+        entry = _load_locks.setdefault(owner_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _indexes_lock:
+            entry[1] -= 1
+            if entry[1] == 0 and _load_locks.get(owner_id) is entry:
+                del _load_locks[owner_id]
+
+
+def _cached(owner_id: str) -> Optional[OwnerLexicalIndex]:
+    with _indexes_lock:
+        index = _indexes.get(owner_id)
+        if index is not None:
+            _indexes.move_to_end(owner_id)
+        return index
+
+
+def _get_index(owner_id: str) -> OwnerLexicalIndex:
+    index = _cached(owner_id)
+    if index is not None:
+        return index
+    with _load_lock(owner_id):
+        index = _cached(owner_id)
+        if index is None:
+            index = _build_from_mongo(owner_id)
+            with _indexes_lock:
+                _indexes[owner_id] = index
+                while len(_indexes) > max(1, LEXICAL_CACHE_MAX_OWNERS):
+                    evicted, _ = _indexes.popitem(last=False)
+                    logger.info("Evicted lexical index for %s", evicted)
+        return index
+
+
+def add_chunks(
+    owner_id: str,
+    file_id: str,
+    texts: List[str],
+    chunk_ids: List[Optional[str]],
+    chunk_indexes: Optional[List[Optional[int]]] = None,
+) -> int:
+    """
+    Index a file's chunks, called after they are written to Mongo. Owners whose index
+    is not loaded are skipped: the next build from Mongo picks the chunks up.
+    """
+    if chunk_indexes is None:
+        chunk_indexes = list(range(len(texts)))
+    # waiting on the load lock orders us after a build that may have missed these chunks
+    with _load_lock(owner_id):
+        index = _cached(owner_id)
+    if index is None:
+        return 0
+    with index.lock.write():
+        return index.add(file_id, texts, chunk_ids, chunk_indexes)
+
+
+def delete_file(owner_id: str, file_id: str) -> int:
+    """Remove a file's chunks from the owner's lexical index (if loaded)."""
+    with _load_lock(owner_id):
+        index = _cached(owner_id)
+    if index is None:
+        return 0
+    with index.lock.write():
+        return index.delete_file(file_id)
+
+
+def search(owner_id: str, query: str, top_k: int = 5, file_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    BM25 hits for query as dicts with fileId, chunkIndex, chunkId and score (higher is
+    better), optionally restricted to file_ids.
+    """
+    if not (query or "").strip() or (file_ids is not None and not file_ids):
+        return []
+    try:
+        index = _get_index(owner_id)
+        with index.lock.read():
+            return [index.hit(doc, score) for doc, score in index.search(query, top_k, file_ids=file_ids)]
+    except Exception as e:
+        logger.exception("lexical search failed for owner %s: %s", owner_id, e)
+        return []
+
+
+def lexical_stats() -> Dict[str, Any]:
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {
+        "owners": len(indexes),
+        "docs": sum(i.live_docs for i in indexes),
+        "terms": sum(len(i.postings) for i in indexes),
+    }
@@ -17,6 +17,20 @@ def get_db():
         _db.users.create_index("email", unique=True)
         _db.chunks.create_index([("ownerId", 1), ("fileId", 1), ("chunkIndex", 1)])
         _db.files.create_index([("ownerId", 1), ("id", 1)])
+        _db.jobs.create_index("id", unique=True)
+        _db.jobs.create_index([("status", 1), ("createdAt", 1)])
+        _db.jobs.create_index([("ownerId", 1), ("fileId", 1)])
+        _db.jobs.create_index([("ownerId", 1), ("fileIds", 1)])
+        _db.artifacts.create_index("key", unique=True)
+        _db.artifacts.create_index("sha256")
+        _db.artifact_chunks.create_index([("key", 1), ("chunkIndex", 1)])
+        _db.artifact_refs.create_index([("sha256", 1), ("ownerId", 1), ("fileId", 1)], unique=True)
+        _db.artifact_refs.create_index([("ownerId", 1), ("fileId", 1)])
+        _db.chunks.create_index("id")
+        _db.texts.create_index("id", unique=True)
+        _db.text_blocks.create_index([("textId", 1), ("n", 1)], unique=True)
+        _db.text_dicts.create_index("id", unique=True)
+        _db.text_dicts.create_index([("ownerId", 1), ("createdAt", -1)])
     except Exception:
         pass
     return _db
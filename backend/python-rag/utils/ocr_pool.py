@@ -0,0 +1,176 @@
+# python-rag/utils/ocr_pool.py
+import os
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pages without a usable text layer are OCR'd on a pool of worker processes. Each
+# worker keeps one warmed-up OCR engine for its lifetime and rasterizes only the page
+# it was given, so page images are never all in memory at once. Workers run one OCR
+# thread each (OMP_THREAD_LIMIT=1). The default is one worker per core but one, capped
+# so the engines (OCR_WORKER_MEMORY_MB each, hundreds of MB with easyocr) fit in half
+# of the RAM. OCR_WORKERS=1 keeps OCR to one core, e.g. next to a busy embedder, and
+# OCR_WORKERS=0 OCRs in-process instead.
+OCR_WORKER_MEMORY_MB = int(os.environ.get("OCR_WORKER_MEMORY_MB", "512"))
+
+
+def _default_workers() -> int:
+    workers = max(1, (os.cpu_count() or 2) - 1)
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        workers = min(workers, max(1, memory // (2 * OCR_WORKER_MEMORY_MB * 1024 * 1024)))
+    except (AttributeError, ValueError, OSError):
+        pass  # no sysconf (Windows): cores only
+    return workers
+
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS") or _default_workers())
+# pages submitted ahead of the page being emitted (bounds memory and keeps order)
+OCR_MAX_INFLIGHT = int(os.environ.get("OCR_MAX_INFLIGHT", str(max(2, 2 * OCR_WORKERS))))
+_WORKER_DOCS = 2  # open PDFs a worker keeps between pages
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"pending_pages": 0, "pages": 0, "failures": 0}
+
+# per worker process: recently used documents, path -> file_processing._PdfPages
+_worker_docs: "OrderedDict[str, object]" = OrderedDict()
+
+
+def _init_worker():
+    """Runs once in each worker: one thread per engine (the pool supplies the parallelism), then warm up."""
+    for var in ("OMP_THREAD_LIMIT", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = "1"
+    from utils import file_processing
+
+    file_processing.ocr_engine()
+    try:
+        import torch
+
+        torch.set_num_threads(1)
+    except Exception:
+        pass
+
+
+def _ocr_page(path: str, index: int) -> Tuple[Optional[str], str, float]:
+    from utils import file_processing
+
+    pages = _worker_docs.pop(path, None)
+    if pages is None:
+        pages = file_processing._PdfPages(path)
+    _worker_docs[path] = pages
+    while len(_worker_docs) > _WORKER_DOCS:
+        _, old = _worker_docs.popitem(last=False)
+        old.close()
+    return file_processing.timed_ocr(pages, index)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def enabled() -> bool:
+    return OCR_WORKERS > 0
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if not enabled():
+        return None
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent is a threaded server
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            logger.info("Started OCR pool: %d workers", OCR_WORKERS)
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_pool():
+    """Create the pool and warm every worker's OCR engine without waiting for them (no-op without an OCR engine)."""
+    from utils import file_processing
+
+    if not enabled() or not file_processing._ocr_available():
+        return
+    pool = _get_pool()
+    if pool is None:
+        return
+    try:
+        for _ in range(OCR_WORKERS):
+            pool.submit(_ping)
+    except Exception as e:
+        logger.exception("Failed to start OCR pool: %s", e)
+
+
+def stop_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _page_done(fut: Future):
+    with _stats_lock:
+        _stats["pending_pages"] -= 1
+        if fut.cancelled() or fut.exception() is not None:
+            _stats["failures"] += 1
+        else:
+            _stats["pages"] += 1
+
+
+def submit(path: str, index: int) -> Optional[Future]:
+    """
+    Queue OCR of one page; the future resolves to (text, method, ms). None when the
+    pool is disabled or could not take the page (the caller OCRs it in-process).
+    """
+    pool = _get_pool()
+    if pool is None:
+        return None
+    with _stats_lock:
+        _stats["pending_pages"] += 1
+    try:
+        fut = pool.submit(_ocr_page, path, index)
+    except Exception as e:
+        with _stats_lock:
+            _stats["pending_pages"] -= 1
+        logger.exception("OCR pool unavailable; OCR runs in-process: %s", e)
+        _discard_pool(pool)
+        return None
+    fut.add_done_callback(_page_done)
+    return fut
+
+
+def failed(fut: Future):
+    """Called when a page's future raised: drop a broken pool so the next page gets a fresh one."""
+    from concurrent.futures.process import BrokenProcessPool
+
+    if isinstance(fut.exception(), BrokenProcessPool) and _pool is not None:
+        _discard_pool(_pool)
+
+
+def pool_stats() -> Dict[str, int]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["workers"] = OCR_WORKERS
+    stats["running"] = _pool is not None
+    return stats
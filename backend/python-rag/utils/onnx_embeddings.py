@@ -0,0 +1,196 @@
+# python-rag/utils/onnx_embeddings.py
+import os
+import json
+import inspect
+import logging
+from pathlib import Path
+from typing import List, Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# An exported model directory holds model.onnx (fp32), optionally model_int8.onnx
+# (dynamic int8 weights), the tokenizer files and pooling.json, which records how the
+# SentenceTransformer turns token states into one vector.
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+POOLING_FILE = "pooling.json"
+TOKENIZER_FILE = "tokenizer.json"  # written by save_pretrained for fast tokenizers
+
+
+def model_dir(root: Path, model_name: str) -> Path:
+    return Path(root) / model_name.replace("/", "__")
+
+
+def _NamedInputs(transformer, names: List[str]):
+    """Wrap the transformer so the exported graph's positional inputs are passed by name."""
+    import torch
+
+    class NamedInputs(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *tensors):
+            return self.transformer(**dict(zip(names, tensors)), return_dict=False)[0]
+
+    return NamedInputs().eval()
+
+
+def _legacy_export_kwargs(torch) -> Dict[str, Any]:
+    # newer torch defaults torch.onnx.export to the dynamo exporter, which needs
+    # onnxscript and handles dynamic_axes differently; keep the TorchScript exporter
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return {"dynamo": False}
+    return {}
+
+
+def _export_fp32(model_name: str, out_dir: Path):
+    # torch and sentence-transformers are only needed once, to export
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0].auto_model.eval()
+    tokenizer = st.tokenizer
+
+    pooling = {"pooling": "mean", "normalize": False}
+    for module in st:
+        kind = type(module).__name__
+        if kind == "Pooling":
+            cfg = module.get_config_dict()
+            if cfg.get("pooling_mode_cls_token"):
+                pooling["pooling"] = "cls"
+            elif cfg.get("pooling_mode_max_tokens"):
+                pooling["pooling"] = "max"
+        elif kind == "Normalize":
+            pooling["normalize"] = True
+    pooling.update(
+        model=model_name,
+        dimension=int(st.get_sentence_embedding_dimension()),
+        max_seq_length=int(st.max_seq_length),
+        pad_token=tokenizer.pad_token,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+
+    sample = tokenizer(["an export sample sentence"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    tmp = out_dir / (ONNX_FP32_FILE + ".tmp")
+    with torch.no_grad():
+        torch.onnx.export(
+            _NamedInputs(transformer, names),
+            tuple(sample[n] for n in names),
+            str(tmp),
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=14,
+            **_legacy_export_kwargs(torch),
+        )
+    tokenizer.save_pretrained(str(out_dir))
+    with open(out_dir / POOLING_FILE, "w", encoding="utf-8") as f:
+        json.dump(pooling, f)
+    os.replace(tmp, out_dir / ONNX_FP32_FILE)
+
+
+def ensure_onnx_model(model_name: str, root: Path, int8: bool = False) -> Path:
+    """Export (and int8-quantize) model_name under root once; returns the model directory."""
+    out_dir = model_dir(root, model_name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not (out_dir / ONNX_FP32_FILE).exists() or not (out_dir / POOLING_FILE).exists():
+        logger.info("Exporting %s to ONNX in %s", model_name, out_dir)
+        _export_fp32(model_name, out_dir)
+    if int8 and not (out_dir / ONNX_INT8_FILE).exists():
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        logger.info("Quantizing %s ONNX weights to int8", model_name)
+        tmp = out_dir / (ONNX_INT8_FILE + ".tmp")
+        quantize_dynamic(str(out_dir / ONNX_FP32_FILE), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, out_dir / ONNX_INT8_FILE)
+    return out_dir
+
+
+class OnnxSentenceEncoder:
+    """
+    The SentenceTransformer encode() path on ONNX Runtime: tokenizer -> transformer ->
+    pooling -> optional L2 normalization. Drop-in for the methods embeddings.py uses.
+    """
+
+    def __init__(self, directory: Path, int8: bool = False, threads: int = 0):
+        import onnxruntime as ort
+
+        directory = Path(directory)
+        with open(directory / POOLING_FILE, "r", encoding="utf-8") as f:
+            self.config: Dict[str, Any] = json.load(f)
+        self._max_length = int(self.config.get("max_seq_length", 256))
+        if (directory / TOKENIZER_FILE).exists():
+            # the Rust tokenizer alone: serving needs neither transformers nor torch
+            from tokenizers import Tokenizer
+
+            self.tokenizer = Tokenizer.from_file(str(directory / TOKENIZER_FILE))
+            self.tokenizer.enable_truncation(max_length=self._max_length)
+            self.tokenizer.enable_padding(
+                pad_id=int(self.config.get("pad_token_id") or 0), pad_token=self.config.get("pad_token") or "[PAD]"
+            )
+            self._fast = True
+        else:
+            from transformers import AutoTokenizer
+
+            self.tokenizer = AutoTokenizer.from_pretrained(str(directory))
+            self._fast = False
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        model_file = directory / (ONNX_INT8_FILE if int8 else ONNX_FP32_FILE)
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self.int8 = int8
+
+    @classmethod
+    def load(cls, model_name: str, root: Path, int8: bool = False, threads: int = 0) -> "OnnxSentenceEncoder":
+        return cls(ensure_onnx_model(model_name, root, int8=int8), int8=int8, threads=threads)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.config["dimension"])
+
+    def _pool(self, states: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        pooling = self.config.get("pooling", "mean")
+        if pooling == "cls":
+            return states[:, 0]
+        mask = mask[:, :, None].astype(np.float32)
+        if pooling == "max":
+            return np.where(mask > 0, states, -1e9).max(axis=1)
+        return (states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _tokenize(self, batch: List[str]) -> Dict[str, np.ndarray]:
+        if not self._fast:
+            tokens = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=self._max_length, return_tensors="np"
+            )
+            return {k: v.astype(np.int64) for k, v in tokens.items()}
+        encodings = self.tokenizer.encode_batch(batch)
+        return {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+
+    def encode(self, sentences: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # like SentenceTransformer.encode: longest first, so each batch pads little
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        for start in range(0, len(order), batch_size):
+            idx = order[start : start + batch_size]
+            batch = [sentences[i] for i in idx]
+            tokens = self._tokenize(batch)
+            feed = {k: v for k, v in tokens.items() if k in self._inputs}
+            states = self.session.run(None, feed)[0]
+            pooled = self._pool(states, tokens["attention_mask"])
+            if self.config.get("normalize"):
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out[idx] = pooled
+        return out
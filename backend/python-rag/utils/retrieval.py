@@ -0,0 +1,189 @@
+# python-rag/utils/retrieval.py
+import os
+import re
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils.vector_store import Document, search_store, fill_texts
+from utils.text_store import chunk_texts
+from utils import lexical_index
+from utils.mongo_client import get_db
+
+logger = logging.getLogger(__name__)
+
+# vector: FAISS only (score = squared L2, lower is closer)
+# lexical: BM25 only (score = BM25, higher is better)
+# hybrid: both, fused with reciprocal rank fusion (score = RRF, higher is better)
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "vector").lower()
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# each retriever contributes top_k * HYBRID_CANDIDATES candidates to the fusion
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "3"))
+
+
+def resolve_mode(mode: Optional[str]) -> str:
+    mode = (mode or RETRIEVAL_MODE or "vector").lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval_mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+
+def resolve_file_filter(
+    owner_id: str,
+    file_ids: Optional[List[str]] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    file_types: Optional[List[str]] = None,
+) -> Optional[List[str]]:
+    """
+    Turn request filters into the owner's matching fileIds (None = no filter). Upload
+    date and type come from the files collection; types are mime types
+    ("application/pdf", "image/*") or extensions ("pdf", ".docx").
+    """
+    if file_ids is None and uploaded_after is None and uploaded_before is None and not file_types:
+        return None
+    if uploaded_after is None and uploaded_before is None and not file_types:
+        return list(dict.fromkeys(file_ids))
+
+    q: Dict[str, Any] = {"ownerId": owner_id}
+    if file_ids is not None:
+        q["id"] = {"$in": list(file_ids)}
+    uploaded: Dict[str, Any] = {}
+    if uploaded_after is not None:
+        uploaded["$gte"] = uploaded_after
+    if uploaded_before is not None:
+        uploaded["$lte"] = uploaded_before
+    if uploaded:
+        q["uploadedAt"] = uploaded
+    if file_types:
+        mimes = [t.lower() for t in file_types if "/" in t and not t.endswith("/*")]
+        families = [t.lower()[:-1] for t in file_types if t.endswith("/*")]
+        exts = [t.lower().lstrip(".") for t in file_types if "/" not in t]
+        any_of: List[Dict[str, Any]] = []
+        if mimes:
+            any_of.append({"mimeType": {"$in": mimes}})
+        for family in families:
+            any_of.append({"mimeType": {"$regex": "^" + re.escape(family), "$options": "i"}})
+        if exts:
+            pattern = r"\.(" + "|".join(re.escape(e) for e in exts) + ")$"
+            any_of.append({"originalName": {"$regex": pattern, "$options": "i"}})
+        q["$or"] = any_of
+    return [f.get("id") for f in get_db().files.find(q, {"id": 1})]
+
+
+def _key(md: Dict[str, Any]) -> Tuple[Any, Any]:
+    return (md.get("fileId"), md.get("chunkIndex"))
+
+
+def _lexical_documents(
+    owner_id: str, hits: List[Dict[str, Any]], with_text: bool = True
+) -> Dict[Tuple[Any, Any], Document]:
+    """Documents for lexical hits, texts fetched from Mongo in one query (see fill_texts without them)."""
+    docs = {}
+    if not hits:
+        return docs
+    texts = {}
+    try:
+        if with_text:
+            file_ids = list({h["fileId"] for h in hits})
+            records = list(
+                get_db().chunks.find(
+                    {"ownerId": owner_id, "fileId": {"$in": file_ids}, "chunkIndex": {"$in": list({h["chunkIndex"] for h in hits})}},
+                    {"fileId": 1, "chunkIndex": 1, "text": 1, "textId": 1, "start": 1, "end": 1},
+                )
+            )
+            for c, text in zip(records, chunk_texts(records)):
+                texts[(c.get("fileId"), c.get("chunkIndex"))] = text
+    except Exception as e:
+        logger.exception("Failed to fetch chunk texts for lexical hits of %s: %s", owner_id, e)
+    for h in hits:
+        key = (h["fileId"], h["chunkIndex"])
+        docs[key] = Document(
+            page_content=texts.get(key, ""),
+            metadata={
+                "fileId": h["fileId"],
+                "ownerId": owner_id,
+                "chunkIndex": h["chunkIndex"],
+                "chunkId": h["chunkId"],
+                "originalName": "",
+            },
+        )
+    return docs
+
+
+def retrieve(
+    owner_id: str,
+    query: str,
+    top_k: int = 5,
+    mode: Optional[str] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    file_ids: Optional[List[str]] = None,
+    with_text: bool = True,
+) -> List[Tuple[Document, float]]:
+    """
+    Top-k (Document, score) for query in the given retrieval mode (see RETRIEVAL_MODES),
+    restricted to file_ids when given (see resolve_file_filter).
+    Hybrid hits carry denseRank / lexicalRank (None when absent) in their metadata.
+    Only the final top-k get their text (decompressed from the text store); callers
+    that read the chunk records themselves pass with_text=False.
+    """
+    mode = resolve_mode(mode)
+    if mode == "vector":
+        return search_store(
+            owner_id=owner_id,
+            query=query,
+            top_k=top_k,
+            ef_search=ef_search,
+            nprobe=nprobe,
+            file_ids=file_ids,
+            with_text=with_text,
+        )
+
+    if mode == "lexical":
+        hits = lexical_index.search(owner_id, query, top_k=top_k, file_ids=file_ids)
+        docs = _lexical_documents(owner_id, hits, with_text=with_text)
+        return [(docs[(h["fileId"], h["chunkIndex"])], h["score"]) for h in hits]
+
+    candidates = max(top_k, top_k * HYBRID_CANDIDATES)
+    # candidates are ranked without their text
+    dense = search_store(
+        owner_id=owner_id,
+        query=query,
+        top_k=candidates,
+        ef_search=ef_search,
+        nprobe=nprobe,
+        file_ids=file_ids,
+        with_text=False,
+    )
+    lexical = lexical_index.search(owner_id, query, top_k=candidates, file_ids=file_ids)
+
+    fused: Dict[Tuple[Any, Any], float] = {}
+    dense_rank: Dict[Tuple[Any, Any], int] = {}
+    lexical_rank: Dict[Tuple[Any, Any], int] = {}
+    docs: Dict[Tuple[Any, Any], Document] = {}
+    for rank, (doc, _) in enumerate(dense, start=1):
+        key = _key(doc.metadata or {})
+        if key in dense_rank:
+            continue
+        dense_rank[key] = rank
+        docs[key] = doc
+        fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank)
+    for rank, h in enumerate(lexical, start=1):
+        key = (h["fileId"], h["chunkIndex"])
+        lexical_rank[key] = rank
+        fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank)
+
+    best = sorted(fused, key=lambda k: fused[k], reverse=True)[:top_k]
+    missing = [h for h in lexical if (h["fileId"], h["chunkIndex"]) in best and (h["fileId"], h["chunkIndex"]) not in docs]
+    docs.update(_lexical_documents(owner_id, missing, with_text=False))
+    if with_text:
+        fill_texts(owner_id, [docs[key] for key in best])
+
+    results = []
+    for key in best:
+        doc = docs[key]
+        doc.metadata = dict(doc.metadata or {}, denseRank=dense_rank.get(key), lexicalRank=lexical_rank.get(key))
+        results.append((doc, fused[key]))
+    return results
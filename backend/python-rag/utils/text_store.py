@@ -0,0 +1,500 @@
+# python-rag/utils/text_store.py
+import os
+import re
+import zlib
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from utils.mongo_client import get_db
+from utils.file_processing import EXTRACTOR_VERSION
+
+logger = logging.getLogger(__name__)
+
+try:
+    # optional: without it new blocks are zlib, but zstd blocks cannot be read (see _require_zstd)
+    import zstandard as zstd
+except Exception as e:
+    zstd = None
+    logger.debug("zstandard not available: %s", e)
+
+# The single stored copy of each file's extracted text. Chunks do not carry their text:
+# a chunk record is (textId, start, end, page) -- character offsets into the text of its
+# file -- and readers slice the text on demand (chunk_texts).
+#
+# A text is content-addressed (sha256 of the file bytes + EXTRACTOR_VERSION), so every
+# owner of the same file shares it, and is stored in TEXT_STORE_BLOCK_CHARS-character
+# blocks, each compressed on its own (`text_blocks`), so a slice decompresses only
+# the one or two blocks it spans. The `texts` header document holds the length and
+# the page map ([[offset, page], ...]) and is written once the whole text is stored.
+# The files using a text are tracked with the other artifacts of their sha256 (see
+# utils/artifacts.py add_ref); once none is left, delete_texts removes it.
+TEXT_STORE_BLOCK_CHARS = int(os.environ.get("TEXT_STORE_BLOCK_CHARS", "8192"))
+# "zstd" (needs zstandard) or "zlib". Each block records its codec and dictionary, so
+# changing either only affects texts stored from then on.
+TEXT_STORE_CODEC = os.environ.get("TEXT_STORE_CODEC", "zstd" if zstd is not None else "zlib").lower()
+if TEXT_STORE_CODEC == "zstd" and zstd is None:
+    logger.warning("TEXT_STORE_CODEC=zstd but zstandard is not installed; using zlib")
+    TEXT_STORE_CODEC = "zlib"
+TEXT_STORE_LEVEL = int(os.environ.get("TEXT_STORE_LEVEL", "6"))
+# zstd only: each owner gets a dictionary trained on its stored text once it has
+# TEXT_DICT_MIN_CHARS of it (at most TEXT_DICT_SAMPLE_CHARS are sampled); the owner's
+# later texts are compressed with it
+TEXT_STORE_DICT = os.environ.get("TEXT_STORE_DICT", "true").lower() in ("1", "true", "yes")
+TEXT_DICT_SIZE = int(os.environ.get("TEXT_DICT_SIZE", "16384"))
+TEXT_DICT_MIN_CHARS = int(os.environ.get("TEXT_DICT_MIN_CHARS", "500000"))
+TEXT_DICT_SAMPLE_CHARS = int(os.environ.get("TEXT_DICT_SAMPLE_CHARS", "4000000"))
+_DICT_SAMPLE_PIECE = 2048  # training sample size, in chars
+_DICT_SAMPLE_TEXTS = 64  # texts of the owner sampled for training
+# decompressed blocks kept in memory (LRU), shared by all readers
+TEXT_STORE_CACHE_BLOCKS = int(os.environ.get("TEXT_STORE_CACHE_BLOCKS", "512"))
+
+# (start, end, page); start/end None when the chunk could not be located in the text
+Span = Tuple[Optional[int], Optional[int], Optional[int]]
+
+_cache: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+_cache_lock = threading.Lock()
+# textId -> block size it was written with
+_block_sizes: Dict[str, int] = {}
+_stats = {
+    "block_hits": 0,
+    "block_reads": 0,
+    "decompress_ms": 0.0,
+    "slices": 0,
+    "texts_written": 0,
+    "raw_chars": 0,
+    "stored_bytes": 0,
+    "dicts_trained": 0,
+}
+
+# dictionary id -> dictionary; owner -> its dictionary id (None: not trained yet)
+_dicts: Dict[str, Any] = {}
+_owner_dicts: Dict[str, Optional[str]] = {}
+# chars stored per owner since its last training attempt
+_owner_written: Dict[str, int] = {}
+# owners whose dictionary is being looked up or trained (outside _dict_lock)
+_dict_training: set = set()
+_dict_lock = threading.Lock()
+_local = threading.local()  # per-thread zstd decompressors (they are not thread-safe)
+
+
+def text_id(sha256: str) -> str:
+    return f"{sha256}:{EXTRACTOR_VERSION}"
+
+
+def _require_zstd():
+    if zstd is None:
+        raise RuntimeError(
+            "text block is zstd-compressed but the zstandard package is not installed "
+            "(pip install -r requirements.txt)"
+        )
+
+
+def _compressor(codec: str, zdict: Any = None, level: int = TEXT_STORE_LEVEL) -> Callable[[str], bytes]:
+    if codec == "zstd":
+        cctx = zstd.ZstdCompressor(level=level, dict_data=zdict)
+        return lambda text: cctx.compress(text.encode("utf-8"))
+    return lambda text: zlib.compress(text.encode("utf-8"), level)
+
+
+def _decompress(data: Any, codec: Optional[str] = None, zdict: Any = None) -> str:
+    if codec == "zstd":
+        _require_zstd()
+        dctxs = getattr(_local, "dctxs", None)
+        if dctxs is None:
+            dctxs = _local.dctxs = {}
+        key = zdict.dict_id() if zdict is not None else 0
+        dctx = dctxs.get(key)
+        if dctx is None:
+            dctx = dctxs[key] = zstd.ZstdDecompressor(dict_data=zdict)
+        return dctx.decompress(bytes(data)).decode("utf-8")
+    # blocks written before codecs were recorded are zlib
+    return zlib.decompress(bytes(data)).decode("utf-8")
+
+
+def _decompress_block(doc: Dict[str, Any]) -> str:
+    return _decompress(doc["data"], doc.get("codec"), _load_dict(doc.get("dict")))
+
+
+def train_dict(samples: List[str], size: int = TEXT_DICT_SIZE) -> Any:
+    """A zstd dictionary trained on text samples (raises when they are too few)."""
+    zdict = zstd.train_dictionary(size, [s.encode("utf-8") for s in samples if s])
+    zdict.precompute_compress(level=TEXT_STORE_LEVEL)
+    return zdict
+
+
+def _load_dict(dict_id: Optional[str]) -> Any:
+    if not dict_id:
+        return None
+    zdict = _dicts.get(dict_id)
+    if zdict is None:
+        _require_zstd()
+        doc = get_db().text_dicts.find_one({"id": dict_id}, {"_id": 0, "data": 1})
+        if doc is None:
+            raise RuntimeError(f"text dictionary {dict_id} not found")
+        zdict = zstd.ZstdCompressionDict(bytes(doc["data"]))
+        zdict.precompute_compress(level=TEXT_STORE_LEVEL)
+        _dicts[dict_id] = zdict
+    return zdict
+
+
+def _sample_owner_text(owner_id: str) -> List[str]:
+    """Pieces of the owner's stored texts, up to TEXT_DICT_SAMPLE_CHARS in all."""
+    db = get_db()
+    tids: List[str] = []
+    for c in db.chunks.find({"ownerId": owner_id, "textId": {"$exists": True}}, {"_id": 0, "textId": 1}).limit(20000):
+        if c["textId"] not in tids:
+            tids.append(c["textId"])
+            if len(tids) >= _DICT_SAMPLE_TEXTS:
+                break
+    samples: List[str] = []
+    if not tids:
+        return samples
+    total = 0
+    for doc in db.text_blocks.find({"textId": {"$in": tids}}, {"_id": 0, "data": 1, "codec": 1, "dict": 1}):
+        block = _decompress_block(doc)
+        samples.extend(block[i : i + _DICT_SAMPLE_PIECE] for i in range(0, len(block), _DICT_SAMPLE_PIECE))
+        total += len(block)
+        if total >= TEXT_DICT_SAMPLE_CHARS:
+            break
+    return samples
+
+
+def _train_owner_dict(owner_id: str) -> Optional[str]:
+    samples = _sample_owner_text(owner_id)
+    chars = sum(len(s) for s in samples)
+    if chars < TEXT_DICT_MIN_CHARS:
+        return None
+    t0 = time.perf_counter()
+    zdict = train_dict(samples)
+    data = zdict.as_bytes()
+    dict_id = hashlib.sha256(data).hexdigest()[:16]
+    get_db().text_dicts.update_one(
+        {"id": dict_id},
+        {
+            "$set": {
+                "ownerId": owner_id,
+                "data": data,
+                "size": len(data),
+                "sampleChars": chars,
+                "createdAt": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+    _dicts[dict_id] = zdict
+    _stats["dicts_trained"] += 1
+    logger.info(
+        "Trained text dictionary %s for owner %s: %d bytes from %d chars in %.0f ms",
+        dict_id,
+        owner_id,
+        len(data),
+        chars,
+        (time.perf_counter() - t0) * 1000,
+    )
+    return dict_id
+
+
+def owner_dict(owner_id: Optional[str]) -> Optional[str]:
+    """
+    The owner's dictionary id, training it when the owner has stored enough text since
+    the last attempt; None when there is none (yet) or dictionaries are off. Training
+    runs outside _dict_lock: other owners are not held up, and writers of the same
+    owner go on without a dictionary until it is published.
+    """
+    if not owner_id or not TEXT_STORE_DICT or TEXT_STORE_CODEC != "zstd":
+        return None
+    with _dict_lock:
+        dict_id = _owner_dicts.get(owner_id)
+        if owner_id in _dict_training:
+            return dict_id
+        if owner_id in _owner_dicts and (
+            dict_id is not None or _owner_written.get(owner_id, 0) < TEXT_DICT_MIN_CHARS
+        ):
+            return dict_id
+        _dict_training.add(owner_id)
+        _owner_written[owner_id] = 0
+    dict_id = None
+    try:
+        doc = get_db().text_dicts.find_one({"ownerId": owner_id}, {"_id": 0, "id": 1}, sort=[("createdAt", -1)])
+        dict_id = doc["id"] if doc is not None else None
+        if dict_id is None:
+            dict_id = _train_owner_dict(owner_id)
+    except Exception as e:
+        logger.exception("Text dictionary unavailable for owner %s: %s", owner_id, e)
+        dict_id = None
+    finally:
+        with _dict_lock:
+            _owner_dicts[owner_id] = dict_id
+            _dict_training.discard(owner_id)
+    return dict_id
+
+
+class TextWriter:
+    """
+    Stores one text as it streams by (see tee). Full blocks are written as they fill;
+    sync() also writes the partial last block, so every offset read so far can be
+    sliced -- call it before storing chunks that point into the text. Blocks use the
+    owner's dictionary when it has one.
+    """
+
+    def __init__(self, tid: str, owner_id: Optional[str] = None, block_chars: int = TEXT_STORE_BLOCK_CHARS):
+        self.tid = tid
+        self.owner_id = owner_id
+        self.block_chars = block_chars
+        self.codec = TEXT_STORE_CODEC
+        self.dict_id = owner_dict(owner_id)
+        self._compress = _compressor(self.codec, _load_dict(self.dict_id))
+        self.offset = 0
+        self.pages: List[List[int]] = []
+        self._block = 0
+        self._buf: List[str] = []
+        self._buf_len = 0
+        self._dirty = False
+        self._stored_bytes = 0
+
+    def mark_page(self, page: int):
+        """The page starting at the current offset (call before its text is written)."""
+        if self.pages and self.pages[-1][0] == self.offset:
+            self.pages[-1][1] = page
+        else:
+            self.pages.append([self.offset, page])
+
+    def write(self, piece: str):
+        while piece:
+            take = piece[: self.block_chars - self._buf_len]
+            piece = piece[len(take) :]
+            self._buf.append(take)
+            self._buf_len += len(take)
+            self.offset += len(take)
+            self._dirty = True
+            if self._buf_len >= self.block_chars:
+                self._put_block(final=True)
+
+    def _put_block(self, final: bool):
+        block = "".join(self._buf)
+        data = self._compress(block)
+        try:
+            # a block only grows: two jobs extracting the same file at once write the
+            # same text, and a partial block must never replace a longer one
+            get_db().text_blocks.update_one(
+                {"textId": self.tid, "n": self._block, "chars": {"$lt": len(block)}},
+                {"$set": {"data": data, "chars": len(block), "codec": self.codec, "dict": self.dict_id}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass
+        self._dirty = False
+        if final:
+            self._stored_bytes += len(data)
+            self._block += 1
+            self._buf, self._buf_len = [], 0
+
+    def sync(self):
+        if self._dirty:
+            self._put_block(final=False)
+
+    def tee(self, sections: Iterable[str]) -> Iterator[str]:
+        for piece in sections:
+            self.write(piece)
+            yield piece
+
+    def close(self):
+        """Write the last block and the header; from now on the text is complete."""
+        if self._buf_len:
+            self._put_block(final=True)
+        get_db().texts.update_one(
+            {"id": self.tid},
+            {
+                "$set": {
+                    "length": self.offset,
+                    "blocks": self._block,
+                    "blockChars": self.block_chars,
+                    "pages": self.pages,
+                    "storedBytes": self._stored_bytes,
+                    "codec": self.codec,
+                    "dict": self.dict_id,
+                    "createdAt": datetime.utcnow(),
+                }
+            },
+            upsert=True,
+        )
+        _stats["texts_written"] += 1
+        _stats["raw_chars"] += self.offset
+        _stats["stored_bytes"] += self._stored_bytes
+        if self.owner_id and self.dict_id is None:
+            with _dict_lock:
+                _owner_written[self.owner_id] = _owner_written.get(self.owner_id, 0) + self.offset
+
+    def page_at(self, offset: Optional[int]) -> Optional[int]:
+        return page_at(self.pages, offset)
+
+
+def page_at(pages: List[List[int]], offset: Optional[int]) -> Optional[int]:
+    """The page an offset falls on, from a page map; None without one."""
+    if not pages or offset is None:
+        return None
+    i = bisect.bisect_right([p[0] for p in pages], offset) - 1
+    return pages[max(i, 0)][1]
+
+
+def get_text(tid: str) -> Optional[Dict[str, Any]]:
+    """Header of a complete text (length, blocks, blockChars, pages), or None."""
+    try:
+        return get_db().texts.find_one({"id": tid}, {"_id": 0})
+    except Exception as e:
+        logger.exception("Text lookup failed for %s: %s", tid, e)
+        return None
+
+
+def iter_text(tid: str) -> Iterator[str]:
+    """A complete text, block by block."""
+    cursor = get_db().text_blocks.find({"textId": tid}, {"_id": 0, "data": 1, "codec": 1, "dict": 1}).sort("n", 1)
+    for doc in cursor:
+        yield _decompress_block(doc)
+
+
+def _cache_get(key: Tuple[str, int], need: int) -> Optional[str]:
+    with _cache_lock:
+        block = _cache.get(key)
+        if block is None or len(block) < need:
+            # a block read while its text was still being written may be partial
+            return None
+        _cache.move_to_end(key)
+        return block
+
+
+def _cache_put(blocks: Dict[Tuple[str, int], str]):
+    with _cache_lock:
+        for key, block in blocks.items():
+            _cache[key] = block
+            _cache.move_to_end(key)
+        while len(_cache) > TEXT_STORE_CACHE_BLOCKS:
+            _cache.popitem(last=False)
+
+
+def _block_chars(tids: Iterable[str]) -> Dict[str, int]:
+    tids = set(tids)
+    unknown = [t for t in tids if t not in _block_sizes]
+    if unknown:
+        for doc in get_db().texts.find({"id": {"$in": unknown}}, {"_id": 0, "id": 1, "blockChars": 1}):
+            _block_sizes[doc["id"]] = int(doc.get("blockChars") or TEXT_STORE_BLOCK_CHARS)
+    # a text still being written has no header yet: it uses this process's block size
+    return {t: _block_sizes.get(t, TEXT_STORE_BLOCK_CHARS) for t in tids}
+
+
+def _blocks_of(start: int, end: int, block_chars: int) -> range:
+    return range(start // block_chars, max(start, end - 1) // block_chars + 1)
+
+
+def slice_texts(spans: List[Tuple[str, int, int]]) -> List[str]:
+    """
+    text[start:end] for each (textId, start, end), reading every block involved once
+    (one query per call) and decompressing only those blocks.
+    """
+    sizes = _block_chars(tid for tid, _, _ in spans)
+    needed: Dict[Tuple[str, int], int] = {}
+    for tid, start, end in spans:
+        block_chars = sizes[tid]
+        for n in _blocks_of(start, end, block_chars):
+            key = (tid, n)
+            needed[key] = max(needed.get(key, 0), min(end - n * block_chars, block_chars))
+    blocks: Dict[Tuple[str, int], str] = {}
+    missing: Dict[str, List[int]] = {}
+    for key, need in needed.items():
+        block = _cache_get(key, need)
+        if block is None:
+            missing.setdefault(key[0], []).append(key[1])
+        else:
+            blocks[key] = block
+    _stats["block_hits"] += len(blocks)
+    if missing:
+        fetched: Dict[Tuple[str, int], str] = {}
+        query = {"$or": [{"textId": tid, "n": {"$in": ns}} for tid, ns in missing.items()]}
+        fields = {"_id": 0, "textId": 1, "n": 1, "data": 1, "codec": 1, "dict": 1}
+        docs = list(get_db().text_blocks.find(query, fields))
+        t0 = time.perf_counter()
+        for doc in docs:
+            fetched[(doc["textId"], int(doc["n"]))] = _decompress_block(doc)
+        _stats["decompress_ms"] += (time.perf_counter() - t0) * 1000
+        _stats["block_reads"] += len(fetched)
+        _cache_put(fetched)
+        blocks.update(fetched)
+    out = []
+    for tid, start, end in spans:
+        block_chars = sizes[tid]
+        parts = []
+        for n in _blocks_of(start, end, block_chars):
+            block = blocks.get((tid, n), "")
+            lo = max(start - n * block_chars, 0)
+            hi = min(end - n * block_chars, block_chars)
+            parts.append(block[lo:hi])
+        out.append("".join(parts))
+    _stats["slices"] += len(spans)
+    return out
+
+
+def chunk_texts(chunks: List[Dict[str, Any]]) -> List[str]:
+    """
+    The text of each chunk record: sliced from its file's text for (textId, start, end)
+    records, the inline `text` of records written before offsets (or not locatable).
+    """
+    out: List[Optional[str]] = [None] * len(chunks)
+    spans: List[Tuple[str, int, int]] = []
+    where: List[int] = []
+    for i, c in enumerate(chunks):
+        if c.get("text") is not None:
+            out[i] = c["text"]
+        elif c.get("textId") is not None and c.get("start") is not None and c.get("end") is not None:
+            spans.append((c["textId"], int(c["start"]), int(c["end"])))
+            where.append(i)
+        else:
+            out[i] = ""
+    if spans:
+        try:
+            for i, text in zip(where, slice_texts(spans)):
+                out[i] = text
+        except Exception as e:
+            logger.exception("Failed to read chunk texts: %s", e)
+            for i in where:
+                out[i] = ""
+    return [t or "" for t in out]
+
+
+def delete_texts(sha256: str) -> int:
+    """
+    Delete the stored texts of a file content, of every EXTRACTOR_VERSION and including
+    blocks of texts never finished; call once no file uses the content any more.
+    """
+    db = get_db()
+    prefix = {"$regex": f"^{re.escape(sha256)}:"}
+    # the header first: from then on no new reader starts on the text
+    deleted = db.texts.delete_many({"id": prefix}).deleted_count
+    blocks = db.text_blocks.delete_many({"textId": prefix}).deleted_count
+    with _cache_lock:
+        for key in [k for k in _cache if k[0].startswith(sha256 + ":")]:
+            del _cache[key]
+        for tid in [t for t in _block_sizes if t.startswith(sha256 + ":")]:
+            del _block_sizes[tid]
+    if deleted or blocks:
+        logger.info("Deleted %d texts (%d blocks) of %s: no file uses them any more", deleted, blocks, sha256[:12])
+    return deleted
+
+
+def text_stats() -> Dict[str, Any]:
+    with _cache_lock:
+        cached = len(_cache)
+    stats: Dict[str, Any] = dict(_stats, cached_blocks=cached, codec=TEXT_STORE_CODEC, dicts_loaded=len(_dicts))
+    stats["decompress_ms"] = round(_stats["decompress_ms"], 1)
+    if _stats["raw_chars"]:
+        stats["compression_ratio"] = round(_stats["stored_bytes"] / _stats["raw_chars"], 3)
+    if _stats["block_reads"]:
+        stats["decompress_us_per_block"] = round(1000 * _stats["decompress_ms"] / _stats["block_reads"], 1)
+    return stats
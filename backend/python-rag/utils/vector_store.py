@@ -1,37 +1,115 @@
 # python-rag/utils/vector_store.py
 import os
+import json
+import uuid
+import shutil
 import threading
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any, Iterator, Callable
 
 logger = logging.getLogger(__name__)
 
-# Try langchain_community first, fallback to langchain
 try:
-    from langchain_community.vectorstores.faiss import FAISS as LC_FAISS  # type: ignore
+    import faiss  # type: ignore
+except Exception as e:
+    logger.exception("Failed to import faiss: %s", e)
+    raise
+
+# search results keep LangChain's Document shape (page_content + metadata)
+try:
     from langchain.schema import Document
-    LC_MODULE = "langchain_community"
 except Exception:
-    try:
-        from langchain.vectorstores import FAISS as LC_FAISS
-        from langchain.schema import Document
-        LC_MODULE = "langchain"
-    except Exception as e:
-        logger.exception("Failed to import FAISS from langchain or langchain_community: %s", e)
-        raise
+    from langchain_core.documents import Document  # type: ignore
 
 # embedding adapter using your utils.embeddings
-from utils.embeddings import embed_texts
+from utils.embeddings import embed_texts, embed_query, MODEL_NAME
+from utils.text_store import chunk_texts
 from utils.mongo_client import get_db
+from utils.locks import RWLock
 
 import numpy as np
 
 VECTORS_DIR = Path(os.environ.get("VECTORS_DIR", "./vectors")).resolve()
 VECTORS_DIR.mkdir(parents=True, exist_ok=True)
 
-_stores: Dict[str, LC_FAISS] = {}
+VECTOR_COMPACT_RATIO = float(os.environ.get("VECTOR_COMPACT_RATIO", "0.25"))
+CURRENT_FILE = "CURRENT"
+GEN_PREFIX = "gen-"
+
+# Native on-disk format (one generation directory). Nothing in it is pickled:
+# the FAISS index is opened memory-mapped and the numpy columns with mmap_mode="r",
+# so a cold owner loads in milliseconds and worker processes share the pages.
+STORE_FORMAT = 1
+META_FILE = "meta.json"          # format version, dimension, file table [[fileId, originalName], ...]
+INDEX_FILE = "index.faiss"       # raw faiss.write_index output
+IDS_FILE = "ids.npy"             # chunk id per vector position (fixed-width bytes)
+ROWS_FILE = "rows.npy"           # (file code, chunkIndex) per vector position
+TEXT_FILE = "text.bin"           # concatenated utf-8 chunk texts
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+TOMBSTONES_FILE = "tombstones.npy"
+VECTORS_FILE = "vectors.npy"     # exact float32 vectors, only for quantized indexes (re-scoring)
+_ROW_DTYPE = np.dtype([("file", "<i4"), ("chunk", "<i4")])
+# IO_FLAG_MMAP_IFC (faiss >= 1.9) maps flat codes zero-copy; older faiss reads the index normally
+_INDEX_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# Index type promotion: owners start on an exact flat index and move to an approximate
+# one (HNSW, or trained IVF) once they reach VECTOR_ANN_THRESHOLD vectors. They go
+# back to flat when compaction leaves them under half the threshold.
+VECTOR_ANN_KIND = os.environ.get("VECTOR_ANN_KIND", "hnsw").lower()  # hnsw | ivf | flat (never promote)
+VECTOR_ANN_THRESHOLD = int(os.environ.get("VECTOR_ANN_THRESHOLD", "50000"))
+VECTOR_HNSW_M = int(os.environ.get("VECTOR_HNSW_M", "32"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.environ.get("VECTOR_HNSW_EF_CONSTRUCTION", "80"))
+VECTOR_HNSW_EF_SEARCH = int(os.environ.get("VECTOR_HNSW_EF_SEARCH", "64"))
+VECTOR_IVF_NPROBE = int(os.environ.get("VECTOR_IVF_NPROBE", "16"))
+
+# Opt-in compressed index codes for new and rebuilt indexes: fp16 (2x), sq8 (4x) or
+# pq (dim / VECTOR_PQ_M floats per byte, 16x with the defaults). pq only applies to
+# HNSW/IVF indexes: a flat IndexPQ takes no IDSelector (tombstones, file filters),
+# so flat stores use sq8 instead. Quantized stores
+# keep the exact float32 vectors memory-mapped on disk and re-score the best
+# top_k * VECTOR_RESCORE_FACTOR candidates with them, so ranking stays exact.
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none").lower()  # none | fp16 | sq8 | pq
+VECTOR_PQ_M = int(os.environ.get("VECTOR_PQ_M", "96"))
+VECTOR_PQ_MIN_TRAIN = int(os.environ.get("VECTOR_PQ_MIN_TRAIN", "10000"))  # fewer vectors -> sq8
+VECTOR_TRAIN_SAMPLE = int(os.environ.get("VECTOR_TRAIN_SAMPLE", "50000"))
+VECTOR_RESCORE_FACTOR = int(os.environ.get("VECTOR_RESCORE_FACTOR", "4"))
+
+# File-filtered searches run inside FAISS with an IDSelector over the files' positions.
+# On HNSW/IVF a very selective filter can starve the graph walk / probed lists, so
+# filters matching at most this many vectors are scored exactly instead.
+VECTOR_FILTER_EXACT_MAX = int(os.environ.get("VECTOR_FILTER_EXACT_MAX", "4096"))
+
+# Write-behind persistence: mutations mark a store dirty and a background thread
+# saves it after VECTOR_FLUSH_INTERVAL seconds or VECTOR_FLUSH_EVERY mutations.
+VECTOR_FLUSH_INTERVAL = float(os.environ.get("VECTOR_FLUSH_INTERVAL", "5"))
+VECTOR_FLUSH_EVERY = int(os.environ.get("VECTOR_FLUSH_EVERY", "50"))
+# Mutations since the last flush are lost if the process dies, while Mongo already
+# has them. Stores loaded from disk are checked against the owner's Mongo chunks
+# and repaired: missing chunks re-added from their stored vectors, deleted ones
+# tombstoned, stale chunkIndex values renumbered.
+VECTOR_RECONCILE_ON_LOAD = os.environ.get("VECTOR_RECONCILE_ON_LOAD", "true").lower() in ("1", "true", "yes")
+
+# Loaded stores are an LRU cache bounded by an approximate byte budget; owners are
+# loaded on first access and the least recently used unpinned store is evicted.
+VECTOR_CACHE_MAX_BYTES = int(os.environ.get("VECTOR_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+VECTOR_PRELOAD = os.environ.get("VECTOR_PRELOAD", "false").lower() in ("1", "true", "yes")
+# rough per-row overhead of rows added since the last save (python strings/tuples)
+_ROW_OVERHEAD_BYTES = 200
+
+_stores: "OrderedDict[str, OwnerStore]" = OrderedDict()
+# _stores_lock only guards the cache bookkeeping and is never held during embedding,
+# FAISS work or disk I/O; each OwnerStore carries its own reader/writer lock.
 _stores_lock = threading.Lock()
+# owner -> [load lock, threads using it]; dropped when the last one is done
+_load_locks: Dict[str, List[Any]] = {}
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_persist_stats = {"flushes": 0, "errors": 0}
+_flush_wakeup = threading.Event()
+_persister_stop = threading.Event()
+_persister_thread: Optional[threading.Thread] = None
 
 
 class SentenceTransformerEmbeddings:
@@ -52,8 +130,7 @@ class SentenceTransformerEmbeddings:
 
     def embed_query(self, text: str) -> List[float]:
         try:
-            arr = embed_texts([text])  # shape (1, dim)
-            return arr[0].tolist()
+            return embed_query(text).tolist()  # micro-batched with concurrent queries
         except Exception as e:
             logger.exception("embed_query failed: %s", e)
             raise
@@ -78,28 +155,1090 @@ def _owner_dir(owner_id: str) -> Path:
     return VECTORS_DIR / f"owner_{owner_id}"
 
 
-def _save_store(owner_id: str, faiss_store: LC_FAISS):
+def _chunk_metadata(c: Dict) -> Dict:
+    return {
+        "fileId": c.get("fileId"),
+        "ownerId": c.get("ownerId"),
+        "chunkIndex": c.get("chunkIndex"),
+        "chunkId": c.get("id"),
+        "originalName": "",
+    }
+
+
+def embed_chunks(texts: List[str]) -> np.ndarray:
+    """Embed chunk texts once; the result is what gets indexed and persisted in Mongo."""
+    return np.asarray(embed_texts(texts), dtype=np.float32)
+
+
+def pack_vector(vec: np.ndarray) -> bytes:
+    """float32 vector -> compact bytes for the `embedding` field of a chunks document."""
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def unpack_vector(data: Any) -> Optional[np.ndarray]:
+    if not data:
+        return None
+    try:
+        return np.frombuffer(bytes(data), dtype=np.float32)
+    except Exception:
+        return None
+
+
+def _load_chunk_vectors(chunks: List[Dict]) -> np.ndarray:
+    """
+    Return the vectors for Mongo chunk docs, in order. Vectors persisted by process_file
+    are used as-is; only chunks without a usable stored vector (legacy docs, or ones
+    embedded with a different EMBEDDING_MODEL) go through the model, and those are
+    written back so the next rebuild is a pure bulk load.
+    """
+    stored = []
+    for c in chunks:
+        vec = unpack_vector(c.get("embedding")) if c.get("embeddingModel") == MODEL_NAME else None
+        stored.append(vec)
+    dims = {v.shape[0] for v in stored if v is not None}
+    if len(dims) > 1:
+        logger.warning("Stored chunk embeddings have mixed dimensions %s; re-embedding all", dims)
+        stored = [None] * len(chunks)
+
+    missing = [i for i, v in enumerate(stored) if v is None]
+    if missing:
+        fresh = embed_chunks(chunk_texts([chunks[i] for i in missing]))
+        for j, i in enumerate(missing):
+            stored[i] = fresh[j]
+        try:
+            from pymongo import UpdateOne
+
+            ops = [
+                UpdateOne({"id": chunks[i].get("id")}, {"$set": {"embedding": pack_vector(fresh[j]), "embeddingModel": MODEL_NAME}})
+                for j, i in enumerate(missing)
+                if chunks[i].get("id")
+            ]
+            if ops:
+                get_db().chunks.bulk_write(ops, ordered=False)
+        except Exception:
+            logger.exception("Failed to backfill chunk embeddings into Mongo")
+        logger.info("Embedded %d chunks without a stored vector (%d loaded from Mongo)", len(missing), len(chunks) - len(missing))
+
+    if not stored:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(stored).astype(np.float32, copy=False)
+
+
+def _resident_nbytes(arr: Optional[np.ndarray]) -> int:
+    # memory-mapped arrays live in the (shared, evictable) page cache, not in our heap
+    if arr is None or isinstance(arr, np.memmap):
+        return 0
+    return int(arr.nbytes)
+
+
+class _Column:
+    """
+    Append-only column: an immutable base array (memory-mapped when loaded from
+    disk) plus an in-memory tail for rows added since the store was loaded.
+    """
+
+    def __init__(self, dtype: Any = None, base: Optional[np.ndarray] = None):
+        self.dtype = dtype
+        self.base = base
+        self.tail: List[Any] = []
+
+    def _base_len(self) -> int:
+        return 0 if self.base is None else len(self.base)
+
+    def __len__(self) -> int:
+        return self._base_len() + len(self.tail)
+
+    def __getitem__(self, i: int) -> Any:
+        n = self._base_len()
+        return self.base[i] if i < n else self.tail[i - n]
+
+    def extend(self, values: List[Any]):
+        self.tail.extend(values)
+
+    def to_array(self) -> np.ndarray:
+        parts = []
+        if self._base_len():
+            parts.append(np.asarray(self.base))
+        if self.tail:
+            parts.append(np.array(self.tail, dtype=self.dtype))
+        if not parts:
+            return np.zeros(0, dtype=self.dtype or "S1")
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def take(self, keep: np.ndarray) -> "_Column":
+        return _Column(self.dtype, self.to_array()[keep])
+
+    def resident_nbytes(self) -> int:
+        return _resident_nbytes(self.base) + len(self.tail) * _ROW_OVERHEAD_BYTES
+
+
+class _TextColumn:
+    """Chunk texts as one utf-8 blob plus offsets (memory-mapped when loaded), and an in-memory tail."""
+
+    def __init__(self, blob: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self.blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.tail: List[str] = []
+
+    def _base_len(self) -> int:
+        return len(self.offsets) - 1
+
+    def __len__(self) -> int:
+        return self._base_len() + len(self.tail)
+
+    def __getitem__(self, i: int) -> str:
+        n = self._base_len()
+        if i < n:
+            return bytes(self.blob[int(self.offsets[i]) : int(self.offsets[i + 1])]).decode("utf-8", errors="ignore")
+        return self.tail[i - n]
+
+    def extend(self, texts: List[str]):
+        self.tail.extend(t or "" for t in texts)
+
+    def write(self, blob_path: Path, offsets_path: Path):
+        offsets = [int(o) for o in self.offsets]
+        with open(blob_path, "wb") as f:
+            if len(self.blob):
+                f.write(memoryview(np.ascontiguousarray(self.blob)))
+            pos = offsets[-1]
+            for t in self.tail:
+                data = t.encode("utf-8")
+                f.write(data)
+                pos += len(data)
+                offsets.append(pos)
+        np.save(offsets_path, np.array(offsets, dtype=np.int64), allow_pickle=False)
+
+    @classmethod
+    def read(cls, blob_path: Path, offsets_path: Path) -> "_TextColumn":
+        offsets = np.load(offsets_path, mmap_mode="r", allow_pickle=False)
+        if blob_path.stat().st_size == 0:
+            return cls(None, offsets)  # np.memmap cannot map an empty file
+        return cls(np.memmap(blob_path, dtype=np.uint8, mode="r"), offsets)
+
+    def take(self, keep: np.ndarray) -> "_TextColumn":
+        col = _TextColumn()
+        col.extend([self[int(i)] for i in keep])
+        return col
+
+    def resident_nbytes(self) -> int:
+        return _resident_nbytes(self.blob) + _resident_nbytes(self.offsets) + sum(len(t) for t in self.tail)
+
+
+class _VectorColumn:
+    """Exact float32 vectors (memory-mapped when loaded) plus an in-memory tail, for re-scoring."""
+
+    def __init__(self, dim: int, base: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.base = base
+        self.tail: List[np.ndarray] = []
+
+    def _base_len(self) -> int:
+        return 0 if self.base is None else len(self.base)
+
+    def __len__(self) -> int:
+        return self._base_len() + sum(len(t) for t in self.tail)
+
+    def extend(self, vectors: np.ndarray):
+        self.tail.append(np.array(vectors, dtype=np.float32).reshape(-1, self.dim))
+
+    def to_array(self) -> np.ndarray:
+        parts = ([np.asarray(self.base)] if self._base_len() else []) + self.tail
+        if not parts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def slice(self, start: int, stop: int) -> np.ndarray:
+        return np.array(self.to_array()[start:stop]) if self.tail else np.array(self.base[start:stop])
+
+    def gather(self, positions: np.ndarray) -> np.ndarray:
+        if not self.tail:
+            return np.asarray(self.base[positions])
+        if len(self.tail) > 1:
+            self.tail = [np.concatenate(self.tail)]
+        n = self._base_len()
+        out = np.empty((len(positions), self.dim), dtype=np.float32)
+        in_base = positions < n
+        if in_base.any():
+            out[in_base] = self.base[positions[in_base]]
+        out[~in_base] = self.tail[0][positions[~in_base] - n]
+        return out
+
+    def take(self, keep: np.ndarray) -> "_VectorColumn":
+        return _VectorColumn(self.dim, np.ascontiguousarray(self.to_array()[keep]))
+
+    def resident_nbytes(self) -> int:
+        return _resident_nbytes(self.base) + sum(t.nbytes for t in self.tail)
+
+
+def _index_kind(index: Any) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def _index_quantization(index: Any) -> str:
+    if isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF)):
+        index = faiss.downcast_index(index.storage if isinstance(index, faiss.IndexHNSW) else index)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "none"
+
+
+def _code_bytes(index: Any) -> int:
+    """Approximate bytes per vector held by the index (codes plus graph links / ids)."""
+    if isinstance(index, faiss.IndexHNSW):
+        return _code_bytes(faiss.downcast_index(index.storage)) + 2 * VECTOR_HNSW_M * 4
+    if isinstance(index, faiss.IndexIVF):
+        return int(index.code_size) + 8
+    return int(getattr(index, "code_size", index.d * 4))
+
+
+def _choose_quantization(n: int, dim: int, kind: str) -> str:
+    quantization = VECTOR_QUANTIZATION if VECTOR_QUANTIZATION in ("fp16", "sq8", "pq") else "none"
+    if quantization == "pq" and (kind == "flat" or n < max(VECTOR_PQ_MIN_TRAIN, 256) or dim % VECTOR_PQ_M):
+        # flat index, too few vectors to train 256 centroids per sub-space (or bad M): sq8 until the next rebuild
+        quantization = "sq8"
+    return quantization
+
+
+def _build_index(vectors: np.ndarray, kind: str, quantization: str = "none", add: bool = True) -> Any:
+    """Build a fresh index of the given kind trained on vectors; with add, position i holds vectors[i]."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = int(vectors.shape[1])
+    codec = {"none": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{VECTOR_PQ_M}"}[quantization]
+    if kind == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{VECTOR_HNSW_M}" if codec == "Flat" else f"HNSW{VECTOR_HNSW_M}_{codec}")
+        index.hnsw.efConstruction = VECTOR_HNSW_EF_CONSTRUCTION
+    elif kind == "ivf":
+        nlist = max(1, min(int(4 * np.sqrt(len(vectors))), len(vectors) // 39 or 1))
+        index = faiss.index_factory(dim, f"IVF{nlist},{codec}")
+    else:
+        index = faiss.index_factory(dim, codec)
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > VECTOR_TRAIN_SAMPLE:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), VECTOR_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    if kind == "ivf":
+        # sequential ids -> array direct map, so positions can be reconstructed for rebuilds
+        index.make_direct_map()
+    if add:
+        index.add(vectors)
+    return index
+
+
+class OwnerStore:
+    """
+    One owner's vectors in a raw FAISS index plus columnar metadata, all addressed
+    by vector position:
+    - ids: chunk id (the Mongo chunks `id`) per position
+    - rows: (file code, chunkIndex) per position; files maps a code to [fileId, originalName]
+    - texts: chunk text per position
+    - tombstones: positions that were deleted but are still physically in the index
+
+    Deleting a file only tombstones its positions (cost ~ size of the file). Searches
+    exclude tombstones with a FAISS IDSelector and the index is compacted with
+    remove_ids once tombstones reach VECTOR_COMPACT_RATIO of the index -- no vector is
+    ever re-embedded.
+
+    The index starts as exact IndexFlatL2 and is promoted to HNSW/IVF for large owners
+    (see _maybe_promote). With VECTOR_QUANTIZATION the index holds compressed codes
+    and `vectors` keeps the exact vectors for re-scoring. A store loaded from disk is
+    memory-mapped read-only; the first mutation copies the index into owned memory.
+
+    lock is a per-owner reader/writer lock: searches and saves take it shared,
+    adds/deletes/compaction take it exclusive.
+    """
+
+    def __init__(
+        self,
+        owner_id: str,
+        index: Any,
+        ids: Optional[_Column] = None,
+        rows: Optional[_Column] = None,
+        files: Optional[List[List[str]]] = None,
+        texts: Optional[_TextColumn] = None,
+        tombstones: Optional[List[int]] = None,
+        index_mapped: bool = False,
+        vectors: Optional[_VectorColumn] = None,
+    ):
+        self.owner_id = owner_id
+        self.index = index
+        self.index_mapped = index_mapped
+        if vectors is None and _index_quantization(index) != "none":
+            vectors = _VectorColumn(int(index.d))
+        self.vectors = vectors
+        self.ids = ids if ids is not None else _Column()
+        self.rows = rows if rows is not None else _Column(_ROW_DTYPE)
+        self.files: List[List[str]] = [list(f) for f in (files or [])]
+        self._file_codes = {f[0]: code for code, f in enumerate(self.files)}
+        self.texts = texts if texts is not None else _TextColumn()
+        self.tombstones = set(int(t) for t in (tombstones or []))
+        self._tombstone_selector: Optional[Tuple[Any, Any]] = None
+        self._refresh_tombstone_selector()
+        # fileId -> live positions; built on first delete so cold loads stay cheap
+        self._file_positions: Optional[Dict[str, List[int]]] = None
+        # bumped whenever positions are renumbered (compaction)
+        self.layout_version = 0
+        self.lock = RWLock()
+        # set once the owner's last file is deleted; a removed store is never saved again
+        self.removed = False
+        # number of callers currently using this store; pinned stores are never evicted
+        self.pins = 0
+        # mutations not yet written to disk; dirty stores are never evicted
+        self.dirty = 0
+        # an index build (promotion or compaction) is running outside the lock; guarded by _stores_lock
+        self.rebuilding = False
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal)
+
+    @property
+    def kind(self) -> str:
+        return _index_kind(self.index)
+
+    @property
+    def quantization(self) -> str:
+        return _index_quantization(self.index)
+
+    @property
+    def live_count(self) -> int:
+        return max(0, self.ntotal - len(self.tombstones))
+
+    def nbytes(self) -> int:
+        """Approximate resident (non-shared) size; memory-mapped data is not counted."""
+        index_bytes = 0 if self.index_mapped else self.ntotal * _code_bytes(self.index)
+        vector_bytes = self.vectors.resident_nbytes() if self.vectors is not None else 0
+        return (
+            index_bytes + vector_bytes + self.ids.resident_nbytes() + self.rows.resident_nbytes() + self.texts.resident_nbytes()
+        )
+
+    # --- metadata -------------------------------------------------------------
+
+    def _file_code(self, file_id: Optional[str], original_name: Optional[str]) -> int:
+        if file_id is None:
+            return -1
+        code = self._file_codes.get(file_id)
+        if code is None:
+            code = len(self.files)
+            self.files.append([file_id, original_name or ""])
+            self._file_codes[file_id] = code
+        elif original_name and not self.files[code][1]:
+            self.files[code][1] = original_name
+        return code
+
+    def metadata(self, pos: int) -> Dict[str, Any]:
+        row = self.rows[pos]
+        code, chunk_index = int(row[0]), int(row[1])
+        file_id, original_name = self.files[code] if 0 <= code < len(self.files) else (None, "")
+        chunk_id = self.ids[pos]
+        return {
+            "fileId": file_id,
+            "ownerId": self.owner_id,
+            "chunkIndex": chunk_index if chunk_index >= 0 else None,
+            "chunkId": chunk_id.decode("utf-8") if isinstance(chunk_id, bytes) else str(chunk_id),
+            "originalName": original_name,
+        }
+
+    def document(self, pos: int) -> Document:
+        return Document(page_content=self.texts[pos], metadata=self.metadata(pos))
+
+    def _file_map(self) -> Dict[str, List[int]]:
+        if self._file_positions is None:
+            positions: Dict[str, List[int]] = {}
+            codes = self.rows.to_array()["file"] if len(self.rows) else np.zeros(0, dtype=np.int32)
+            for pos, code in enumerate(codes.tolist()):
+                if code < 0 or pos in self.tombstones:
+                    continue
+                positions.setdefault(self.files[code][0], []).append(pos)
+            self._file_positions = positions
+        return self._file_positions
+
+    # --- mutations (caller holds lock.write()) ---------------------------------
+
+    def _make_writable(self):
+        if self.index_mapped:
+            # a memory-mapped index is a read-only view; copy it into owned memory once
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.index_mapped = False
+
+    def exact_vectors(self, start: int, stop: int) -> np.ndarray:
+        """Unquantized vectors for positions [start, stop), the source for index rebuilds."""
+        if self.vectors is not None:
+            return self.vectors.slice(start, stop)
+        return self.index.reconstruct_n(start, stop - start)
+
+    def exact_vectors_at(self, positions: np.ndarray) -> np.ndarray:
+        if self.vectors is not None:
+            return self.vectors.gather(positions)
+        return self.index.reconstruct_batch(positions)
+
+    def replace_index(self, index: Any, vectors: np.ndarray):
+        """Swap in a rebuilt index over `vectors` (all positions), keeping exact vectors only if quantized."""
+        self.index = index
+        self.index_mapped = False
+        if _index_quantization(index) != "none":
+            self.vectors = _VectorColumn(int(index.d), np.ascontiguousarray(vectors, dtype=np.float32))
+        else:
+            self.vectors = None
+
+    def add_embeddings(self, texts: List[str], vectors: np.ndarray, metadatas: List[Dict], ids: List[str]) -> List[str]:
+        self._make_writable()
+        start = self.ntotal
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.index.add(vectors)
+        if self.vectors is not None:
+            self.vectors.extend(vectors)
+        self.ids.extend([str(i).encode("utf-8") for i in ids])
+        rows = []
+        for md in metadatas:
+            md = md or {}
+            chunk_index = md.get("chunkIndex")
+            rows.append((self._file_code(md.get("fileId"), md.get("originalName")), -1 if chunk_index is None else int(chunk_index)))
+        self.rows.extend(rows)
+        self.texts.extend(texts)
+        if self._file_positions is not None:
+            for offset, md in enumerate(metadatas):
+                file_id = (md or {}).get("fileId")
+                if file_id is not None:
+                    self._file_positions.setdefault(file_id, []).append(start + offset)
+        return ids
+
+    def _refresh_tombstone_selector(self):
+        if not self.tombstones:
+            self._tombstone_selector = None
+            return
+        batch = faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))
+        # keep the batch referenced: IDSelectorNot does not own it
+        self._tombstone_selector = (batch, faiss.IDSelectorNot(batch))
+
+    def delete_file(self, file_id: str) -> int:
+        """Tombstone every vector of file_id. Returns the number of vectors removed."""
+        positions = self._file_map().pop(file_id, [])
+        if positions:
+            self.tombstones.update(positions)
+            self._refresh_tombstone_selector()
+        return len(positions)
+
+    def delete_chunks(self, file_id: str, chunk_ids: List[str]) -> int:
+        """Tombstone the given chunks of file_id. Returns the number of vectors removed."""
+        wanted = {str(c).encode("utf-8") for c in chunk_ids}
+        positions = self._file_map().get(file_id, [])
+        removed = [pos for pos in positions if bytes(self.ids[pos]) in wanted]
+        if removed:
+            gone = set(removed)
+            self._file_map()[file_id] = [pos for pos in positions if pos not in gone]
+            self.tombstones.update(removed)
+            self._refresh_tombstone_selector()
+        return len(removed)
+
+    def renumber_chunks(self, file_id: str, chunk_indexes: Dict[str, int]) -> int:
+        """Give chunks of file_id (by chunk id) a new chunkIndex. Returns the number of vectors changed."""
+        wanted = {str(c).encode("utf-8"): int(i) for c, i in chunk_indexes.items()}
+        changes = []
+        for pos in self._file_map().get(file_id, []):
+            chunk_index = wanted.get(bytes(self.ids[pos]))
+            if chunk_index is not None:
+                changes.append((pos, chunk_index))
+        if changes:
+            # the base rows may be a read-only memory map: the column is rewritten in memory
+            rows = self.rows.to_array().copy()
+            for pos, chunk_index in changes:
+                rows["chunk"][pos] = chunk_index
+            self.rows = _Column(_ROW_DTYPE, rows)
+        return len(changes)
+
+    def needs_compaction(self) -> bool:
+        return bool(self.tombstones) and len(self.tombstones) >= VECTOR_COMPACT_RATIO * max(1, self.ntotal)
+
+    def compaction_kind(self) -> Optional[str]:
+        """Index kind a compaction rebuilds into, or None when the flat index is compacted in place."""
+        kind = self.kind
+        if kind == "flat":
+            return None
+        return "flat" if self.live_count < VECTOR_ANN_THRESHOLD // 2 else kind
+
+    def _take_positions(self, keep: np.ndarray):
+        self.ids = self.ids.take(keep)
+        self.rows = self.rows.take(keep)
+        self.texts = self.texts.take(keep)
+        self.layout_version += 1
+        self._file_positions = None
+
+    def compact(self) -> int:
+        """
+        Physically drop tombstoned vectors from a flat index and the columns (no
+        re-embedding). HNSW cannot remove and IVF would keep stale ids, so those
+        are rebuilt outside the lock instead (see _compact_store).
+        """
+        dropped = len(self.tombstones)
+        if dropped:
+            self._make_writable()
+            removed = np.array(sorted(self.tombstones), dtype=np.int64)
+            keep = np.setdiff1d(np.arange(self.ntotal, dtype=np.int64), removed, assume_unique=True)
+            self.index.remove_ids(removed)  # flat remove_ids keeps the surviving order
+            if self.vectors is not None:
+                self.vectors = self.vectors.take(keep)
+            self._take_positions(keep)
+        self.tombstones.clear()
+        self._refresh_tombstone_selector()
+        logger.info("Compacted FAISS store for %s: dropped %d tombstoned vectors, %d remain", self.owner_id, dropped, self.ntotal)
+        return dropped
+
+    def swap_compacted(self, index: Any, vectors: np.ndarray, keep: np.ndarray, snapshot_n: int) -> int:
+        """
+        Install an index rebuilt over the snapshot positions `keep` (the first
+        snapshot_n positions minus their tombstones). Vectors appended and
+        positions tombstoned since the snapshot carry over. Returns the number dropped.
+        """
+        before = self.ntotal
+        if before > snapshot_n:
+            appended = self.exact_vectors(snapshot_n, before)
+            index.add(appended)
+            vectors = np.concatenate([vectors, appended])
+            keep = np.concatenate([keep, np.arange(snapshot_n, before, dtype=np.int64)])
+        late = []
+        for pos in self.tombstones:
+            j = int(np.searchsorted(keep, pos))
+            if j < len(keep) and keep[j] == pos:
+                late.append(j)
+        self.replace_index(index, vectors)
+        self._take_positions(keep)
+        self.tombstones = set(late)
+        self._refresh_tombstone_selector()
+        return before - len(keep)
+
+    # --- search (caller holds lock.read()) -------------------------------------
+
+    def positions_for_files(self, file_ids: List[str]) -> np.ndarray:
+        """Sorted live positions of the given files (the pushed-down file filter)."""
+        file_map = self._file_map()
+        parts = [file_map[f] for f in set(file_ids) if f in file_map]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate([np.asarray(p, dtype=np.int64) for p in parts]))
+
+    def _search_params(self, k: int, ef_search: Optional[int], nprobe: Optional[int], sel: Any = None) -> Any:
+        kind = self.kind
+        if kind == "hnsw":
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(int(ef_search or VECTOR_HNSW_EF_SEARCH), k)
+        elif kind == "ivf":
+            params = faiss.SearchParametersIVF()
+            params.nprobe = max(1, min(int(nprobe or VECTOR_IVF_NPROBE), self.index.nlist))
+        else:
+            params = faiss.SearchParameters()
+        if sel is not None:
+            params.sel = sel
+        elif self._tombstone_selector is not None:
+            params.sel = self._tombstone_selector[1]
+        return params
+
+    def search(
+        self,
+        xq: np.ndarray,
+        top_k: int,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        positions: Optional[np.ndarray] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Search query rows xq (n, dim). Returns per query [(position, L2 distance)], tombstones
+        excluded. ef_search / nprobe tune recall vs latency on HNSW / IVF indexes (ignored on flat).
+        positions (live positions, see positions_for_files) restricts the search to them.
+        """
+        allowed = self.live_count if positions is None else len(positions)
+        k = min(int(top_k), allowed)
+        if k <= 0:
+            return [[] for _ in range(len(xq))]
+        xq = np.ascontiguousarray(xq, dtype=np.float32)
+        if self.kind == "flat" and self.quantization == "pq":
+            # flat IndexPQ (saved before pq was limited to HNSW/IVF) rejects selectors: score exactly
+            if positions is None:
+                positions = np.setdiff1d(np.arange(self.ntotal, dtype=np.int64), list(self.tombstones))
+            return self._exact_search(xq, k, positions)
+        sel = None
+        if positions is not None:
+            if self.kind != "flat" and allowed <= VECTOR_FILTER_EXACT_MAX:
+                return self._exact_search(xq, k, positions)
+            sel = faiss.IDSelectorBatch(positions)
+        # quantized codes only shortlist candidates; exact distances decide the final order
+        candidates = k if self.vectors is None else min(k * max(1, VECTOR_RESCORE_FACTOR), allowed)
+        # per-call parameters: never mutate index.hnsw.efSearch / index.nprobe under a shared lock
+        D, I = self.index.search(xq, candidates, params=self._search_params(candidates, ef_search, nprobe, sel))
+        if self.vectors is None:
+            return [[(int(i), float(d)) for d, i in zip(D[q], I[q]) if i != -1] for q in range(len(xq))]
+        results = []
+        for q in range(len(xq)):
+            positions_q = I[q][I[q] != -1]
+            results.append(self._rescore(xq[q], positions_q, k))
+        return results
+
+    def _rescore(self, q: np.ndarray, positions: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not len(positions):
+            return []
+        diffs = self.exact_vectors_at(positions) - q
+        dists = np.einsum("ij,ij->i", diffs, diffs)
+        order = np.argsort(dists, kind="stable")[:k]
+        return [(int(positions[j]), float(dists[j])) for j in order]
+
+    def _exact_search(self, xq: np.ndarray, k: int, positions: np.ndarray) -> List[List[Tuple[int, float]]]:
+        vecs = self.exact_vectors_at(positions)
+        dists = (xq * xq).sum(1)[:, None] - 2.0 * xq @ vecs.T + (vecs * vecs).sum(1)[None, :]
+        results = []
+        for q in range(len(xq)):
+            top = np.argpartition(dists[q], k - 1)[:k] if k < len(positions) else np.arange(len(positions))
+            top = top[np.argsort(dists[q][top], kind="stable")]
+            results.append([(int(positions[j]), float(max(dists[q][j], 0.0))) for j in top])
+        return results
+
+    # --- persistence --------------------------------------------------------------
+
+    def write(self, d: Path):
+        faiss.write_index(self.index, str(d / INDEX_FILE))
+        np.save(d / IDS_FILE, self.ids.to_array(), allow_pickle=False)
+        np.save(d / ROWS_FILE, self.rows.to_array(), allow_pickle=False)
+        self.texts.write(d / TEXT_FILE, d / TEXT_OFFSETS_FILE)
+        np.save(d / TOMBSTONES_FILE, np.array(sorted(self.tombstones), dtype=np.int64), allow_pickle=False)
+        if self.vectors is not None:
+            np.save(d / VECTORS_FILE, self.vectors.to_array(), allow_pickle=False)
+        with open(d / META_FILE, "w", encoding="utf-8") as f:
+            json.dump({"format": STORE_FORMAT, "dim": int(self.index.d), "count": self.ntotal, "files": self.files}, f)
+
+    @classmethod
+    def read(cls, owner_id: str, d: Path) -> "OwnerStore":
+        with open(d / META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != STORE_FORMAT:
+            raise ValueError(f"unsupported vector store format {meta.get('format')!r}")
+        index_mapped = bool(_INDEX_MMAP_FLAGS)
+        try:
+            index = faiss.read_index(str(d / INDEX_FILE), _INDEX_MMAP_FLAGS)
+        except Exception:
+            # index types without mmap support are read into memory
+            index = faiss.read_index(str(d / INDEX_FILE))
+            index_mapped = False
+        ids = np.load(d / IDS_FILE, mmap_mode="r", allow_pickle=False)
+        rows = np.load(d / ROWS_FILE, mmap_mode="r", allow_pickle=False)
+        tombstones = np.load(d / TOMBSTONES_FILE, allow_pickle=False).tolist()
+        vectors = None
+        if (d / VECTORS_FILE).exists():
+            exact = np.load(d / VECTORS_FILE, mmap_mode="r", allow_pickle=False)
+            vectors = _VectorColumn(int(index.d), exact if len(exact) else None)
+        store = cls(
+            owner_id,
+            index,
+            ids=_Column(None, ids if len(ids) else None),
+            rows=_Column(_ROW_DTYPE, rows if len(rows) else None),
+            files=meta.get("files") or [],
+            texts=_TextColumn.read(d / TEXT_FILE, d / TEXT_OFFSETS_FILE),
+            tombstones=tombstones,
+            index_mapped=index_mapped,
+            vectors=vectors,
+        )
+        if not (store.ntotal == len(store.ids) == len(store.rows) == len(store.texts)):
+            raise ValueError(f"inconsistent vector store in {d}")
+        if store.vectors is not None and len(store.vectors) != store.ntotal:
+            raise ValueError(f"inconsistent vector store in {d}")
+        return store
+
+
+def _store_from_vectors(
+    owner_id: str, texts: List[str], vectors: np.ndarray, metadatas: List[Dict], ids: List[str]
+) -> OwnerStore:
+    if not texts:
+        raise ValueError("cannot build a FAISS store from zero vectors")
+    # always flat, even for a large owner (first bulk upload or rebuild from Mongo):
+    # HNSW/IVF training can take minutes, so it is left to the background promotion
+    quantization = _choose_quantization(len(texts), int(vectors.shape[1]), "flat")
+    # trained but empty, so add_embeddings fills the index and the columns together
+    store = OwnerStore(owner_id, _build_index(vectors, "flat", quantization, add=False))
+    store.add_embeddings(texts, vectors, metadatas, ids)
+    return store
+
+
+def _start_rebuild(store: OwnerStore) -> bool:
+    """Claim the store's single index-build slot; False if a build is already running."""
+    with _stores_lock:
+        if store.rebuilding:
+            return False
+        store.rebuilding = True
+        return True
+
+
+def _end_rebuild(store: OwnerStore):
+    with _stores_lock:
+        store.rebuilding = False
+
+
+def _maybe_promote(owner_id: str, store: OwnerStore) -> bool:
+    """
+    Move a large owner from the exact flat index to VECTOR_ANN_KIND. The new index is
+    built from a snapshot outside the owner's lock, so searches keep running; vectors
+    added meanwhile are appended before the swap.
+    """
+    if VECTOR_ANN_KIND not in ("hnsw", "ivf") or store.kind != "flat" or store.live_count < VECTOR_ANN_THRESHOLD:
+        return False
+    if not _start_rebuild(store):
+        return False  # another add is already building the index
+    try:
+        with store.lock.read():
+            if store.removed or store.kind != "flat":
+                return False
+            snapshot_n = store.ntotal
+            layout = store.layout_version
+            vectors = store.exact_vectors(0, snapshot_n)
+        quantization = _choose_quantization(len(vectors), int(vectors.shape[1]), VECTOR_ANN_KIND)
+        new_index = _build_index(vectors, VECTOR_ANN_KIND, quantization)
+        with store.lock.write():
+            if store.removed or store.kind != "flat" or store.layout_version != layout:
+                return False  # compacted or promoted meanwhile; a later add retries
+            if store.ntotal > snapshot_n:
+                appended = store.exact_vectors(snapshot_n, store.ntotal)
+                new_index.add(appended)
+                vectors = np.concatenate([vectors, appended])
+            store.replace_index(new_index, vectors)
+    finally:
+        _end_rebuild(store)
+    logger.info(
+        "Promoted FAISS store for %s to %s/%s (%d vectors)", owner_id, VECTOR_ANN_KIND, quantization, store.ntotal
+    )
+    _mark_dirty(owner_id, store)
+    return True
+
+
+def _promote_in_background(owner_id: str, store: OwnerStore):
+    """
+    Run _maybe_promote on a daemon thread when the store qualifies, so the request
+    or ingest job that crossed VECTOR_ANN_THRESHOLD does not wait for the index
+    training. The store stays pinned until the promotion is done.
+    """
+    if VECTOR_ANN_KIND not in ("hnsw", "ivf") or store.kind != "flat" or store.live_count < VECTOR_ANN_THRESHOLD:
+        return
+    with _stores_lock:
+        if store.rebuilding:
+            return
+        store.pins += 1
+
+    def run():
+        try:
+            _maybe_promote(owner_id, store)
+        except Exception:
+            # the vectors are stored either way; promotion is retried on the next add
+            logger.exception("Index promotion failed for %s; keeping the flat index", owner_id)
+        finally:
+            _release(store)
+
+    threading.Thread(target=run, name=f"vector-promote-{owner_id}", daemon=True).start()
+
+
+def _compact_store(owner_id: str, store: OwnerStore) -> int:
+    """
+    Compact an HNSW/IVF store by rebuilding its index without the tombstoned
+    vectors. Like _maybe_promote, the build runs on a snapshot outside the owner's
+    lock, so searches keep running; only the swap takes the write lock.
+    """
+    if not _start_rebuild(store):
+        return 0  # a build is already running; a later delete retries
+    try:
+        with store.lock.read():
+            kind = store.compaction_kind()
+            if store.removed or kind is None or not store.needs_compaction():
+                return 0
+            snapshot_n = store.ntotal
+            layout = store.layout_version
+            removed = np.array(sorted(store.tombstones), dtype=np.int64)
+            keep = np.setdiff1d(np.arange(snapshot_n, dtype=np.int64), removed, assume_unique=True)
+            live = store.exact_vectors(0, snapshot_n)[keep]
+        quantization = _choose_quantization(len(live), int(live.shape[1]), kind)
+        new_index = _build_index(live, kind, quantization)
+        with store.lock.write():
+            if store.removed or store.layout_version != layout:
+                return 0  # compacted meanwhile; a later delete retries
+            dropped = store.swap_compacted(new_index, live, keep, snapshot_n)
+    finally:
+        _end_rebuild(store)
+    logger.info(
+        "Compacted FAISS store for %s into %s/%s: dropped %d tombstoned vectors, %d remain",
+        owner_id,
+        kind,
+        quantization,
+        dropped,
+        store.ntotal,
+    )
+    return dropped
+
+
+def _fsync_dir(path: Path):
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on some platforms (Windows)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _current_store_dir(owner_id: str) -> Optional[Path]:
+    """
+    Directory holding the owner's committed index files. Saves go to a new
+    generation directory and the CURRENT pointer is swapped atomically, so a crash
+    mid-save leaves the previous generation in place. Pre-generation (LangChain)
+    stores keep their files directly in the owner directory.
+    """
     d = _owner_dir(owner_id)
-    d.mkdir(parents=True, exist_ok=True)
-    faiss_store.save_local(str(d))
-    logger.debug("Saved FAISS store for owner %s at %s", owner_id, str(d))
+    pointer = d / CURRENT_FILE
+    if pointer.exists():
+        try:
+            gen = pointer.read_text(encoding="utf-8").strip()
+            if gen and (d / gen).is_dir():
+                return d / gen
+        except Exception:
+            logger.exception("Failed to read %s for owner %s", CURRENT_FILE, owner_id)
+    if (d / "index.faiss").exists():
+        return d
+    return None
 
 
-def _load_store_from_disk(owner_id: str) -> Optional[LC_FAISS]:
+def _save_store(owner_id: str, owner_store: OwnerStore):
+    """Atomically write the store: temp dir -> generation dir -> CURRENT pointer swap."""
     d = _owner_dir(owner_id)
-    if not d.exists() or not any(d.iterdir()):
-        return None
+    d.mkdir(parents=True, exist_ok=True)
+    current = _current_store_dir(owner_id)
+    gen_no = 1
+    if current is not None and current != d:
+        try:
+            gen_no = int(current.name[len(GEN_PREFIX) :]) + 1
+        except ValueError:
+            pass
+    gen_name = f"{GEN_PREFIX}{gen_no:06d}"
+
+    tmp = d / f".tmp-{uuid.uuid4().hex}"
+    tmp.mkdir()
     try:
-        # newer langchain_community requires allow_dangerous_deserialization flag
+        # shared lock: searches continue while we serialize, writers wait for a consistent snapshot
+        with owner_store.lock.read():
+            if owner_store.removed:
+                shutil.rmtree(tmp, ignore_errors=True)
+                return
+            owner_store.write(tmp)
+        for f in tmp.iterdir():
+            with open(f, "rb") as fh:
+                os.fsync(fh.fileno())
+        _fsync_dir(tmp)
+        if (d / gen_name).exists():
+            shutil.rmtree(d / gen_name)
+        os.replace(tmp, d / gen_name)
+
+        pointer_tmp = d / f"{CURRENT_FILE}.tmp"
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            f.write(gen_name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_tmp, d / CURRENT_FILE)
+        _fsync_dir(d)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # the new generation is committed; drop older generations, temp dirs and legacy files
+    for p in d.iterdir():
+        if p.name in (gen_name, CURRENT_FILE):
+            continue
         try:
-            store = LC_FAISS.load_local(str(d), _EMBEDDINGS, allow_dangerous_deserialization=True)  # type: ignore
-        except TypeError:
-            store = LC_FAISS.load_local(str(d), _EMBEDDINGS)
-        logger.info("Loaded FAISS store for owner %s from %s", owner_id, str(d))
+            if p.is_dir():
+                shutil.rmtree(p)
+            else:
+                p.unlink()
+        except Exception:
+            logger.debug("Could not clean up %s", p)
+    logger.debug("Saved FAISS store for owner %s at %s", owner_id, str(d / gen_name))
+
+
+def _reconcile_with_mongo(owner_id: str, store: OwnerStore) -> Optional[OwnerStore]:
+    """
+    Bring a store just read from disk (not cached yet, so no lock needed) in line
+    with the owner's Mongo chunks. Returns the store, or None when it cannot be
+    repaired in place and must be rebuilt from Mongo.
+    """
+    db = get_db()
+    records = list(db.chunks.find({"ownerId": owner_id}, {"_id": 0, "id": 1, "fileId": 1, "chunkIndex": 1}))
+    expected = {r["id"]: r for r in records if r.get("id")}
+    if len(expected) != len(records):
+        # legacy chunks without ids cannot be matched to vectors; only the count can be checked
+        return store if len(records) == store.live_count else None
+
+    ids = store.ids.to_array().tolist() if len(store.ids) else []
+    chunks = store.rows.to_array()["chunk"].tolist() if len(store.rows) else []
+    extra = []
+    renumber: Dict[str, Dict[str, int]] = {}
+    live = set()
+    for pos, raw in enumerate(ids):
+        if pos in store.tombstones:
+            continue
+        chunk_id = raw.decode("utf-8") if isinstance(raw, bytes) else str(raw)
+        record = expected.get(chunk_id)
+        if record is None:
+            extra.append(pos)
+            continue
+        live.add(chunk_id)
+        chunk_index = record.get("chunkIndex")
+        chunk_index = -1 if chunk_index is None else int(chunk_index)
+        if chunk_index != chunks[pos]:
+            renumber.setdefault(record.get("fileId"), {})[chunk_id] = chunk_index
+    missing = [chunk_id for chunk_id in expected if chunk_id not in live]
+    if not (extra or renumber or missing):
         return store
+
+    if extra:
+        store.tombstones.update(extra)
+        store._refresh_tombstone_selector()
+        store._file_positions = None
+    for file_id, chunk_indexes in renumber.items():
+        store.renumber_chunks(file_id, chunk_indexes)
+    if missing:
+        docs = list(db.chunks.find({"ownerId": owner_id, "id": {"$in": missing}}))
+        vectors = _load_chunk_vectors(docs)
+        if len(docs) and vectors.shape[1] != store.index.d:
+            return None
+        if docs:
+            store.add_embeddings(
+                [c.get("text", "") for c in docs], vectors, [_chunk_metadata(c) for c in docs], [c.get("id") for c in docs]
+            )
+    if store.live_count == 0:
+        return None
+    store.dirty = 1
+    logger.warning(
+        "FAISS store for %s was behind Mongo: re-added %d chunks, tombstoned %d, renumbered %d",
+        owner_id,
+        len(missing),
+        len(extra),
+        sum(len(c) for c in renumber.values()),
+    )
+    return store
+
+
+def _load_store_from_disk(owner_id: str) -> Optional[OwnerStore]:
+    d = _current_store_dir(owner_id)
+    if d is None:
+        return None
+    if not (d / META_FILE).exists():
+        # LangChain save_local output (pickled docstore). It is never unpickled: the
+        # caller rebuilds from the vectors persisted in Mongo and the next save
+        # replaces it with the native format.
+        logger.info("Store for owner %s at %s is in the legacy LangChain format; it will be rebuilt", owner_id, str(d))
+        return None
+    try:
+        store = OwnerStore.read(owner_id, d)
+        logger.info("Loaded FAISS store for owner %s from %s (%d vectors)", owner_id, str(d), store.ntotal)
     except Exception as e:
         logger.exception("Failed to load FAISS store for %s: %s", owner_id, e)
         return None
+    if VECTOR_RECONCILE_ON_LOAD:
+        try:
+            store = _reconcile_with_mongo(owner_id, store)
+        except Exception as e:
+            # Mongo unavailable: serve what was persisted, the next load checks again
+            logger.exception("Failed to check the FAISS store for %s against Mongo: %s", owner_id, e)
+        if store is None:
+            logger.warning("FAISS store for %s disagrees with Mongo; it will be rebuilt", owner_id)
+    return store
+
+
+def _remove_store_dir(owner_id: str):
+    d = _owner_dir(owner_id)
+    if d.exists():
+        shutil.rmtree(d, ignore_errors=True)
+
+
+def _mark_dirty(owner_id: str, store: OwnerStore):
+    """
+    Record a mutation. The store is written by the background persister after
+    VECTOR_FLUSH_INTERVAL seconds or VECTOR_FLUSH_EVERY mutations, whichever comes
+    first, so bursts of small uploads coalesce into one save. With a non-positive
+    interval the store is written through immediately.
+    """
+    if VECTOR_FLUSH_INTERVAL <= 0:
+        _save_store(owner_id, store)
+        return
+    with _stores_lock:
+        store.dirty += 1
+        if store.dirty >= VECTOR_FLUSH_EVERY:
+            _flush_wakeup.set()
+
+
+def flush_store(owner_id: str) -> bool:
+    """Write the owner's store if it has unsaved mutations. Returns True if it was written."""
+    with _stores_lock:
+        store = _stores.get(owner_id)
+        if store is None or store.dirty == 0:
+            return False
+        pending = store.dirty
+        store.pins += 1
+    try:
+        _save_store(owner_id, store)
+        with _stores_lock:
+            # mutations that raced with the save keep the store dirty for the next round
+            store.dirty = max(0, store.dirty - pending)
+            _persist_stats["flushes"] += 1
+        return True
+    except Exception as e:
+        with _stores_lock:
+            _persist_stats["errors"] += 1
+        logger.exception("Background flush failed for owner %s: %s", owner_id, e)
+        return False
+    finally:
+        _release(store)
+
+
+def flush_all_stores() -> int:
+    with _stores_lock:
+        dirty = [owner_id for owner_id, s in _stores.items() if s.dirty > 0]
+    flushed = sum(1 for owner_id in dirty if flush_store(owner_id))
+    with _stores_lock:
+        # stores that were dirty could not be evicted; retry now that they are clean
+        _evict_over_budget()
+    return flushed
+
+
+def _persister_loop():
+    while not _persister_stop.is_set():
+        _flush_wakeup.wait(VECTOR_FLUSH_INTERVAL)
+        _flush_wakeup.clear()
+        try:
+            flush_all_stores()
+        except Exception:
+            logger.exception("Vector store persister iteration failed")
+
+
+def start_persister():
+    global _persister_thread
+    if VECTOR_FLUSH_INTERVAL <= 0 or (_persister_thread is not None and _persister_thread.is_alive()):
+        return
+    _persister_stop.clear()
+    _persister_thread = threading.Thread(target=_persister_loop, name="vector-store-persister", daemon=True)
+    _persister_thread.start()
+    logger.info("Vector store persister started (interval %.1fs, every %d mutations)", VECTOR_FLUSH_INTERVAL, VECTOR_FLUSH_EVERY)
+
+
+def stop_persister():
+    """Stop the background persister and flush everything still dirty."""
+    global _persister_thread
+    _persister_stop.set()
+    _flush_wakeup.set()
+    if _persister_thread is not None:
+        _persister_thread.join(timeout=30)
+        _persister_thread = None
+    flushed = flush_all_stores()
+    logger.info("Vector store persister stopped (%d stores flushed on shutdown)", flushed)
 
 
 def list_loaded_owner_ids() -> List[str]:
@@ -107,302 +1246,385 @@ def list_loaded_owner_ids() -> List[str]:
         return list(_stores.keys())
 
 
-def load_all_stores() -> List[str]:
-    loaded = []
-    for p in VECTORS_DIR.iterdir():
-        if p.is_dir() and p.name.startswith("owner_"):
-            owner_id = p.name[len("owner_") :]
-            try:
-                store = _load_store_from_disk(owner_id)
-                if store:
-                    with _stores_lock:
-                        _stores[owner_id] = store
-                    loaded.append(owner_id)
-            except Exception as e:
-                logger.exception("Error loading store for %s: %s", owner_id, e)
-    logger.info("FAISS stores loaded for owners: %s", loaded)
-    return loaded
+def cache_stats() -> Dict[str, Any]:
+    with _stores_lock:
+        return {
+            **_cache_stats,
+            "loaded": len(_stores),
+            "bytes": sum(s.nbytes() for s in _stores.values()),
+            "max_bytes": VECTOR_CACHE_MAX_BYTES,
+            "dirty": sum(1 for s in _stores.values() if s.dirty > 0),
+            **_persist_stats,
+        }
 
 
-def _rebuild_store_from_mongo(owner_id: str) -> LC_FAISS:
-    """
-    Recreate FAISS index from Mongo chunks for owner_id.
-    """
-    db = get_db()
-    chunks = list(db.chunks.find({"ownerId": owner_id}))
-    texts = [c.get("text", "") for c in chunks]
-    metas = [
-        {
-            "fileId": c.get("fileId"),
-            "ownerId": c.get("ownerId"),
-            "chunkIndex": c.get("chunkIndex"),
-            "originalName": "",
-        }
-        for c in chunks
-    ]
-    store = LC_FAISS.from_texts(texts=texts, embedding=_EMBEDDINGS, metadatas=metas)
-    _save_store(owner_id, store)
+def _evict_over_budget(keep: Optional[str] = None):
+    """Evict least recently used, unpinned stores until under budget. Caller holds _stores_lock."""
+    total = sum(s.nbytes() for s in _stores.values())
+    for owner_id in list(_stores.keys()):
+        if total <= VECTOR_CACHE_MAX_BYTES:
+            break
+        store = _stores[owner_id]
+        if owner_id == keep or store.pins > 0 or store.dirty > 0:
+            continue
+        del _stores[owner_id]
+        total -= store.nbytes()
+        _cache_stats["evictions"] += 1
+        logger.info("Evicted FAISS store for owner %s from memory (cache bytes now %d)", owner_id, total)
+
+
+def _cache_store(owner_id: str, store: OwnerStore, pin: bool = False) -> OwnerStore:
+    """Insert a freshly loaded/built store. If another thread won the race, its store is kept."""
     with _stores_lock:
+        existing = _stores.get(owner_id)
+        if existing is not None:
+            store = existing
         _stores[owner_id] = store
-    logger.info("Rebuilt FAISS store for owner %s from Mongo (%d chunks)", owner_id, len(texts))
+        _stores.move_to_end(owner_id)
+        if pin:
+            store.pins += 1
+        _evict_over_budget(keep=owner_id)
+    _promote_in_background(owner_id, store)
     return store
 
 
-def _get_or_create_store(owner_id: str, texts: Optional[List[str]] = None, metadatas: Optional[List[Dict]] = None) -> LC_FAISS:
+def _release(store: OwnerStore):
     with _stores_lock:
-        if owner_id in _stores:
-            return _stores[owner_id]
+        store.pins = max(0, store.pins - 1)
 
-    # try load from disk
-    store = _load_store_from_disk(owner_id)
-    if store:
-        with _stores_lock:
-            _stores[owner_id] = store
-        return store
 
-    # create from provided texts
-    if texts:
-        store = LC_FAISS.from_texts(texts=texts, embedding=_EMBEDDINGS, metadatas=metadatas)
-        _save_store(owner_id, store)
+def _pin_cached(owner_id: str) -> Optional[OwnerStore]:
+    """Caller holds _stores_lock."""
+    store = _stores.get(owner_id)
+    if store is not None:
+        _stores.move_to_end(owner_id)
+        store.pins += 1
+    return store
+
+
+def _get_store(owner_id: str, rebuild: bool = True) -> Optional[OwnerStore]:
+    """
+    Return the owner's store pinned (callers must _release it): from the cache,
+    else loaded from disk, else (if rebuild) rebuilt from Mongo. None if unavailable.
+    Loads are serialized per owner so concurrent first requests load it only once.
+    """
+    with _stores_lock:
+        store = _pin_cached(owner_id)
+        if store is not None:
+            _cache_stats["hits"] += 1
+            return store
+        _cache_stats["misses"] += 1
+        entry = _load_locks.setdefault(owner_id, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        with entry[0]:
+            with _stores_lock:
+                store = _pin_cached(owner_id)
+            if store is not None:
+                return store
+
+            store = _load_store_from_disk(owner_id)
+            if store is None and rebuild:
+                try:
+                    store = _rebuild_store_from_mongo(owner_id)
+                except Exception as e:
+                    logger.info("No store could be rebuilt from Mongo for %s: %s", owner_id, e)
+                    store = None
+            if store is None:
+                return None
+            return _cache_store(owner_id, store, pin=True)
+    finally:
         with _stores_lock:
-            _stores[owner_id] = store
-        return store
+            entry[1] -= 1
+            if entry[1] == 0 and _load_locks.get(owner_id) is entry:
+                del _load_locks[owner_id]
+
 
-    # fallback: rebuild from Mongo
+@contextmanager
+def _use_store(owner_id: str, rebuild: bool = True) -> Iterator[Optional[OwnerStore]]:
+    """Pin the owner's store for the duration of the block so it cannot be evicted mid-use."""
+    store = _get_store(owner_id, rebuild=rebuild)
     try:
-        return _rebuild_store_from_mongo(owner_id)
-    except Exception as e:
-        logger.exception("Failed to rebuild store from Mongo for %s: %s", owner_id, e)
-        raise ValueError(f"No store for owner {owner_id} and no texts provided to create one.") from e
+        yield store
+    finally:
+        if store is not None:
+            _release(store)
+
+
+def load_all_stores() -> List[str]:
+    """
+    Warm the cache from disk, most recently written owners first, stopping once the
+    byte budget is full. Only used when VECTOR_PRELOAD is set; otherwise stores load lazily.
+    """
+    loaded = []
+    owner_dirs = [p for p in VECTORS_DIR.iterdir() if p.is_dir() and p.name.startswith("owner_")]
+    owner_dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in owner_dirs:
+        owner_id = p.name[len("owner_") :]
+        try:
+            store = _load_store_from_disk(owner_id)
+            if store:
+                _cache_store(owner_id, store)
+                loaded.append(owner_id)
+                with _stores_lock:
+                    full = sum(s.nbytes() for s in _stores.values()) >= VECTOR_CACHE_MAX_BYTES
+                if full:
+                    break
+        except Exception as e:
+            logger.exception("Error loading store for %s: %s", owner_id, e)
+    logger.info("FAISS stores preloaded for owners: %s", loaded)
+    return loaded
+
 
+def _rebuild_store_from_mongo(owner_id: str) -> OwnerStore:
+    """
+    Recreate FAISS index from Mongo chunks for owner_id, bulk-loading the vectors
+    stored on each chunk instead of re-running the model.
+    """
+    db = get_db()
+    chunks = list(db.chunks.find({"ownerId": owner_id}))
+    texts = [c.get("text", "") for c in chunks]
+    metas = [_chunk_metadata(c) for c in chunks]
+    ids = [c.get("id") or str(uuid.uuid4()) for c in chunks]
+    store = _store_from_vectors(owner_id, texts, _load_chunk_vectors(chunks), metas, ids)
+    # not cached yet, so no lock needed; the persister writes it once cached
+    store.dirty = 1
+    logger.info("Rebuilt FAISS store for owner %s from Mongo (%d chunks)", owner_id, len(texts))
+    return store
 
-def add_texts_to_store(owner_id: str, texts: List[str], metadatas: List[Dict]) -> int:
+
+def add_texts_to_store(
+    owner_id: str,
+    texts: List[str],
+    metadatas: List[Dict],
+    ids: Optional[List[str]] = None,
+    vectors: Optional[np.ndarray] = None,
+) -> int:
+    """
+    Add chunks to the owner's store. ids (normally the Mongo chunk ids) are kept per
+    vector, so the vectors can later be deleted without a rebuild. Pass the vectors
+    from embed_chunks when the caller also persists them; otherwise the texts are
+    embedded here.
+    Returns the number of live vectors after the add.
+    """
     if not texts:
         return 0
-    try:
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in texts]
+    if vectors is None:
+        vectors = embed_chunks(texts)
+    for _ in range(3):
+        store = _get_store(owner_id)
+        if store is None:
+            # first file for this owner: build the store directly from the new vectors
+            built = _store_from_vectors(owner_id, texts, vectors, metadatas, ids)
+            store = _cache_store(owner_id, built, pin=True)
+            if store is built:
+                try:
+                    _mark_dirty(owner_id, store)
+                    return store.live_count
+                finally:
+                    _release(store)
+            # another request created the store meanwhile: add into that one instead
         try:
-            store = _get_or_create_store(owner_id)
-        except ValueError:
-            store = _get_or_create_store(owner_id, texts=texts, metadatas=metadatas)
+            # add to store
             try:
-                count = store.index.ntotal if hasattr(store, "index") else None
-                if count is None and hasattr(store, "docstore"):
-                    count = len(getattr(store.docstore, "_dict", {}))
-                return int(count) if count is not None else len(texts)
-            except Exception:
-                return len(texts)
-
-        # add to store
-        try:
-            if hasattr(store, "add_texts"):
-                store.add_texts(texts=texts, metadatas=metadatas)
-            else:
-                # try add_documents
-                try:
-                    store.add_documents([Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)])
-                except Exception:
-                    # recreate merging existing
-                    existing_texts, existing_metas = [], []
-                    try:
-                        if hasattr(store, "docstore") and hasattr(store.docstore, "_dict"):
-                            for _, v in getattr(store.docstore, "_dict").items():
-                                if isinstance(v, Document):
-                                    existing_texts.append(v.page_content)
-                                    existing_metas.append(v.metadata or {})
-                                elif isinstance(v, dict):
-                                    existing_texts.append(v.get("page_content") or v.get("text") or "")
-                                    existing_metas.append(v.get("metadata") or {})
-                                else:
-                                    existing_texts.append(str(v))
-                                    existing_metas.append({})
-                    except Exception:
-                        logger.exception("Failed to read existing docstore while recreating store.")
-                    combined_texts = existing_texts + texts
-                    combined_metas = existing_metas + metadatas
-                    store = LC_FAISS.from_texts(texts=combined_texts, embedding=_EMBEDDINGS, metadatas=combined_metas)
-            _save_store(owner_id, store)
-        except Exception as e_add:
-            logger.exception("Exception while adding to store for %s: %s. Attempting rebuild.", owner_id, e_add)
-            # rebuild using Mongo + provided texts as last resort
-            db = get_db()
-            existing = list(db.chunks.find({"ownerId": owner_id}))
-            prev_texts = [c.get("text", "") for c in existing]
-            prev_metas = [
-                {"fileId": c.get("fileId"), "ownerId": c.get("ownerId"), "chunkIndex": c.get("chunkIndex"), "originalName": ""}
-                for c in existing
-            ]
-            combined_texts = prev_texts + texts
-            combined_metas = prev_metas + metadatas
-            new_store = LC_FAISS.from_texts(texts=combined_texts, embedding=_EMBEDDINGS, metadatas=combined_metas)
-            _save_store(owner_id, new_store)
+                with store.lock.write():
+                    if store.removed:
+                        # the owner's last file was deleted while we waited; start over
+                        continue
+                    store.add_embeddings(texts=texts, vectors=vectors, metadatas=metadatas, ids=ids)
+                _mark_dirty(owner_id, store)
+                _promote_in_background(owner_id, store)
+            except Exception as e_add:
+                logger.exception("Exception while adding to store for %s: %s. Attempting rebuild.", owner_id, e_add)
+                # rebuild using Mongo (stored vectors) + provided vectors as last resort
+                db = get_db()
+                existing = list(db.chunks.find({"ownerId": owner_id, "id": {"$nin": ids}}))
+                prev_texts = [c.get("text", "") for c in existing]
+                prev_metas = [_chunk_metadata(c) for c in existing]
+                prev_ids = [c.get("id") or str(uuid.uuid4()) for c in existing]
+                prev_vectors = _load_chunk_vectors(existing)
+                combined_vectors = np.vstack([prev_vectors, vectors]) if len(existing) else vectors
+                new_store = _store_from_vectors(
+                    owner_id, prev_texts + texts, combined_vectors, prev_metas + metadatas, prev_ids + ids
+                )
+                with store.lock.write():
+                    store.removed = True
+                _release(store)
+                with _stores_lock:
+                    _stores.pop(owner_id, None)
+                store = _cache_store(owner_id, new_store, pin=True)
+                _mark_dirty(owner_id, store)
+
             with _stores_lock:
-                _stores[owner_id] = new_store
-            store = new_store
+                _evict_over_budget(keep=owner_id)
+            return store.live_count
+        except Exception as e:
+            logger.exception("add_texts_to_store failed for owner %s: %s", owner_id, e)
+            raise
+        finally:
+            _release(store)
+    raise RuntimeError(f"store for owner {owner_id} kept being removed during add")
 
-        # return count
-        try:
-            count = None
-            if hasattr(store, "index") and hasattr(store.index, "ntotal"):
-                count = store.index.ntotal
-            elif hasattr(store, "docstore") and hasattr(store.docstore, "_dict"):
-                count = len(getattr(store.docstore, "_dict", {}))
-            return int(count) if count is not None else len(texts)
-        except Exception:
-            return len(texts)
+
+def search_store(
+    owner_id: str,
+    query: str,
+    top_k: int = 5,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    file_ids: Optional[List[str]] = None,
+    with_text: bool = True,
+) -> List[Tuple[Document, float]]:
+    """
+    Return list of (Document, score), score being the squared L2 distance (lower is closer).
+    ef_search / nprobe override the recall knobs for owners on an HNSW / IVF index.
+    file_ids (None = all files) restricts the search to those files inside the index.
+    with_text=False leaves page_content empty for chunks stored as offsets (see fill_texts).
+    """
+    return search_store_batch(
+        owner_id, [query], top_k=top_k, ef_search=ef_search, nprobe=nprobe, file_ids=file_ids, with_text=with_text
+    )[0]
+
+
+def search_store_batch(
+    owner_id: str,
+    queries: List[str],
+    top_k: int = 5,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    file_ids: Optional[List[str]] = None,
+    with_text: bool = True,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    search_store for many queries against one owner: a single embed_texts call and a
+    single FAISS search over the query matrix. Returns one hit list per query, in order
+    (blank queries get no hits).
+    """
+    results: List[List[Tuple[Document, float]]] = [[] for _ in queries]
+    wanted = [i for i, q in enumerate(queries) if q and q.strip()]
+    if not wanted or (file_ids is not None and not file_ids):
+        return results
+    try:
+        with _use_store(owner_id) as store:
+            if store is None:
+                return results
+            # embed outside the owner's lock; only the FAISS lookup itself needs it.
+            # a lone query goes through the micro-batcher to share encode calls with other requests
+            if len(wanted) == 1:
+                xq = np.asarray(embed_query(queries[wanted[0]]), dtype=np.float32)[None, :]
+            else:
+                xq = embed_chunks([queries[i] for i in wanted])
+            with store.lock.read():
+                positions = store.positions_for_files(file_ids) if file_ids is not None else None
+                hits = store.search(xq, top_k, ef_search=ef_search, nprobe=nprobe, positions=positions)
+                for i, query_hits in zip(wanted, hits):
+                    results[i] = [(store.document(pos), dist) for pos, dist in query_hits]
+        if with_text:
+            fill_texts(owner_id, [doc for hits in results for doc, _ in hits])
     except Exception as e:
-        logger.exception("add_texts_to_store failed for owner %s: %s", owner_id, e)
-        raise
+        logger.exception("search_store_batch failed for owner %s: %s", owner_id, e)
+        return [[] for _ in queries]
+    return results
 
 
-def search_store(owner_id: str, query: str, top_k: int = 5) -> List[Tuple[Document, float]]:
+def fill_texts(owner_id: str, docs: List[Document]):
     """
-    Return list of (Document, score). Robustly fallback to manual FAISS search if needed.
+    The index keeps no text for chunks stored as offsets (see utils/text_store.py):
+    slice their page_content from the file texts, with one chunks lookup for all hits.
     """
+    ids = {(d.metadata or {}).get("chunkId") for d in docs if not d.page_content}
+    ids.discard(None)
+    if not ids:
+        return
     try:
-        with _stores_lock:
-            store = _stores.get(owner_id)
+        records = list(
+            get_db().chunks.find(
+                {"ownerId": owner_id, "id": {"$in": list(ids)}},
+                {"_id": 0, "id": 1, "text": 1, "textId": 1, "start": 1, "end": 1},
+            )
+        )
+    except Exception as e:
+        logger.exception("Failed to fetch chunk texts for %s: %s", owner_id, e)
+        return
+    texts = dict(zip([r.get("id") for r in records], chunk_texts(records)))
+    for d in docs:
+        if not d.page_content:
+            d.page_content = texts.get((d.metadata or {}).get("chunkId"), "")
+
+
+def _delete_from_store(owner_id: str, what: str, delete: Callable[[OwnerStore], int]) -> int:
+    """Tombstone vectors with delete(store) under the write lock; compact or drop the store as needed."""
+    with _use_store(owner_id, rebuild=False) as store:
         if store is None:
-            store = _load_store_from_disk(owner_id)
-            if store:
-                with _stores_lock:
-                    _stores[owner_id] = store
-            else:
-                # try rebuild
-                store = _rebuild_store_from_mongo(owner_id)
+            # nothing persisted for this owner; a later search rebuilds from Mongo
+            logger.info("No FAISS store for %s; nothing to delete for %s", owner_id, what)
+            return 0
 
-        # prefer similarity_search_with_score
         try:
-            if hasattr(store, "similarity_search_with_score"):
-                results = store.similarity_search_with_score(query, k=top_k)
-                out = []
-                for doc, score in results:
-                    try:
-                        s = float(score)
-                    except Exception:
-                        s = score
-                    out.append((doc, s))
-                return out
-        except Exception as e:
-            logger.warning("similarity_search_with_score failed for owner %s: %s", owner_id, e)
-            # fall through to manual faiss search
+            with store.lock.write():
+                removed = delete(store)
+                if store.live_count == 0:
+                    # after this no save (background or not) will touch the directory again
+                    store.removed = True
+                elif removed and store.needs_compaction() and store.compaction_kind() is None:
+                    store.compact()
 
-        # manual faiss search using raw embedding
-        try:
-            emb = _EMBEDDINGS.embed_query(query)
-            xq = np.array([emb], dtype=np.float32)
-            faiss_index = getattr(store, "index", None)
-            if faiss_index is None:
-                return []
-            D, I = faiss_index.search(xq, top_k)
-            # map ids to docs via store.index_to_docstore_id or store.docstore
-            res = []
-            index_to_docstore = getattr(store, "index_to_docstore_id", None)
-            docstore_dict = getattr(getattr(store, "docstore", None), "_dict", None)
-            for dist, idx in zip(D[0], I[0]):
-                if idx == -1:
-                    continue
-                doc_obj = None
-                # Try index_to_docstore mapping first
-                try:
-                    if index_to_docstore:
-                        docstore_id = index_to_docstore[idx]
-                        if docstore_dict and docstore_id in docstore_dict:
-                            v = docstore_dict[docstore_id]
-                            if isinstance(v, Document):
-                                doc = v
-                            elif isinstance(v, dict):
-                                doc = Document(page_content=v.get("page_content") or v.get("text") or "", metadata=v.get("metadata") or {})
-                            else:
-                                doc = Document(page_content=str(v), metadata={})
-                            res.append((doc, float(dist)))
-                            continue
-                except Exception:
-                    logger.exception("Error mapping index_to_docstore_id")
-
-                # fallback: try to fetch metadata from docstore idx position
-                try:
-                    if docstore_dict:
-                        keys = list(docstore_dict.keys())
-                        if idx < len(keys):
-                            v = docstore_dict[keys[idx]]
-                            if isinstance(v, Document):
-                                res.append((v, float(dist)))
-                                continue
-                            elif isinstance(v, dict):
-                                doc = Document(page_content=v.get("page_content") or v.get("text") or "", metadata=v.get("metadata") or {})
-                                res.append((doc, float(dist)))
-                                continue
-                            else:
-                                doc = Document(page_content=str(v), metadata={})
-                                res.append((doc, float(dist)))
-                                continue
-                except Exception:
-                    logger.exception("Error reading docstore dict fallback")
-                # last resort: create Document with empty content and metadata if mapping fails
-                res.append((Document(page_content="", metadata={}), float(dist)))
-            return res
+            if removed and not store.removed and store.needs_compaction():
+                # HNSW/IVF: rebuilt outside the write lock so the owner's searches are not blocked
+                _compact_store(owner_id, store)
+
+            if store.removed:
+                with _stores_lock:
+                    store.dirty = 0
+                    if _stores.get(owner_id) is store:
+                        del _stores[owner_id]
+                _remove_store_dir(owner_id)
+                logger.info("Deleted last vectors of %s -> store removed (%d vectors).", owner_id, removed)
+                return removed
+
+            if removed:
+                _mark_dirty(owner_id, store)
+            logger.info("Removed %d vectors of %s from %s (%d live remaining)", removed, what, owner_id, store.live_count)
+            return removed
         except Exception as e:
-            logger.exception("manual FAISS search failed for owner %s: %s", owner_id, e)
-            return []
-    except Exception as e:
-        logger.exception("search_store failed for owner %s: %s", owner_id, e)
-        return []
+            logger.exception("Failed to update FAISS store for %s after deleting %s: %s", owner_id, what, e)
+            raise
 
 
 def delete_file_from_store(owner_id: str, file_id: str) -> int:
     """
-    Rebuild the owner's store excluding chunks from file_id.
-    Returns number of removed vectors (approx).
+    Remove file_id's vectors from the owner's store by tombstoning their positions.
+    Cost is proportional to the file, not the owner; the index is compacted
+    (remove_ids, no re-embedding) once enough tombstones accumulate.
+    Returns number of removed vectors.
     """
-    db = get_db()
-    current_docs = list(db.chunks.find({"ownerId": owner_id}))
-    remaining = list(db.chunks.find({"ownerId": owner_id, "fileId": {"$ne": file_id}}))
-
-    texts = []
-    metas = []
-    for r in remaining:
-        texts.append(r.get("text", ""))
-        metas.append(
-            {
-                "fileId": r.get("fileId"),
-                "ownerId": r.get("ownerId"),
-                "chunkIndex": r.get("chunkIndex"),
-                "originalName": "",
-            }
-        )
+    return _delete_from_store(owner_id, f"file {file_id}", lambda store: store.delete_file(file_id))
 
-    d = _owner_dir(owner_id)
-    removed = 0
-    try:
-        if not texts:
-            # remove on-disk files
-            if d.exists():
-                for f in d.iterdir():
-                    try:
-                        f.unlink()
-                    except Exception:
-                        pass
-                try:
-                    d.rmdir()
-                except Exception:
-                    pass
-            with _stores_lock:
-                if owner_id in _stores:
-                    del _stores[owner_id]
-            removed = len(current_docs)
-            logger.info("Rebuilt store for %s -> empty (deleted vectors).", owner_id)
-            return removed
 
-        new_store = LC_FAISS.from_texts(texts=texts, embedding=_EMBEDDINGS, metadatas=metas)
-        _save_store(owner_id, new_store)
-        with _stores_lock:
-            _stores[owner_id] = new_store
-        removed = len(current_docs) - len(remaining)
-        logger.info("Rebuilt FAISS store for %s: removed %d vectors, remaining %d", owner_id, removed, len(remaining))
-        return removed
-    except Exception as e:
-        logger.exception("Failed to rebuild FAISS store for %s after deleting file %s: %s", owner_id, file_id, e)
-        raise
+def delete_chunks_from_store(owner_id: str, file_id: str, chunk_ids: List[str]) -> int:
+    """Remove some of file_id's vectors (by chunk id), e.g. chunks that changed on re-ingestion."""
+    if not chunk_ids:
+        return 0
+    return _delete_from_store(
+        owner_id, f"{len(chunk_ids)} chunks of file {file_id}", lambda store: store.delete_chunks(file_id, chunk_ids)
+    )
+
+
+def renumber_chunks_in_store(owner_id: str, file_id: str, chunk_indexes: Dict[str, int]) -> int:
+    """Update the chunkIndex of some of file_id's vectors (chunk id -> index), e.g. after re-ingestion."""
+    if not chunk_indexes:
+        return 0
+    with _use_store(owner_id, rebuild=False) as store:
+        if store is None:
+            return 0
+        with store.lock.write():
+            changed = store.renumber_chunks(file_id, chunk_indexes)
+        if changed:
+            _mark_dirty(owner_id, store)
+        return changed
 
 
 def debug_store_stats(owner_id: str) -> Dict[str, Any]:
@@ -412,145 +1634,100 @@ def debug_store_stats(owner_id: str) -> Dict[str, Any]:
         loaded = owner_id in _stores
         store = _stores.get(owner_id)
     faiss_ntotal = None
-    docstore_count = None
+    row_count = None
     sample = []
-    try:
-        if store is not None:
-            if hasattr(store, "index") and hasattr(store.index, "ntotal"):
-                faiss_ntotal = int(store.index.ntotal)
-            if hasattr(store, "docstore") and hasattr(store.docstore, "_dict"):
-                try:
-                    docstore_count = len(getattr(store.docstore, "_dict", {}))
-                except Exception:
-                    docstore_count = None
-            try:
-                if hasattr(store, "docstore") and hasattr(store.docstore, "_dict"):
-                    for i, (_, v) in enumerate(getattr(store.docstore, "_dict").items()):
-                        if i >= 3:
-                            break
-                        if isinstance(v, Document):
-                            sample.append({"text": v.page_content, "metadata": v.metadata})
-                        elif isinstance(v, dict):
-                            sample.append({"text": v.get("page_content") or v.get("text"), "metadata": v.get("metadata")})
-                        else:
-                            sample.append({"text": str(v)})
-            except Exception:
-                pass
-    except Exception:
-        logger.exception("debug_store_stats failed for %s", owner_id)
+    lock = store.lock.read() if store is not None else nullcontext()
+    with lock:
+        try:
+            if store is not None:
+                faiss_ntotal = store.ntotal
+                row_count = len(store.ids)
+                for pos in range(store.ntotal):
+                    if len(sample) >= 3:
+                        break
+                    if pos in store.tombstones:
+                        continue
+                    sample.append(store.document(pos))
+        except Exception:
+            logger.exception("debug_store_stats failed for %s", owner_id)
+    fill_texts(owner_id, sample)
+    sample = [{"text": doc.page_content, "metadata": doc.metadata} for doc in sample]
     return {
         "owner_id": owner_id,
         "is_loaded": bool(loaded),
         "on_disk_exists": bool(on_disk),
         "faiss_ntotal": faiss_ntotal,
-        "docstore_count": docstore_count,
+        "docstore_count": row_count,
+        "tombstones": len(store.tombstones) if store is not None else 0,
+        "index_mapped": bool(store.index_mapped) if store is not None else False,
+        "index_kind": store.kind if store is not None else None,
+        "quantization": store.quantization if store is not None else None,
         "sample": sample,
     }
 
 
 def debug_search_owner(owner_id: str, query: str, top_k: int = 6) -> Dict[str, Any]:
     """
-    Detailed search diagnostic. Returns steps, embedding length, manual-faiss mapping etc.
+    Detailed search diagnostic. Returns steps, embedding length, raw FAISS hits mapped back to chunks.
     """
     debug: Dict[str, Any] = {"owner_id": owner_id, "query": query, "top_k": top_k, "steps": []}
 
     with _stores_lock:
-        store = _stores.get(owner_id)
-    if store is None:
+        cached = owner_id in _stores
+    if not cached:
         step = {"action": "load_from_disk_or_rebuild", "result": None}
         debug["steps"].append(step)
-        store = _load_store_from_disk(owner_id)
-        if store:
-            with _stores_lock:
-                _stores[owner_id] = store
-            step["result"] = "loaded_from_disk"
-        else:
-            try:
-                store = _rebuild_store_from_mongo(owner_id)
+        on_disk = _current_store_dir(owner_id) is not None
+        try:
+            store = _get_store(owner_id, rebuild=False)
+            if store is None:
+                store = _cache_store(owner_id, _rebuild_store_from_mongo(owner_id), pin=True)
                 step["result"] = "rebuilt_from_mongo"
-            except Exception as e:
-                step["result"] = "failed_rebuild"
-                step["error"] = str(e)
-                debug["store_present"] = False
-                return debug
-
-    debug["store_present"] = True
+            else:
+                step["result"] = "loaded_from_disk" if on_disk else "loaded"
+        except Exception as e:
+            step["result"] = "failed_rebuild"
+            step["error"] = str(e)
+            debug["store_present"] = False
+            return debug
+    else:
+        store = _get_store(owner_id, rebuild=False)
+        if store is None:
+            debug["store_present"] = False
+            return debug
 
-    # embed query
     try:
-        q_emb = _EMBEDDINGS.embed_query(query)
-        debug["embedding_len"] = len(q_emb)
-        debug["steps"].append({"action": "embed_query", "result": "ok"})
-    except Exception as e:
-        debug["steps"].append({"action": "embed_query", "result": "error", "error": str(e)})
-        return debug
+        debug["store_present"] = True
+        debug["tombstones"] = len(store.tombstones)
 
-    # try similarity_search_with_score
-    try:
-        if hasattr(store, "similarity_search_with_score"):
-            res = store.similarity_search_with_score(query, k=top_k)
-            debug["steps"].append({"action": "similarity_search_with_score", "count": len(res)})
-            serial = []
-            for doc, score in res:
-                serial.append({"text": getattr(doc, "page_content", None), "score": float(score)})
-            debug["similarity_search_with_score"] = serial
-            if res:
-                return debug
-    except Exception as e:
-        debug["steps"].append({"action": "similarity_search_with_score", "error": str(e)})
+        # embed query
+        try:
+            q_emb = _EMBEDDINGS.embed_query(query)
+            debug["embedding_len"] = len(q_emb)
+            debug["steps"].append({"action": "embed_query", "result": "ok"})
+        except Exception as e:
+            debug["steps"].append({"action": "embed_query", "result": "error", "error": str(e)})
+            return debug
 
-    # manual FAISS search
-    try:
-        if hasattr(store, "index") and getattr(store.index, "ntotal", 0) > 0:
-            xq = np.array([q_emb], dtype=np.float32)
-            faiss_index = getattr(store, "index", None)
-            D, I = faiss_index.search(xq, top_k)
-            D = D.tolist() if hasattr(D, "tolist") else D
-            I = I.tolist() if hasattr(I, "tolist") else I
-            debug["steps"].append({"action": "manual_faiss_search", "distances": D, "ids": I})
-            # mapping ids back to docs
-            mapped = []
-            index_to_docstore = getattr(store, "index_to_docstore_id", None)
-            docstore_dict = getattr(getattr(store, "docstore", None), "_dict", None)
-            for dist, idx in zip(D[0], I[0]):
-                if idx == -1:
-                    mapped.append({"id": None, "distance": float(dist), "doc": None})
-                    continue
-                doc_obj = None
-                doc_meta = None
-                try:
-                    if index_to_docstore:
-                        docstore_id = index_to_docstore[idx]
-                        if docstore_dict and docstore_id in docstore_dict:
-                            v = docstore_dict[docstore_id]
-                            if isinstance(v, Document):
-                                doc_obj = v.page_content
-                                doc_meta = v.metadata
-                            elif isinstance(v, dict):
-                                doc_obj = v.get("page_content") or v.get("text")
-                                doc_meta = v.get("metadata")
-                            else:
-                                doc_obj = str(v)
-                    else:
-                        if docstore_dict:
-                            keys = list(docstore_dict.keys())
-                            if idx < len(keys):
-                                v = docstore_dict[keys[idx]]
-                                if isinstance(v, Document):
-                                    doc_obj = v.page_content
-                                    doc_meta = v.metadata
-                                elif isinstance(v, dict):
-                                    doc_obj = v.get("page_content") or v.get("text")
-                                    doc_meta = v.get("metadata")
-                                else:
-                                    doc_obj = str(v)
-                except Exception:
-                    logger.exception("Error mapping faiss idx -> docstore")
-                mapped.append({"id": idx, "distance": float(dist), "doc": doc_obj, "meta": doc_meta})
+        # raw FAISS search, mapping positions back to chunks
+        try:
+            with store.lock.read():
+                hits = store.search(np.array([q_emb], dtype=np.float32), top_k)[0]
+                debug["steps"].append(
+                    {"action": "faiss_search", "distances": [d for _, d in hits], "ids": [p for p, _ in hits]}
+                )
+                docs = [store.document(pos) for pos, _ in hits]
+            fill_texts(owner_id, docs)
+            mapped = [
+                {"id": pos, "distance": dist, "doc": doc.page_content, "meta": doc.metadata}
+                for (pos, dist), doc in zip(hits, docs)
+            ]
             debug["manual_faiss_map"] = mapped
+            if not mapped:
+                debug["steps"].append({"action": "no_results", "result": True})
             return debug
-    except Exception as e:
-        debug["steps"].append({"action": "manual_faiss_search", "error": str(e)})
-
-    debug["steps"].append({"action": "no_results", "result": True})
-    return debug
+        except Exception as e:
+            debug["steps"].append({"action": "faiss_search", "error": str(e)})
+        return debug
+    finally:
+        _release(store)